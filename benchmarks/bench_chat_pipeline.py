@@ -0,0 +1,172 @@
+"""
+RAGChatSystem.process_chat_query のステージ別レイテンシを計測するベンチマーク。
+
+Gemini APIの代わりに LocalStubProvider を使うため、APIキーなしでオフライン実行できる。
+リポジトリのルートで実行する:
+    uv run python -m benchmarks.bench_chat_pipeline
+    uv run python -m benchmarks.bench_chat_pipeline --embed-latency 0.15 --generate-latency 1.2 --repeat 5
+    uv run python -m benchmarks.bench_chat_pipeline --mode async   # process_chat_query_async を計測
+    uv run python -m benchmarks.bench_chat_pipeline --mode stream  # stream_chat_query を計測 (first_token も集計)
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+
+from web_search.context_assembler import ContextAssembler
+from web_search.model_providers import LocalStubProvider
+from web_search.rag_chat_core import RAGChatSystem
+from web_search.tracing import Tracer
+
+# (質問, キーワード抽出LLMが返すことを想定した応答)
+# 応答は --llm-keywords 指定時に、ローカル辞書で見出し語が見つからなかった質問にだけ使われる
+DEFAULT_QUERIES = [
+    ("学費はいくらですか？", "学費,費用"),
+    ("スクーリングの受講料について教えてください。", "スクーリング,受講料,費用"),
+    ("履修登録の期間はいつまでですか？", "履修登録,期間"),
+    ("GPAの計算方法は？", "GPA,成績"),
+    ("卒業制作の提出方法を知りたい", ""),
+    ("学割証明書はどこで発行できますか？", ""),
+]
+
+# 計測対象のステージ (RAGChatSystemのトレースのspan名)
+STAGES = [
+    "keyword_extraction",
+    "lexical_search",
+    "embedding",
+    "faiss_search",
+    "rank_fusion",
+    "document_lookup",
+    "context_assembly",
+    "cache_embedding",
+    "generation",
+]
+
+
+class MemoryTracer(Tracer):
+    """トレースをファイルに書かず、メモリ上に集めるTracer"""
+
+    def __init__(self):
+        super().__init__(enabled=False, dump_context=False)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def load_queries(path):
+    """JSONファイル ([{"query": ..., "keywords": ...}, ...]) から質問セットを読み込む"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(item['query'], item.get('keywords', '')) for item in json.load(f)]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    p95_index = max(0, int(round(len(samples) * 0.95)) - 1)
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': statistics.median(samples) * 1000,
+        'p95_ms': samples[p95_index] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def print_report(report):
+    print(f"{'stage':<20}{'count':>7}{'mean_ms':>11}{'p50_ms':>11}{'p95_ms':>11}{'max_ms':>11}")
+    for stage, stats in report.items():
+        print(
+            f"{stage:<20}{stats['count']:>7}{stats['mean_ms']:>11.2f}{stats['p50_ms']:>11.2f}"
+            f"{stats['p95_ms']:>11.2f}{stats['max_ms']:>11.2f}"
+        )
+
+
+def run_query(system, query, mode):
+    # sessionを渡さないので、毎回過去の情報源を引き継がない新しい会話として処理される
+    if mode == 'async':
+        asyncio.run(system.process_chat_query_async(query, chat_history=[]))
+    elif mode == 'stream':
+        for _ in system.stream_chat_query(query, chat_history=[]):
+            pass
+    else:
+        system.process_chat_query(query, chat_history=[])
+
+
+def run_benchmark(queries, repeat=3, embed_latency=0.0, generate_latency=0.0, verbose=False, mode='sync',
+                  answer_cache=False, llm_keywords=False, context_budget=None):
+    """質問セットを repeat 回処理し、ステージ別のレイテンシ統計を返す"""
+    responses = {f"質問: {query}\n出力:": keywords for query, keywords in queries}
+    provider = LocalStubProvider(embed_latency=embed_latency, generate_latency=generate_latency, responses=responses)
+
+    # RAGChatSystem内のデバッグ出力は計測のノイズになるため、verbose指定時以外は捨てる
+    log_sink = None if verbose else io.StringIO()
+    with contextlib.redirect_stdout(log_sink) if log_sink else contextlib.nullcontext():
+        # トレースはファイルに書き出さず、メモリ上で集計する
+        tracer = MemoryTracer()
+        # 回答キャッシュは繰り返し実行で必ずヒットしてしまうため、指定時以外は無効にする
+        context_assembler = ContextAssembler(budget_tokens=context_budget) if context_budget else None
+        system = RAGChatSystem(provider=provider, tracer=tracer, answer_cache=None if answer_cache else False,
+                               keyword_llm_fallback=llm_keywords, context_assembler=context_assembler)
+
+    for _ in range(repeat):
+        for query, _keywords in queries:
+            with contextlib.redirect_stdout(log_sink) if log_sink else contextlib.nullcontext():
+                run_query(system, query, mode)
+            if log_sink:
+                log_sink.seek(0)
+                log_sink.truncate()
+
+    timings = {}
+    for record in tracer.records:
+        for span in record['spans']:
+            # 非同期版でキャンセルされた投機的な検索は集計しない
+            if span.get('error'):
+                continue
+            timings.setdefault(span['name'], []).append(span['duration_ms'] / 1000)
+        if 'first_token_ms' in record:
+            timings.setdefault('first_token', []).append(record['first_token_ms'] / 1000)
+        timings.setdefault('total', []).append(record['duration_ms'] / 1000)
+
+    ordered_stages = STAGES + ['first_token', 'total']
+    return {stage: summarize(timings[stage]) for stage in ordered_stages if stage in timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="process_chat_query のステージ別レイテンシベンチマーク")
+    parser.add_argument("--queries", type=str, default=None, help="質問セットのJSONファイル (省略時は組み込みの質問セット)")
+    parser.add_argument("--repeat", type=int, default=3, help="質問セットを繰り返す回数")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Embedding呼び出し1回あたりの擬似レイテンシ (秒)")
+    parser.add_argument("--generate-latency", type=float, default=0.0, help="生成呼び出し1回あたりの擬似レイテンシ (秒)")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--verbose", action="store_true", help="RAGChatSystemのデバッグ出力を表示する")
+    parser.add_argument("--answer-cache", action="store_true", help="回答キャッシュを有効にして計測する")
+    parser.add_argument("--llm-keywords", action="store_true", help="ローカル辞書で一致しない場合のLLMキーワード抽出を有効にする")
+    parser.add_argument("--context-budget", type=int, default=None, help="コンテキストのトークン数の上限 (省略時は既定値)")
+    parser.add_argument("--mode", choices=["sync", "async", "stream"], default="sync",
+                        help="計測するAPI (process_chat_query / process_chat_query_async / stream_chat_query)")
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries) if args.queries else DEFAULT_QUERIES
+    report = run_benchmark(
+        queries,
+        repeat=args.repeat,
+        embed_latency=args.embed_latency,
+        generate_latency=args.generate_latency,
+        verbose=args.verbose,
+        mode=args.mode,
+        answer_cache=args.answer_cache,
+        llm_keywords=args.llm_keywords,
+        context_budget=args.context_budget,
+    )
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{len(queries)} queries x {args.repeat} runs ({args.mode})")
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+チャンクのメタデータの読み込み時間・常駐メモリ量・アクセス時間を、metadata.json (辞書のリスト) と
+列形式のチャンクストア (web_search/chunk_store.py) で比較するベンチマーク。
+
+data/vector_store の今の版の metadata.json を使うため、APIキーなしでオフライン実行できる。
+リポジトリのルートで実行する:
+    uv run python -m benchmarks.bench_chunk_store
+    uv run python -m benchmarks.bench_chunk_store --scale 20   # チャンクを20倍に水増しして大きなコーパスを模擬する
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from web_search.chunk_store import ChunkStore
+from web_search.rag_chat_core import VECTOR_STORE_DIR
+from web_search.vector_store import METADATA_FILE, current_vector_store_dir
+
+
+def make_records(records, scale):
+    """ページのURLを変えてチャンクを scale 倍に水増しする (ページ数もscale倍になる)"""
+    if scale <= 1:
+        return records
+    scaled = list(records)
+    for copy in range(1, scale):
+        scaled.extend(dict(record, source=f"{record['source']}?copy={copy}") for record in records)
+    return scaled
+
+
+def measure_load(load):
+    """ロードにかかった時間と、ロード後も残っているPythonのメモリ量 (tracemalloc) を測る"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = load()
+    seconds = time.perf_counter() - start
+    retained_bytes, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, seconds, retained_bytes
+
+
+def measure_access(chunks, chunk_ids):
+    """rag_chat_core と同じく、ヒットしたチャンクの情報源URL・見出し・位置を引く時間"""
+    start = time.perf_counter()
+    for chunk_id in chunk_ids:
+        chunk = chunks[chunk_id]
+        if isinstance(chunk, dict):
+            chunk['source'], tuple(chunk['headings']), chunk.get('offset')
+        else:
+            chunk.source, chunk.headings, chunk.offset
+    return (time.perf_counter() - start) / len(chunk_ids)
+
+
+def run_benchmark(scale=1, accesses=10000, seed=0):
+    with open(os.path.join(current_vector_store_dir(VECTOR_STORE_DIR), METADATA_FILE), 'r', encoding='utf-8') as f:
+        records = make_records(json.load(f), scale)
+    chunk_ids = [random.Random(seed).randrange(len(records)) for _ in range(accesses)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, 'metadata.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+        store_dir = os.path.join(directory, 'chunks')
+        ChunkStore.write(records, store_dir)
+        del records
+
+        def load_json():
+            with open(json_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        report = {}
+        for name, load, files in (
+            ('json', load_json, [json_path]),
+            ('chunk_store', lambda: ChunkStore.load(store_dir), [os.path.join(store_dir, name) for name in os.listdir(store_dir)]),
+        ):
+            chunks, load_seconds, retained_bytes = measure_load(load)
+            report[name] = {
+                'chunks': len(chunks),
+                'load_ms': load_seconds * 1000,
+                'retained_mb': retained_bytes / (1024 * 1024),
+                'file_mb': sum(os.path.getsize(path) for path in files) / (1024 * 1024),
+                'access_us': measure_access(chunks, chunk_ids) * 1e6,
+            }
+            if isinstance(chunks, ChunkStore):
+                chunks.close()
+            del chunks
+    return report
+
+
+def print_report(report):
+    print(f"{'format':<13}{'chunks':>9}{'load_ms':>10}{'retained_mb':>13}{'file_mb':>10}{'access_us':>11}")
+    for name, stats in report.items():
+        print(
+            f"{name:<13}{stats['chunks']:>9}{stats['load_ms']:>10.2f}{stats['retained_mb']:>13.2f}"
+            f"{stats['file_mb']:>10.2f}{stats['access_us']:>11.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="metadata.json とチャンクストアの読み込み時間/メモリ量のベンチマーク")
+    parser.add_argument("--scale", type=int, default=1, help="チャンクを何倍に水増しするか")
+    parser.add_argument("--accesses", type=int, default=10000, help="アクセス時間を測るチャンク数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    report = run_benchmark(scale=args.scale, accesses=args.accesses, seed=args.seed)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
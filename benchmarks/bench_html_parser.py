@@ -0,0 +1,197 @@
+"""
+スクレイパーのHTML解析を、バックエンド (bs4: BeautifulSoup + html.parser、lxml: make_database/lxml_parser.py) ごとに比較するベンチマーク。
+
+benchmarks/fixtures/html/ に保存したページ (在学生向けページ・シラバスの検索結果と詳細ページ) を解析するため、
+ネットワークなしでオフライン実行できる。保存したページは、サイトに接続できない環境でも再現できるよう、
+data/scraped_data_student_menu と data/all_syllabus_with_overview.csv の内容から元のサイトと同じ構造で組み立てたもの。
+
+--check では、各バックエンドの parse_element_to_structured_data・parse_table・_extract_data_from_search_page・
+概要の抽出の結果を、bs4 で作った正解 (golden.json) と比べ、違いがあれば終了コード1で終わる
+(同じ比較を tests/test_html_parser_parity.py がページごとのテストとして行う)。
+解析の処理を変えて正解が変わる場合は --update-golden で作り直す。
+リポジトリのルートで実行する:
+    uv run python -m benchmarks.bench_html_parser
+    uv run python -m benchmarks.bench_html_parser --check
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+if __package__ in (None, ''): # python benchmarks/bench_html_parser.py のようにファイルとして実行された場合
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_chat_pipeline import summarize
+from make_database import lxml_parser, syllabus_scraper, web_scraper
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'html')
+GOLDEN_PATH = os.path.join(FIXTURES_DIR, 'golden.json')
+# 保存したページのURL (リンクの絶対URLを作るときの基準)
+STUDENT_MENU_BASE_URL = "https://cc.musabi.ac.jp/campus-2nd/"
+SYLLABUS_DETAIL_BASE_URL = "https://ccap02.musabi.ac.jp/syllabus/html/"
+
+
+def use_fixture_urls():
+    """検索結果の詳細URLはスクレイパーの実行時に --base-url から決まるため、保存したページの元のURLを使う"""
+    syllabus_scraper.SYLLABUS_DETAIL_BASE_URL = SYLLABUS_DETAIL_BASE_URL
+
+
+def load_golden():
+    with open(GOLDEN_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_fixtures():
+    """{種類: [(名前, HTMLのバイト列)]}"""
+    fixtures = {}
+    for kind, pattern in (
+        ('student_menu', 'student_menu/*.html'),
+        ('search_page', 'syllabus/search_page_*.html'),
+        ('detail_page', 'syllabus/detail_*.html'),
+    ):
+        fixtures[kind] = []
+        for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, pattern))):
+            with open(path, 'rb') as f:
+                fixtures[kind].append((os.path.relpath(path, FIXTURES_DIR), f.read()))
+    return fixtures
+
+
+def student_menu_url(name):
+    return STUDENT_MENU_BASE_URL + os.path.splitext(os.path.basename(name))[0]
+
+
+def parse_fixture(kind, name, html, backend):
+    """スクレイパーと同じ経路で1ページを解析する (ベンチマークで時間を測る処理)"""
+    if kind == 'student_menu':
+        return web_scraper.parse_page(student_menu_url(name), html, backend=backend)
+    if kind == 'search_page':
+        return syllabus_scraper.parse_search_page(html.decode('utf-8'), backend=backend)
+    return syllabus_scraper.extract_overview(html.decode('utf-8'), backend=backend)
+
+
+def structured_outputs(kind, name, html, backend):
+    """
+    バックエンドの一致を確かめる出力。ページ全体の結果に加えて、文書中の全ての表の parse_table と、
+    取り除く要素を残したままの<body>の parse_element_to_structured_data も比べる。
+    """
+    outputs = {'page': parse_fixture(kind, name, html, backend)}
+    if kind != 'student_menu':
+        return outputs
+    url = student_menu_url(name)
+    if backend == 'lxml':
+        root = lxml_parser.parse_document(html)
+        outputs['tables'] = [lxml_parser.parse_table(table) for table in root.iter('table')]
+        outputs['body'] = lxml_parser.parse_element_to_structured_data(next(root.iter('body')), url)
+    else:
+        soup = BeautifulSoup(html, 'html.parser')
+        outputs['tables'] = [web_scraper.parse_table(table) for table in soup.find_all('table')]
+        outputs['body'] = web_scraper.parse_element_to_structured_data(soup.find('body'), url)
+    return outputs
+
+
+def normalize(value):
+    """タプルとリストの違いを無くしてJSONと比べられる形にする"""
+    return json.loads(json.dumps(value, ensure_ascii=False))
+
+
+def collect_outputs(fixtures, backend):
+    with contextlib.redirect_stdout(io.StringIO()): # シラバスの解析のデバッグ出力を抑える
+        return {
+            name: normalize(structured_outputs(kind, name, html, backend))
+            for kind, pages in fixtures.items() for name, html in pages
+        }
+
+
+def check_parity(fixtures, backends):
+    """各バックエンドの出力を正解と比べ、違いのあったページ名のリストを {バックエンド: [...]} で返す"""
+    golden = load_golden()
+    mismatches = {}
+    for backend in backends:
+        outputs = collect_outputs(fixtures, backend)
+        mismatches[backend] = [
+            f"{name}:{part}"
+            for name in sorted(set(golden) | set(outputs))
+            for part in sorted(set(golden.get(name, {})) | set(outputs.get(name, {})))
+            if golden.get(name, {}).get(part) != outputs.get(name, {}).get(part)
+        ]
+    return mismatches
+
+
+def run_benchmark(fixtures, backends, repeat=5):
+    """種類ごとに、1ページの解析時間 (全ページを repeat 回解析した分布) を測る"""
+    report = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for backend in backends:
+            report[backend] = {}
+            for kind, pages in fixtures.items():
+                samples = []
+                for _ in range(repeat):
+                    for name, html in pages:
+                        start = time.perf_counter()
+                        parse_fixture(kind, name, html, backend)
+                        samples.append(time.perf_counter() - start)
+                stats = summarize(samples)
+                stats['pages_per_second'] = len(samples) / sum(samples)
+                report[backend][kind] = stats
+    return report
+
+
+def print_report(report):
+    print(f"{'backend':<9}{'fixture':<14}{'pages':>7}{'mean_ms':>10}{'p50_ms':>10}{'p95_ms':>10}{'pages/s':>10}{'speedup':>9}")
+    baseline = report.get('bs4', {})
+    for backend, kinds in report.items():
+        for kind, stats in kinds.items():
+            speedup = baseline[kind]['mean_ms'] / stats['mean_ms'] if kind in baseline else float('nan')
+            print(
+                f"{backend:<9}{kind:<14}{stats['count']:>7}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}"
+                f"{stats['p95_ms']:>10.3f}{stats['pages_per_second']:>10.1f}{speedup:>8.2f}x"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="スクレイパーのHTML解析のバックエンドごとの一致と速度のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="全ページを解析する回数")
+    parser.add_argument("--check", action="store_true", help="各バックエンドの出力が正解と一致するかだけを確かめる")
+    parser.add_argument("--update-golden", action="store_true", help="bs4 の出力で正解 (golden.json) を作り直す")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    use_fixture_urls()
+    backends = [backend for backend in lxml_parser.PARSER_BACKENDS if backend != 'lxml' or lxml_parser.LXML_AVAILABLE]
+    if len(backends) < len(lxml_parser.PARSER_BACKENDS):
+        print("WARNING: lxml is not installed. Only the 'bs4' backend is measured.", file=sys.stderr)
+    fixtures = load_fixtures()
+
+    if args.update_golden:
+        outputs = collect_outputs(fixtures, 'bs4')
+        # 差分を見やすくするため、1ページを1行に書く
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            f.write("{\n" + ",\n".join(
+                f"{json.dumps(name, ensure_ascii=False)}: {json.dumps(outputs[name], ensure_ascii=False)}" for name in outputs
+            ) + "\n}\n")
+        print(f"Wrote {GOLDEN_PATH}")
+        return
+
+    mismatches = check_parity(fixtures, backends)
+    for backend, names in mismatches.items():
+        status = "OK" if not names else f"{len(names)} mismatches: {', '.join(names)}"
+        print(f"parity {backend}: {status}", file=sys.stderr)
+    if args.check:
+        sys.exit(1 if any(mismatches.values()) else 0)
+
+    report = run_benchmark(fixtures, backends, repeat=args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{sum(len(pages) for pages in fixtures.values())} fixture pages x {args.repeat} runs")
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
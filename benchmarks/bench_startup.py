@@ -0,0 +1,89 @@
+"""
+RAGChatSystem の起動時間 (モジュールの読み込み・インスタンスの作成・最初のクエリまで) を、
+通常の起動と高速起動モード (fast_start) で比較するベンチマーク。
+
+コンテナのコールドスタートやStreamlitのワーカー再起動を模擬するため、計測ごとに新しいPythonプロセスを起動する。
+Gemini APIの代わりに LocalStubProvider を使うため、APIキーなしでオフライン実行できる。
+OSのページキャッシュは消さないため、ディスクから読む時間は含まない (ファイルがキャッシュにある状態の計測)。
+リポジトリのルートで実行する:
+    uv run python -m benchmarks.bench_startup
+    uv run python -m benchmarks.bench_startup --repeat 10 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# 子プロセスで実行するスクリプト。各段階の所要時間 (秒) をJSONで標準出力の最終行に書く
+CHILD_SCRIPT = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+    from web_search.rag_chat_core import RAGChatSystem
+    imported = time.perf_counter()
+    # インポートしただけで読み込まれている重いモジュール
+    heavy_modules = [name for name in ('faiss', 'google.generativeai') if name in sys.modules]
+    from web_search.model_providers import LocalStubProvider
+    system = RAGChatSystem(provider=LocalStubProvider(), answer_cache=False, fast_start={fast_start})
+    constructed = time.perf_counter()
+    system.process_chat_query("学費はいくらですか？", chat_history=[])
+    answered = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - start,
+    'construct_s': constructed - imported,
+    'first_query_s': answered - constructed,
+    'ready_s': answered - start,
+    'heavy_modules_after_import': heavy_modules,
+}}))
+"""
+
+STAGES = ('import_s', 'construct_s', 'first_query_s', 'ready_s')
+
+
+def run_child(fast_start):
+    script = CHILD_SCRIPT.format(fast_start=fast_start)
+    env = dict(os.environ, RAG_TRACE_ENABLED='0')
+    result = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_benchmark(repeat=5):
+    report = {}
+    for name, fast_start in (('default', False), ('fast_start', True)):
+        runs = [run_child(fast_start) for _ in range(repeat)]
+        report[name] = {stage: statistics.median(run[stage] for run in runs) * 1000 for stage in STAGES}
+        report[name]['heavy_modules_after_import'] = runs[-1]['heavy_modules_after_import']
+    return report
+
+
+def print_report(report):
+    print(f"{'mode':<12}{'import_ms':>11}{'construct_ms':>14}{'first_query_ms':>16}{'ready_ms':>10}  heavy modules after import")
+    for name, stats in report.items():
+        print(
+            f"{name:<12}{stats['import_s']:>11.1f}{stats['construct_s']:>14.1f}{stats['first_query_s']:>16.1f}"
+            f"{stats['ready_s']:>10.1f}  {', '.join(stats['heavy_modules_after_import']) or '-'}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAGChatSystemの起動時間のベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="モードごとにプロセスを起動する回数 (中央値を表示)")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    report = run_benchmark(repeat=args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"median of {args.repeat} runs (ms)")
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
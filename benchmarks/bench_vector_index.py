@@ -0,0 +1,145 @@
+"""
+FAISSインデックスの種類ごとに、recall@k (IndexFlatL2の結果に対する再現率)・検索レイテンシ・メモリ量を比較するベンチマーク。
+sq8/pq は、量子化したベクトルだけのもの (既定) と、元のベクトルで並べ直す層を重ねたもの (+refine) の両方を計測する。
+
+data/vector_store のベクトルを使うため、APIキーなしでオフライン実行できる。
+リポジトリのルートで実行する:
+    uv run python -m benchmarks.bench_vector_index
+    uv run python -m benchmarks.bench_vector_index --scale 20 --k 10   # ベクトルを20倍に水増しして大きなコーパスを模擬する
+"""
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from benchmarks.bench_chat_pipeline import summarize
+from web_search.rag_chat_core import VECTOR_STORE_DIR
+from web_search.vector_index import INDEX_TYPES, build_index, load_index
+
+# 並べ直しの層 (IndexRefineFlat) を付けられる種類
+REFINABLE_INDEX_TYPES = ('sq8', 'pq')
+from web_search.vector_store import FAISS_INDEX_FILE, current_vector_store_dir
+
+# 水増し・クエリ生成時に加えるノイズの標準偏差 (正規化済みベクトルの各次元に対して)
+NOISE_SCALE = 0.01
+
+
+def load_vectors(index_path=None):
+    """保存済みのインデックス (省略時は今の版) から元のベクトルを取り出す"""
+    index_path = index_path or os.path.join(current_vector_store_dir(VECTOR_STORE_DIR), FAISS_INDEX_FILE)
+    index, _config = load_index(index_path)
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError as e:
+        raise SystemExit(f"Cannot reconstruct vectors from {index_path} ({e}). Rebuild it with --index-type flat.")
+
+
+def perturb(vectors, rng, copies=1):
+    """ベクトルにノイズを加えて正規化したものを copies 個ずつ作る"""
+    repeated = np.repeat(vectors, copies, axis=0)
+    noisy = repeated + rng.normal(scale=NOISE_SCALE, size=repeated.shape).astype('float32')
+    return (noisy / np.linalg.norm(noisy, axis=1, keepdims=True)).astype('float32')
+
+
+def make_corpus(vectors, scale, rng):
+    if scale <= 1:
+        return np.ascontiguousarray(vectors, dtype='float32')
+    return np.vstack([vectors, perturb(vectors, rng, copies=scale - 1)])
+
+
+def index_memory_bytes(index):
+    """シリアライズしたサイズをメモリ使用量の目安にする"""
+    return int(faiss.serialize_index(index).size)
+
+
+def recall_at_k(corpus, queries, results, kth_distances, k):
+    """
+    flatのk番目の距離以内に入っている結果の割合。
+    同じ本文のチャンクなど距離が同じベクトルがあるため、IDの一致ではなく正確な距離で判定する。
+    """
+    hits = 0
+    for query, found, kth_distance in zip(queries, results, kth_distances):
+        found = found[found >= 0]
+        distances = np.sum((corpus[found] - query) ** 2, axis=1)
+        hits += int(np.sum(distances <= kth_distance * (1 + 1e-5) + 1e-6))
+    return hits / (len(queries) * k)
+
+
+def index_variants(index_types):
+    """(表示名, インデックスの種類, build_index のオプション)。sq8/pq は並べ直しの有無の両方"""
+    for index_type in index_types:
+        yield index_type, index_type, {}
+        if index_type in REFINABLE_INDEX_TYPES:
+            yield f"{index_type}+refine", index_type, {'refine': True}
+
+
+def run_benchmark(index_types=INDEX_TYPES, k=5, num_queries=200, scale=1, seed=0):
+    rng = np.random.default_rng(seed)
+    corpus = make_corpus(load_vectors(), scale, rng)
+    queries = perturb(corpus[rng.choice(len(corpus), size=num_queries, replace=True)], rng)
+
+    # 正解はIndexFlatL2 (総当たり) でのk番目の距離
+    flat_index, _config = build_index(corpus, 'flat')
+    flat_distances, _indices = flat_index.search(queries, k)
+    kth_distances = flat_distances[:, -1]
+
+    report = {}
+    for name, index_type, options in index_variants(index_types):
+        build_start = time.perf_counter()
+        index, config = build_index(corpus, index_type, **options)
+        build_seconds = time.perf_counter() - build_start
+
+        latencies = []
+        results = []
+        for query in queries:
+            start = time.perf_counter()
+            _distances, indices = index.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+            results.append(indices[0])
+
+        stats = summarize(latencies)
+        memory_bytes = index_memory_bytes(index)
+        report[name] = {
+            'recall_at_k': recall_at_k(corpus, queries, results, kth_distances, k),
+            'mean_ms': stats['mean_ms'],
+            'p95_ms': stats['p95_ms'],
+            'build_s': build_seconds,
+            'memory_mb': memory_bytes / (1024 * 1024),
+            'bytes_per_vector': memory_bytes / len(corpus),
+            'config': config,
+        }
+    return len(corpus), report
+
+
+def print_report(report, k):
+    print(f"{'index':<12}{f'recall@{k}':>11}{'mean_ms':>10}{'p95_ms':>10}{'build_s':>10}{'memory_mb':>11}{'B/vector':>10}")
+    for name, stats in report.items():
+        print(
+            f"{name:<12}{stats['recall_at_k']:>11.3f}{stats['mean_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+            f"{stats['build_s']:>10.2f}{stats['memory_mb']:>11.2f}{stats['bytes_per_vector']:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISSインデックスの種類ごとのrecall/レイテンシ/メモリのベンチマーク")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES), help="計測するインデックスの種類")
+    parser.add_argument("--k", type=int, default=5, help="検索件数 (recall@k のk)")
+    parser.add_argument("--queries", type=int, default=200, help="クエリ数")
+    parser.add_argument("--scale", type=int, default=1, help="ベクトルをノイズ付きで何倍に水増しするか")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+
+    num_vectors, report = run_benchmark(args.types, k=args.k, num_queries=args.queries, scale=args.scale, seed=args.seed)
+    if args.json:
+        print(json.dumps({'vectors': num_vectors, 'k': args.k, 'results': report}, ensure_ascii=False, indent=2))
+    else:
+        print(f"{num_vectors} vectors, {args.queries} queries, k={args.k}")
+        print_report(report, args.k)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import time
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+try:
+    from make_database.rate_limiter import TokenBucket
+except ImportError:
+    from rate_limiter import TokenBucket
+
+# --- 定数 ---
+FETCH_WORKERS = 4 # 同時にダウンロードするスレッド数 (全ホストの合計)
+PARSE_WORKERS = 2 # 解析・保存するスレッド数
+REQUESTS_PER_SECOND_PER_HOST = 1.0 # 1ホストあたりの1秒間のリクエスト数
+MAX_CONCURRENT_PER_HOST = 2 # 1ホストに同時に送るリクエスト数の上限
+REQUEST_TIMEOUT = 10
+
+
+class HostLimiter:
+    """
+    ホストごとのリクエストの間隔と同時接続数を制限する。
+    間隔はバーストを許さないトークンバケット (容量1) で、同時接続数はセマフォで制御する。
+    """
+
+    def __init__(self, requests_per_second=REQUESTS_PER_SECOND_PER_HOST, max_concurrent=MAX_CONCURRENT_PER_HOST):
+        self.requests_per_second = requests_per_second
+        self.max_concurrent = max_concurrent
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            limits = self._hosts.get(host)
+            if limits is None:
+                limits = self._hosts[host] = (
+                    TokenBucket(self.requests_per_second * 60, capacity=1),
+                    threading.BoundedSemaphore(self.max_concurrent),
+                )
+            return limits
+
+    def request(self, url, send):
+        """url のホストの枠が空くまで待ってから send() を呼び、その戻り値を返す"""
+        bucket, semaphore = self._host(url)
+        with semaphore:
+            bucket.acquire(1)
+            return send()
+
+
+class CrawlStats:
+    """クロールの件数・転送量・経過時間 (スレッドセーフ)"""
+
+    def __init__(self):
+        self.pages = 0
+        self.saved = 0
+        self.errors = 0
+        self.bytes = 0
+        self.fetch_seconds = 0.0
+        self.parse_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    @property
+    def pages_per_second(self):
+        return self.pages / max(self.elapsed, 1e-9)
+
+    def summary(self):
+        return (
+            f"{self.pages} pages ({self.saved} saved, {self.errors} errors), {self.bytes / 1024:.0f} KiB "
+            f"in {self.elapsed:.1f}s = {self.pages_per_second:.2f} pages/s "
+            f"(fetch {self.fetch_seconds:.1f}s, parse {self.parse_seconds:.1f}s in total across workers)"
+        )
+
+
+class Crawler:
+    """
+    ページのダウンロードと解析を別々のスレッドプールで並行して行うクローラー。
+    ダウンロードはホストごとのリクエスト間隔と同時接続数を守り、ダウンロードしたページは
+    解析用のプールに渡すため、解析やファイルの書き込みを待たずに次のページを取りに行ける。
+    """
+
+    def __init__(self, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS,
+                 requests_per_second_per_host=REQUESTS_PER_SECOND_PER_HOST, max_concurrent_per_host=MAX_CONCURRENT_PER_HOST,
+                 timeout=REQUEST_TIMEOUT, headers=None):
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.host_limiter = HostLimiter(requests_per_second_per_host, max_concurrent_per_host)
+        self.timeout = timeout
+        self.headers = headers or {}
+        # requests.Session はスレッド間で共有しないよう、ダウンロード用のスレッドごとに作る
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def fetch(self, url, headers=None):
+        """ホストの制限を守ってurlを取得する。戻り値は requests.Response (ステータスの確認は呼び出し側で行う)"""
+        return self.host_limiter.request(url, lambda: self._session().get(url, headers=headers, timeout=self.timeout))
+
+    def crawl(self, urls, handle_page, on_error=None, request_headers=None):
+        """
+        urls を並行してダウンロードし、取得できたページごとに解析用のスレッドで handle_page(url, response) を呼ぶ。
+        handle_page が真を返したページを保存できたものとして数える。
+        on_error(url, exception) はダウンロードまたは解析で例外が出たときに呼ばれる。
+        request_headers(url) を指定すると、その戻り値をリクエストのヘッダーに加える (条件付きリクエストなど)。戻り値は CrawlStats。
+        """
+        stats = CrawlStats()
+
+        def report_error(url, error):
+            stats.add(errors=1)
+            if on_error is not None:
+                on_error(url, error)
+
+        def parse(url, response):
+            start_time = time.perf_counter()
+            try:
+                if handle_page(url, response):
+                    stats.add(saved=1)
+            except Exception as e:
+                report_error(url, e)
+            finally:
+                stats.add(parse_seconds=time.perf_counter() - start_time)
+
+        with ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix='crawl-parse') as parse_pool:
+            def fetch(url):
+                start_time = time.perf_counter()
+                try:
+                    response = self.fetch(url, headers=request_headers(url) if request_headers else None)
+                    response.raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    report_error(url, e)
+                    return
+                finally:
+                    stats.add(fetch_seconds=time.perf_counter() - start_time)
+                stats.add(pages=1, bytes=len(response.content))
+                parse_pool.submit(parse, url, response)
+
+            with ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix='crawl-fetch') as fetch_pool:
+                list(fetch_pool.map(fetch, urls))
+        stats.finished_at = time.perf_counter()
+        self.close()
+        return stats
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
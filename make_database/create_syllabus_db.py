@@ -0,0 +1,27 @@
+import os
+import sys
+import time
+import argparse
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from syllabus_search.syllabus_db import SYLLABUS_CSV_PATH, SYLLABUS_DB_PATH, build_syllabus_database
+
+# --- メイン処理 ---
+
+def main(csv_path=SYLLABUS_CSV_PATH, db_path=SYLLABUS_DB_PATH):
+    """シラバスCSVからSQLiteのデータベースと全文検索 (FTS5) の索引を作る"""
+    if not os.path.exists(csv_path):
+        print(f"エラー: シラバスCSVファイルが見つかりません: {csv_path}")
+        return
+
+    start_time = time.perf_counter()
+    row_count = build_syllabus_database(csv_path, db_path)
+    print(f"{row_count}件のシラバスを {db_path} に保存しました ({time.perf_counter() - start_time:.2f} 秒)。")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="シラバス検索用のSQLiteデータベースの作成")
+    parser.add_argument("--csv", default=SYLLABUS_CSV_PATH, help="シラバスCSVのパス")
+    parser.add_argument("--db", default=SYLLABUS_DB_PATH, help="作成するデータベースのパス")
+    args = parser.parse_args()
+    main(csv_path=args.csv, db_path=args.db)
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import google.generativeai as genai
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+try:
+    from make_database.create_vector_db import (
+        API_KEY, EMBEDDING_MODEL, EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS,
+        REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, embed_texts_batched, embed_texts_with_cache,
+    )
+    from make_database.embedding_cache import EmbeddingCache
+except ImportError:
+    from create_vector_db import (
+        API_KEY, EMBEDDING_MODEL, EMBEDDING_CACHE_PATH, EMBEDDING_BATCH_SIZE, EMBEDDING_WORKERS,
+        REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, embed_texts_batched, embed_texts_with_cache,
+    )
+    from embedding_cache import EmbeddingCache
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from syllabus_search.syllabus_index import (
+    SYLLABUS_CSV_PATH, SYLLABUS_VECTOR_STORE_DIR, SYLLABUS_FAISS_INDEX_PATH, SYLLABUS_METADATA_PATH,
+    load_syllabus_rows, syllabus_document_text,
+)
+from web_search.vector_index import build_index, save_index
+
+# --- メイン処理 ---
+
+def main(batch_size=EMBEDDING_BATCH_SIZE, workers=EMBEDDING_WORKERS,
+         requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, use_cache=True):
+    """シラバスCSVの科目名+概要をEmbeddingし、シラバス検索用のFAISSインデックスを作る"""
+    if not API_KEY:
+        print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。direnvの設定を確認してください。")
+        return
+
+    genai.configure(api_key=API_KEY)
+    os.makedirs(SYLLABUS_VECTOR_STORE_DIR, exist_ok=True)
+
+    rows = load_syllabus_rows(SYLLABUS_CSV_PATH)
+    print(f"{len(rows)}件のシラバスを {SYLLABUS_CSV_PATH} から読み込みました。")
+    texts = [syllabus_document_text(row) for row in rows]
+
+    batch_options = {
+        'batch_size': batch_size,
+        'workers': workers,
+        'requests_per_minute': requests_per_minute,
+        'tokens_per_minute': tokens_per_minute,
+    }
+    print("シラバスのEmbeddingを取得中...")
+    start_time = time.perf_counter()
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH) if use_cache else None
+    try:
+        if cache is not None:
+            embeddings = embed_texts_with_cache(texts, EMBEDDING_MODEL, cache, **batch_options)
+        else:
+            embeddings = embed_texts_batched(texts, EMBEDDING_MODEL, **batch_options)
+    finally:
+        if cache is not None:
+            cache.close()
+    print(f"Embedding完了: {len(embeddings)} 件 / {time.perf_counter() - start_time:.1f} 秒")
+
+    if not embeddings:
+        print("有効なEmbeddingが一つも生成されませんでした。処理を中断します。")
+        return
+
+    vectors = np.array(embeddings).astype('float32').reshape(len(embeddings), -1)
+    index, index_config = build_index(vectors, 'flat')
+    print(f"FAISSインデックスを {SYLLABUS_FAISS_INDEX_PATH} に保存中...")
+    save_index(index, index_config, SYLLABUS_FAISS_INDEX_PATH)
+
+    # 検索時にCSVの行と対応しているか確かめるため、行の順に科目名とURLを保存する
+    metadata = [{'subject_name': row['subject_name'], 'detail_url': row['detail_url']} for row in rows]
+    print(f"メタデータを {SYLLABUS_METADATA_PATH} に保存中...")
+    with open(SYLLABUS_METADATA_PATH, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    print("\nシラバス検索用のインデックスの作成が完了しました。")
+    print(f"- ベクトル数: {index.ntotal}")
+    print(f"- 保存先: {SYLLABUS_VECTOR_STORE_DIR}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="シラバス検索用のベクトルDBの作成")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="1リクエストにまとめるシラバス数")
+    parser.add_argument("--workers", type=int, default=EMBEDDING_WORKERS, help="並列に送るバッチ数")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="1分あたりの最大リクエスト数")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="1分あたりの最大トークン数 (0で無制限)")
+    parser.add_argument("--no-cache", action="store_true", help="Embeddingキャッシュを使わずに全件を再Embeddingする")
+    args = parser.parse_args()
+    main(batch_size=args.batch_size, workers=args.workers, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+         use_cache=not args.no_cache)
@@ -1,34 +1,72 @@
 import os
 import json
 import numpy as np
-import faiss
 import google.generativeai as genai
+import sys
 import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+try:
+    from make_database.rate_limiter import RateLimiter
+    from make_database.embedding_cache import EmbeddingCache, make_cache_key
+except ImportError:
+    from rate_limiter import RateLimiter
+    from embedding_cache import EmbeddingCache, make_cache_key
+    # BM25のトークン化は検索時と同じものを使うため、web_searchのモジュールを読み込めるようにする
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from web_search.lexical_index import BM25Index
+from web_search.document_store import render_markdown
+from web_search.context_assembler import estimate_tokens
+from web_search.vector_index import INDEX_TYPES, DEFAULT_INDEX_TYPE, build_index, save_index, load_index
+from web_search.chunk_store import ChunkStore
+from web_search.vector_store import (
+    FAISS_INDEX_FILE, METADATA_FILE, LEXICAL_INDEX_FILE, CHUNK_STORE_SUBDIR,
+    begin_bundle, publish_bundle, current_vector_store_dir, read_manifest,
+)
 
 # --- 定数 ---
 # direnvで設定されることを期待
 API_KEY = os.getenv('GEMINI_API_KEY')
 EMBEDDING_MODEL = 'models/text-embedding-004'
+EMBEDDING_TASK_TYPE = 'RETRIEVAL_DOCUMENT'
 
-# パス設定
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# パス設定 (リポジトリ直下のdata/を参照する)
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 INPUT_DIR = os.path.join(BASE_DIR, 'data','scraped_data_student_menu')
+# 作るたびに OUTPUT_DIR/versions/<版>/ に新しい版 (バンドル) として保存し、OUTPUT_DIR/CURRENT を切り替えて公開する。
+# 版のディレクトリには faiss_index.bin/.json, metadata.json, chunks/ (チャットが読む列形式のメタデータ),
+# bm25_index.json と manifest.json (モデル・次元数・チャンク数・チェックサム) が入る
 OUTPUT_DIR = os.path.join(BASE_DIR, 'data','vector_store')
-FAISS_INDEX_PATH = os.path.join(OUTPUT_DIR, 'faiss_index.bin')
-METADATA_PATH = os.path.join(OUTPUT_DIR, 'metadata.json')
+# Embeddingキャッシュはベクトルストアを作り直しても残るよう別の場所に置く
+EMBEDDING_CACHE_PATH = os.path.join(BASE_DIR, 'data', 'cache', 'embedding_cache.sqlite3')
 
 # デバッグモード設定: 処理するJSONファイルの最大数 (Noneで全ファイル処理)
 DEBUG_MODE_MAX_FILES = None # 全ファイルを処理するように変更
 
+# バッチEmbeddingの設定 (コマンドライン引数で上書き可能)
+EMBEDDING_BATCH_SIZE = 100 # 1リクエストにまとめるチャンク数 (APIの上限は100)
+EMBEDDING_WORKERS = 4 # 並列に送るバッチ数
+REQUESTS_PER_MINUTE = 100
+TOKENS_PER_MINUTE = 1_000_000
+
 # --- メイン処理 ---
 
 def create_chunks(data):
-    """構造化JSONデータからチャンクを作成する"""
+    """
+    構造化JSONデータからチャンクを作成する。
+    各チャンクの offset は、元になった要素がページのMarkdown (render_markdown) の中で占める範囲 [開始, 終了]。
+    検索時にヒットしたチャンクから、そのチャンクを含むセクションを引くのに使う。
+    """
     chunks = []
     current_headings = []
+    _markdown, item_spans = render_markdown(data)
     
     # テキストチャンク結合用の一時バッファ
     text_buffer = []
+    buffer_span = []
 
     def flush_text_buffer():
         if text_buffer:
@@ -37,11 +75,13 @@ def create_chunks(data):
                 'source': data['url'],
                 'title': data['title'],
                 'headings': list(current_headings),
-                'text': chunk_text
+                'text': chunk_text,
+                'offset': [buffer_span[0], buffer_span[-1]],
             })
             text_buffer.clear()
+            buffer_span.clear()
 
-    for item in data['content']:
+    for item, item_span in zip(data['content'], item_spans):
         if item['type'] == 'heading':
             flush_text_buffer() # バッファをフラッシュ
             # 見出しレベルに応じて階層を更新
@@ -55,11 +95,13 @@ def create_chunks(data):
                 'source': data['url'],
                 'title': data['title'],
                 'headings': list(current_headings),
-                'text': chunk_text
+                'text': chunk_text,
+                'offset': list(item_span),
             })
 
         elif item['type'] == 'paragraph':
             text_buffer.append(item['text'])
+            buffer_span.extend(item_span)
             
         elif item['type'] == 'list':
             flush_text_buffer() # バッファをフラッシュ
@@ -69,7 +111,8 @@ def create_chunks(data):
                 'source': data['url'],
                 'title': data['title'],
                 'headings': list(current_headings),
-                'text': chunk_text
+                'text': chunk_text,
+                'offset': list(item_span),
             })
         
         elif item['type'] == 'table':
@@ -94,30 +137,146 @@ def create_chunks(data):
                     'source': data['url'],
                     'title': data['title'],
                     'headings': list(current_headings),
-                    'text': chunk_text
+                    'text': chunk_text,
+                    'offset': list(item_span),
                 })
 
     flush_text_buffer() # 最後に残ったバッファをフラッシュ
             
     return chunks
 
-def get_embeddings_with_retry(texts, model, max_retries=5):
+def get_embeddings_with_retry(texts, model, max_retries=5, rate_limiter=None):
     """リトライ機能付きでEmbeddingを取得する"""
     try:
         # APIのレートリミットを考慮
-        time.sleep(1) 
-        result = genai.embed_content(model=model, content=texts, task_type="RETRIEVAL_DOCUMENT")
+        if rate_limiter is not None:
+            rate_limiter.acquire(tokens=sum(estimate_tokens(text) for text in texts))
+        else:
+            time.sleep(1)
+        result = genai.embed_content(model=model, content=texts, task_type=EMBEDDING_TASK_TYPE)
         return result['embedding']
     except Exception as e:
         print(f"API Error: {e}. Retrying...")
         if max_retries > 0:
             time.sleep(5) # エラー時は長めに待つ
-            return get_embeddings_with_retry(texts, model, max_retries - 1)
+            return get_embeddings_with_retry(texts, model, max_retries - 1, rate_limiter)
         else:
             print("Failed to get embeddings after multiple retries.")
             raise
 
-def main():
+def embed_texts_batched(texts, model, batch_size=EMBEDDING_BATCH_SIZE, workers=EMBEDDING_WORKERS,
+                        requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, on_batch=None):
+    """
+    テキストをbatch_size件ずつ1リクエストにまとめ、workers個のバッチを並列にEmbeddingする。
+    固定のsleepの代わりにRPM/TPMのトークンバケットで流量を制御する。
+    on_batch: バッチが終わるたびに on_batch(バッチのテキスト, Embedding) を (ワーカーのスレッドで) 呼ぶ。
+    戻り値はtextsと同じ順序のEmbeddingのリスト。
+    """
+    rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    completed = [0]
+    progress_lock = threading.Lock()
+
+    def embed_batch(batch_index):
+        batch = batches[batch_index]
+        embeddings = get_embeddings_with_retry(batch, model, rate_limiter=rate_limiter)
+        if len(embeddings) != len(batch):
+            raise RuntimeError(f"Embedding count mismatch in batch {batch_index}: {len(embeddings)} != {len(batch)}")
+        if on_batch is not None:
+            on_batch(batch, embeddings)
+        with progress_lock:
+            completed[0] += 1
+            print(f"  Batch {completed[0]}/{len(batches)} done ({len(batch)} chunks)")
+        return embeddings
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch_results = list(executor.map(embed_batch, range(len(batches))))
+
+    return [embedding for batch_embeddings in batch_results for embedding in batch_embeddings]
+
+def embed_texts_with_cache(texts, model, cache, **batch_options):
+    """
+    キャッシュに無いテキストだけをAPIでEmbeddingし、結果をバッチが終わるたびにキャッシュに保存する
+    (途中のバッチで失敗しても、それまでのバッチはやり直しの際にAPIを呼ばない)。
+    戻り値はtextsと同じ順序のEmbeddingのリスト。
+    """
+    keys = [make_cache_key(text, model, EMBEDDING_TASK_TYPE) for text in texts]
+    cached = cache.get_many(keys)
+
+    # 同じテキストが複数回出てくる場合は1回だけEmbeddingする
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached and key not in missing:
+            missing[key] = text
+
+    if missing:
+        print(f"  キャッシュに無い {len(missing)} 件のテキストをEmbeddingします。")
+        def store_batch(batch, embeddings):
+            cache.put_many([(make_cache_key(text, model, EMBEDDING_TASK_TYPE), vector) for text, vector in zip(batch, embeddings)])
+
+        new_embeddings = embed_texts_batched(list(missing.values()), model, on_batch=store_batch, **batch_options)
+        cached.update((key, np.asarray(vector, dtype='float32')) for key, vector in zip(missing.keys(), new_embeddings))
+    else:
+        print("  すべてのチャンクがキャッシュに存在します。APIは呼び出しません。")
+
+    return [cached[key] for key in keys]
+
+def build_lexical_index(metadata, bundle):
+    """メタデータのチャンク (FAISSと同じ並び) からBM25のインデックスを作って保存する"""
+    lexical_index_path = os.path.join(bundle, LEXICAL_INDEX_FILE)
+    print(f"BM25インデックスを {lexical_index_path} に保存中...")
+    start_time = time.perf_counter()
+    lexical_index = BM25Index.build([chunk['text'] for chunk in metadata])
+    lexical_index.save(lexical_index_path)
+    print(f"- BM25: {len(lexical_index.postings)} 語 / {time.perf_counter() - start_time:.2f} 秒")
+    return lexical_index
+
+def build_chunk_store(metadata, bundle):
+    """メタデータを文字列表と整数の列・本文のバイナリからなるチャンクストアとして保存する"""
+    chunk_store_dir = os.path.join(bundle, CHUNK_STORE_SUBDIR)
+    print(f"チャンクストアを {chunk_store_dir} に保存中...")
+    ChunkStore.write(metadata, chunk_store_dir)
+    store = ChunkStore.load(chunk_store_dir)
+    try:
+        print(f"- チャンクストア: {len(store)} チャンク / 文字列 {len(store.strings)} 件 / 見出しの階層 {len(store.heading_paths)} 件")
+    finally:
+        store.close()
+
+def bundle_info(bundle, metadata, embedding_model=EMBEDDING_MODEL):
+    """版のマニフェストに書く情報 (モデル・次元数・チャンク数・インデックスの種類)"""
+    index, index_config = load_index(os.path.join(bundle, FAISS_INDEX_FILE))
+    return {
+        'embedding_model': embedding_model,
+        'dimension': index.d,
+        'num_chunks': len(metadata),
+        'index_type': index_config['index_type'],
+    }
+
+def publish(bundle, metadata, embedding_model=EMBEDDING_MODEL):
+    version = publish_bundle(OUTPUT_DIR, bundle, **bundle_info(bundle, metadata, embedding_model))
+    print(f"- 版 {version} を公開しました ({os.path.join(OUTPUT_DIR, 'CURRENT')})")
+    return version
+
+def rebuild_from_current(build):
+    """
+    今の版をコピーした新しい版で、metadata.json から build(metadata, 版のディレクトリ) で一部のファイルだけを作り直して公開する
+    (Embedding APIは呼ばない)。以前の形式 (OUTPUT_DIR 直下のファイル) からは最初の版が作られる。
+    """
+    source = current_vector_store_dir(OUTPUT_DIR)
+    metadata_path = os.path.join(source, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        print(f"エラー: {metadata_path} が見つかりません。先にベクトルDBを作成してください。")
+        return
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    manifest = read_manifest(source) or {}
+    bundle = begin_bundle(OUTPUT_DIR, base_dir=source)
+    build(metadata, bundle)
+    publish(bundle, metadata, manifest.get('embedding_model', EMBEDDING_MODEL))
+
+def main(batch_size=EMBEDDING_BATCH_SIZE, workers=EMBEDDING_WORKERS,
+         requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE, use_cache=True,
+         index_type=DEFAULT_INDEX_TYPE, index_options=None):
     """メインの実行関数"""
     if not API_KEY:
         print("エラー: 環境変数 GEMINI_API_KEY が設定されていません。direnvの設定を確認してください。")
@@ -145,41 +304,89 @@ def main():
 
     # Embeddingの取得
     print("チャンクのEmbeddingを取得中... (APIコールのため時間がかかります)")
-    embeddings = []
-    metadata = []
-    
-    for i, chunk in enumerate(all_chunks):
-        # テキストが空でないことを確認
-        if not chunk['text'].strip():
-            continue
+    print(f"  バッチサイズ: {batch_size}, 並列数: {workers}, RPM: {requests_per_minute}, TPM: {tokens_per_minute}")
+    # テキストが空でないチャンクのみを対象にする
+    metadata = [chunk for chunk in all_chunks if chunk['text'].strip()]
+
+    batch_options = {
+        'batch_size': batch_size,
+        'workers': workers,
+        'requests_per_minute': requests_per_minute,
+        'tokens_per_minute': tokens_per_minute,
+    }
+    texts = [chunk['text'] for chunk in metadata]
 
-        print(f"  Processing chunk {i+1}/{len(all_chunks)}...")
-        embedding = get_embeddings_with_retry([chunk['text']], EMBEDDING_MODEL)
-        embeddings.append(embedding[0]) 
-        metadata.append(chunk)
+    start_time = time.perf_counter()
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH) if use_cache else None
+    try:
+        if cache is not None:
+            embeddings = embed_texts_with_cache(texts, EMBEDDING_MODEL, cache, **batch_options)
+        else:
+            embeddings = embed_texts_batched(texts, EMBEDDING_MODEL, **batch_options)
+    finally:
+        if cache is not None:
+            cache.close()
+    elapsed = time.perf_counter() - start_time
+    if embeddings:
+        print(f"Embedding完了: {len(embeddings)} チャンク / {elapsed:.1f} 秒 ({len(embeddings) / max(elapsed, 1e-9):.1f} チャンク/秒)")
 
     if not embeddings:
         print("有効なEmbeddingが一つも生成されませんでした。処理を中断します。")
         return
 
     # FAISSインデックスの作成
-    print("FAISSインデックスを作成中...")
+    print(f"FAISSインデックス ({index_type}) を作成中...")
     vector_dimension = len(embeddings[0])
     print(f"[DEBUG] Creating FAISS index with dimension: {vector_dimension}")
-    index = faiss.IndexFlatL2(vector_dimension)
-    index.add(np.array(embeddings).astype('float32').reshape(-1, vector_dimension))
+    vectors = np.array(embeddings).astype('float32').reshape(-1, vector_dimension)
+    index, index_config = build_index(vectors, index_type, **(index_options or {}))
 
-    # ファイルへの保存
-    print(f"FAISSインデックスを {FAISS_INDEX_PATH} に保存中...")
-    faiss.write_index(index, FAISS_INDEX_PATH)
+    # ファイルへの保存 (インデックスの種類と検索パラメータは faiss_index.json に保存する)
+    # 公開するまでは作業ディレクトリに書くため、動いているアプリが書きかけのファイルを読むことはない
+    bundle = begin_bundle(OUTPUT_DIR)
+    faiss_index_path = os.path.join(bundle, FAISS_INDEX_FILE)
+    print(f"FAISSインデックスを {faiss_index_path} に保存中...")
+    save_index(index, index_config, faiss_index_path)
 
-    print(f"メタデータを {METADATA_PATH} に保存中...")
-    with open(METADATA_PATH, 'w', encoding='utf-8') as f:
+    metadata_path = os.path.join(bundle, METADATA_FILE)
+    print(f"メタデータを {metadata_path} に保存中...")
+    with open(metadata_path, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
 
+    build_chunk_store(metadata, bundle)
+    build_lexical_index(metadata, bundle)
+
     print("\nデータベースの作成が完了しました。")
-    print(f"- ベクトル数: {index.ntotal}")
-    print(f"- 保存先: {OUTPUT_DIR}")
+    print(f"- ベクトル数: {index.ntotal} ({index_config})")
+    publish(bundle, metadata)
+    if cache is not None:
+        print(f"- Embeddingキャッシュ: ヒット {cache.hits} 件 / ミス {cache.misses} 件 ({EMBEDDING_CACHE_PATH})")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="ベクトルDBの作成")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="1リクエストにまとめるチャンク数")
+    parser.add_argument("--workers", type=int, default=EMBEDDING_WORKERS, help="並列に送るバッチ数")
+    parser.add_argument("--rpm", type=int, default=REQUESTS_PER_MINUTE, help="1分あたりの最大リクエスト数")
+    parser.add_argument("--tpm", type=int, default=TOKENS_PER_MINUTE, help="1分あたりの最大トークン数 (0で無制限)")
+    parser.add_argument("--no-cache", action="store_true", help="Embeddingキャッシュを使わずに全チャンクを再Embeddingする")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=DEFAULT_INDEX_TYPE,
+                        help="FAISSインデックスの種類")
+    parser.add_argument("--nlist", type=int, default=None, help="IVFのクラスタ数 (省略時はベクトル数から決める)")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVFで検索時に見るクラスタ数")
+    parser.add_argument("--ef-search", type=int, default=None, help="HNSWの検索時の探索幅")
+    parser.add_argument("--refine", action="store_true",
+                        help="sq8/pqで、元のベクトルも保存して正確な距離で並べ直す (recallは上がるがメモリはflat以上になる)")
+    parser.add_argument("--lexical-only", action="store_true", help="既存のメタデータからBM25インデックスだけを作り直す")
+    parser.add_argument("--chunk-store-only", action="store_true", help="既存のメタデータからチャンクストアだけを作り直す")
+    args = parser.parse_args()
+    if args.lexical_only:
+        rebuild_from_current(build_lexical_index)
+        sys.exit(0)
+    if args.chunk_store_only:
+        rebuild_from_current(build_chunk_store)
+        sys.exit(0)
+    main(batch_size=args.batch_size, workers=args.workers, requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+         use_cache=not args.no_cache, index_type=args.index_type,
+         index_options={name: value for name, value in
+                        (('nlist', args.nlist), ('nprobe', args.nprobe), ('ef_search', args.ef_search),
+                         ('refine', args.refine or None)) if value is not None})
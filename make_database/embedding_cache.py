@@ -0,0 +1,63 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+
+def make_cache_key(text, model, task_type):
+    """チャンクのテキスト・Embeddingモデル名・タスク種別から決まるキャッシュキー"""
+    return hashlib.sha256(f"{model}\0{task_type}\0{text}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    テキストのハッシュをキーにEmbeddingベクトルを保存する、ディスク上の永続キャッシュ (SQLite)。
+    内容が変わらないチャンクは再ビルド時にAPIを呼ばずにベクトルを再利用できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dimension INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """キーのリストを受け取り、キャッシュに存在するものを {key: ベクトル} で返す"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            # SQLiteのプレースホルダ数の上限を超えないよう分割して問い合わせる
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, dimension, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                )
+                for key, dimension, blob in rows:
+                    vector = np.frombuffer(blob, dtype='float32')
+                    if vector.shape[0] == dimension:
+                        found[key] = vector
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """(key, ベクトル) のリストをキャッシュに保存する"""
+        rows = []
+        for key, vector in items:
+            vector = np.asarray(vector, dtype='float32')
+            rows.append((key, int(vector.shape[0]), vector.tobytes()))
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (key, dimension, vector) VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+# ページの状態 (変更ページのマニフェストに記録する)
+NEW = 'new' # 初めて取得したページ
+CHANGED = 'changed' # 内容が変わったページ
+NOT_MODIFIED = 'not_modified' # 条件付きリクエストに 304 Not Modified が返ったページ
+UNCHANGED = 'unchanged' # 200 が返ったが本文のハッシュが前回と同じページ
+ERROR = 'error'
+REMOVED = 'removed' # 前回まではあったが今回のクロールで見つからなかったページ
+# 解析と保存を省略できる状態
+UNCHANGED_STATUSES = (NOT_MODIFIED, UNCHANGED)
+
+
+def body_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class HttpCache:
+    """
+    URLごとに ETag・Last-Modified・本文のハッシュと、前回の解析結果 (JSONにできる値) を保存する、ディスク上の永続キャッシュ (SQLite)。
+    次のクロールでは条件付きリクエスト (If-None-Match / If-Modified-Since) を送り、
+    304 が返るか本文のハッシュが同じページは、解析と保存をせずに前回の結果を使える。
+    scope ごとにURLを分けて持つため、複数のスクレイパーで同じファイルを共有できる。
+    """
+
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "scope TEXT NOT NULL, url TEXT NOT NULL, etag TEXT, last_modified TEXT, body_hash TEXT NOT NULL, "
+            "result TEXT, checked_at REAL NOT NULL, changed_at REAL NOT NULL, PRIMARY KEY (scope, url))"
+        )
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        """保存されている情報を辞書で返す。無ければNone"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified, body_hash, result, checked_at, changed_at FROM pages WHERE scope = ? AND url = ?",
+                (self.scope, url),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, hash_value, result, checked_at, changed_at = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'body_hash': hash_value,
+            'result': json.loads(result) if result is not None else None,
+            'checked_at': checked_at,
+            'changed_at': changed_at,
+        }
+
+    def request_headers(self, url, reusable=None):
+        """
+        条件付きリクエストのヘッダー。前回の結果が無い場合や、reusable(entry) が偽の場合
+        (保存したファイルが消えているなど、304が返っても困る場合) は空の辞書を返す。
+        """
+        entry = self.get(url)
+        if entry is None or entry['result'] is None or (reusable is not None and not reusable(entry)):
+            return {}
+        headers = {}
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def check(self, url, response, reusable=None):
+        """
+        レスポンスを前回と比べて状態 (NEW/CHANGED/NOT_MODIFIED/UNCHANGED) と保存されている情報を返す。
+        本文が同じでも、前回の結果を再利用できない (reusable(entry) が偽の) 場合は CHANGED とする。
+        """
+        entry = self.get(url)
+        if entry is None:
+            return NEW, None
+        if response.status_code == 304:
+            return NOT_MODIFIED, entry
+        if (
+            entry['result'] is not None and (reusable is None or reusable(entry))
+            and body_hash(response.content) == entry['body_hash']
+        ):
+            return UNCHANGED, entry
+        return CHANGED, entry
+
+    def store(self, url, response, result):
+        """解析したページの検証用ヘッダー・本文のハッシュ・解析結果を保存する"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (scope, url, etag, last_modified, body_hash, result, checked_at, changed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.scope, url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                    body_hash(response.content), json.dumps(result, ensure_ascii=False), now, now,
+                ),
+            )
+            self.conn.commit()
+
+    def touch(self, url, response):
+        """変わっていなかったページの確認時刻を更新する (200 が返った場合は新しい検証用ヘッダーも保存する)"""
+        with self.lock:
+            if response.status_code == 304:
+                self.conn.execute(
+                    "UPDATE pages SET checked_at = ? WHERE scope = ? AND url = ?", (time.time(), self.scope, url)
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE pages SET etag = ?, last_modified = ?, checked_at = ? WHERE scope = ? AND url = ?",
+                    (response.headers.get('ETag'), response.headers.get('Last-Modified'), time.time(), self.scope, url),
+                )
+            self.conn.commit()
+
+    def urls(self):
+        with self.lock:
+            return {url for (url,) in self.conn.execute("SELECT url FROM pages WHERE scope = ?", (self.scope,))}
+
+    def remove(self, urls):
+        with self.lock:
+            self.conn.executemany("DELETE FROM pages WHERE scope = ? AND url = ?", [(self.scope, url) for url in urls])
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ChangeManifest:
+    """
+    1回のクロールで各ページがどうだったか (新規・変更・未変更・エラー・削除) を記録し、JSONに書き出す。
+    後段の処理は changed_urls と removed_urls だけを見れば、変わったページの分だけ作業すればよい。
+    """
+
+    def __init__(self, path, scope):
+        self.path = path
+        self.scope = scope
+        self.started_at = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def record(self, url, status, **info):
+        with self.lock:
+            self.pages[url] = {'url': url, 'status': status, **info}
+
+    def status(self, url):
+        """記録したページの状態。記録が無ければNone"""
+        with self.lock:
+            page = self.pages.get(url)
+            return page['status'] if page is not None else None
+
+    def counts(self):
+        with self.lock:
+            counts = {}
+            for page in self.pages.values():
+                counts[page['status']] = counts.get(page['status'], 0) + 1
+            return counts
+
+    def mark_removed(self, cache):
+        """キャッシュにあるが今回記録されなかったURLを削除されたページとして記録し、キャッシュから消す (クロールが最後まで終わった場合だけ呼ぶ)"""
+        with self.lock:
+            removed = sorted(cache.urls() - set(self.pages))
+        for url in removed:
+            self.record(url, REMOVED)
+        cache.remove(removed)
+        return removed
+
+    def write(self):
+        with self.lock:
+            pages = sorted(self.pages.values(), key=lambda page: page['url'])
+        data = {
+            'scope': self.scope,
+            'started_at': self.started_at,
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'counts': self.counts(),
+            'changed_urls': [page['url'] for page in pages if page['status'] in (NEW, CHANGED)],
+            'removed_urls': [page['url'] for page in pages if page['status'] == REMOVED],
+            'pages': pages,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+        return data
+
+    def summary(self):
+        counts = self.counts()
+        return ", ".join(f"{status} {counts.get(status, 0)}" for status in (NEW, CHANGED, NOT_MODIFIED, UNCHANGED, ERROR, REMOVED))
@@ -0,0 +1,287 @@
+"""
+スクレイパーのHTML解析を lxml の木で直接行う高速な実装。
+BeautifulSoup (html.parser) で解析する従来の実装と同じ構造化データを返すよう、
+get_text(strip=True) や find/find_all と同じ規則で要素とテキストをたどる
+(一致は tests/test_html_parser_parity.py と benchmarks/bench_html_parser.py --check で確かめる)。
+"""
+import re
+from urllib.parse import urljoin
+
+try:
+    from lxml import etree
+except ImportError: # lxml は pyproject.toml の依存パッケージ。入っていない環境では警告を出して BeautifulSoup で解析する
+    etree = None
+
+# --- 定数 ---
+# 解析のバックエンド: 'bs4' は BeautifulSoup + html.parser (従来の実装)、'lxml' はこのモジュール
+PARSER_BACKENDS = ('bs4', 'lxml')
+LXML_AVAILABLE = etree is not None
+DEFAULT_PARSER_BACKEND = 'lxml'
+
+if LXML_AVAILABLE:
+    # BeautifulSoup の get_text() はコメントと、script/style/template/rt/rp の中の文字列を含めない
+    _TEXT_NODES = etree.XPath(
+        ".//text()[not(ancestor::script or ancestor::style or ancestor::template or ancestor::rt or ancestor::rp)]"
+    )
+
+
+def resolve_parser_backend(name=None):
+    """バックエンドの名前を確かめて返す。省略時は既定のもの。lxml が無い場合は警告を出して 'bs4' に切り替える"""
+    name = name or DEFAULT_PARSER_BACKEND
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name} (choose from {', '.join(PARSER_BACKENDS)})")
+    if name == 'lxml' and not LXML_AVAILABLE:
+        print("WARNING: lxml is not installed. Falling back to the 'bs4' parser backend.")
+        return 'bs4'
+    return name
+
+
+def parse_document(html):
+    """HTML (bytes または str) を解析してルート要素を返す。空の文書はNone"""
+    if isinstance(html, bytes):
+        # 文字コードの宣言が無いページも BeautifulSoup と同じくUTF-8として読めるよう、先にデコードを試す
+        try:
+            html = html.decode('utf-8')
+        except UnicodeDecodeError:
+            return etree.HTML(html)
+    try:
+        return etree.HTML(html)
+    except ValueError: # XML宣言付きの文字列はそのままでは解析できない
+        return etree.HTML(html.encode('utf-8'), etree.HTMLParser(encoding='utf-8'))
+
+
+def is_text(node):
+    """BeautifulSoup の NavigableString に相当する節点か (lxml のテキストは str、コメントは要素として現れる)"""
+    return isinstance(node, str) or node.tag is etree.Comment
+
+
+def node_string(node):
+    return node if isinstance(node, str) else (node.text or '')
+
+
+def children(element):
+    """BeautifulSoup の element.children と同じ順で子 (テキストと要素) を返す"""
+    if element.text:
+        yield element.text
+    for child in element:
+        if child.tag is etree.ProcessingInstruction or child.tag is etree.Entity:
+            continue
+        yield child
+        if child.tail:
+            yield child.tail
+
+
+def has_class(element, class_name):
+    return class_name in (element.get('class') or '').split()
+
+
+def find(element, tag, class_name=None):
+    """子孫から最初に見つかった要素 (BeautifulSoup の find と同じく要素自身は含めない)"""
+    for descendant in element.iterdescendants(tag):
+        if class_name is None or has_class(descendant, class_name):
+            return descendant
+    return None
+
+
+def find_all(element, *tags):
+    return list(element.iterdescendants(*tags))
+
+
+def get_text(element):
+    """BeautifulSoup の get_text(strip=True) と同じ文字列"""
+    return ''.join(text.strip() for text in _TEXT_NODES(element))
+
+
+def remove_elements(element, tags, classes):
+    """
+    子孫のうち、タグ名が tags に含まれるか class が classes のどれかを持つ要素を取り除く
+    (BeautifulSoup の select(...) → decompose() と同じ。要素の後ろのテキストは残す)。
+    """
+    tags = set(tags)
+    classes = set(classes)
+    targets = [
+        descendant for descendant in element.iterdescendants()
+        if isinstance(descendant.tag, str)
+        and (descendant.tag in tags or not classes.isdisjoint((descendant.get('class') or '').split()))
+    ]
+    for target in targets:
+        parent = target.getparent()
+        if parent is None:
+            continue
+        if target.tail:
+            previous = target.getprevious()
+            if previous is not None:
+                previous.tail = (previous.tail or '') + target.tail
+            else:
+                parent.text = (parent.text or '') + target.tail
+        parent.remove(target)
+
+
+# --- web_scraper.py の解析 ---
+
+def parse_table(table_tag):
+    """web_scraper.parse_table の lxml 版"""
+    headers = []
+    rows = []
+
+    header_row = find(table_tag, 'thead')
+    if header_row is not None:
+        headers = [get_text(th) for th in find_all(header_row, 'th')]
+    else: # theadがない場合、最初のtrをヘッダーとみなす
+        first_tr = find(table_tag, 'tr')
+        if first_tr is not None:
+            ths = find_all(first_tr, 'th')
+            if ths:
+                headers = [get_text(th) for th in ths]
+            else:
+                headers = [get_text(td) for td in find_all(first_tr, 'td')]
+
+    for tr in find_all(table_tag, 'tr'):
+        cells = find_all(tr, 'th', 'td')
+        if not cells:
+            continue
+        row_data = [get_text(cell) for cell in cells]
+        if any(row_data):
+            rows.append(row_data)
+
+    if headers and rows and rows[0] == headers:
+        rows = rows[1:]
+
+    return {
+        "type": "table",
+        "headers": headers,
+        "rows": rows
+    }
+
+
+def parse_element_to_structured_data(element, base_url):
+    """web_scraper.parse_element_to_structured_data の lxml 版 (element は children() が返す節点)"""
+    structured_data = []
+
+    if is_text(element):
+        text = node_string(element).strip()
+        if text:
+            structured_data.append({"type": "text", "text": text})
+        return structured_data
+
+    name = element.tag
+    if not isinstance(name, str):
+        return []
+
+    if re.match(r'h[1-6]', name):
+        text = get_text(element)
+        if text:
+            structured_data.append({
+                "type": "heading",
+                "level": int(name[1]),
+                "text": text
+            })
+    elif name == 'p':
+        text_content = ''
+        links = []
+        for content in children(element):
+            if is_text(content):
+                text_content += node_string(content)
+            elif content.tag == 'a' and content.get('href') is not None:
+                link_text = get_text(content)
+                text_content += link_text
+                links.append({"text": link_text, "url": urljoin(base_url, content.get('href'))})
+
+        text_content = text_content.strip()
+        if text_content:
+            p_data = {"type": "paragraph", "text": re.sub(r'\s+', ' ', text_content)}
+            if links:
+                p_data['links'] = links
+            structured_data.append(p_data)
+    elif name in ('ul', 'ol'):
+        items = []
+        for li in element.iterchildren('li'):
+            item_text = get_text(li)
+            if item_text:
+                items.append(item_text)
+        if items:
+            structured_data.append({
+                "type": "list",
+                "style": "unordered" if name == 'ul' else "ordered",
+                "items": items
+            })
+    elif name == 'table':
+        table_data = parse_table(element)
+        if table_data['headers'] or table_data['rows']:
+            structured_data.append(table_data)
+    elif name in ('div', 'section', 'article', 'main', 'body'):
+        for child in children(element):
+            structured_data.extend(parse_element_to_structured_data(child, base_url))
+
+    return structured_data
+
+
+# --- syllabus_scraper.py の解析 ---
+
+def search_page_rows(root):
+    """
+    検索結果の2番目の <table class="list"> の行を (<td>のテキストのリスト, 科目のリンク (テキスト, href) またはNone,
+    リンクが無い場合は3列目の<td>のHTML) で返す。表が無い場合はNone (syllabus_scraper._search_page_rows の lxml 版)。
+    """
+    all_list_tables = [table for table in root.iter('table') if has_class(table, 'list')]
+    if len(all_list_tables) < 2:
+        return None
+    tbody = find(all_list_tables[1], 'tbody')
+    if tbody is None:
+        return []
+    data_rows = find_all(tbody, 'tr')
+    if data_rows and find(data_rows[0], 'th') is not None:
+        data_rows = data_rows[1:]
+
+    rows = []
+    for row in data_rows:
+        tds = find_all(row, 'td')
+        link = None
+        link_cell_html = None
+        if len(tds) >= 5:
+            for a_tag in tds[2].iterdescendants('a'):
+                href = a_tag.get('href')
+                if href is not None and re.search(r"JavaScript:showSbs", href):
+                    link = (get_text(a_tag), href)
+                    break
+            if link is None:
+                link_cell_html = etree.tostring(tds[2], encoding='unicode', with_tail=False)
+        rows.append(([get_text(td) for td in tds], link, link_cell_html))
+    return rows
+
+
+def next_page_href(root):
+    """「次のページ」のリンク (最初の <a title="next page">) のhref。無ければNone"""
+    for a_tag in root.iter('a'):
+        if a_tag.get('title') == "next page":
+            return a_tag.get('href')
+    return None
+
+
+def _single_string(element):
+    """BeautifulSoup の element.string (子が1つだけのときの文字列) と同じ値。無ければNone"""
+    nodes = list(children(element))
+    if len(nodes) != 1:
+        return None
+    node = nodes[0]
+    if is_text(node):
+        return node_string(node)
+    return _single_string(node)
+
+
+def extract_overview(root):
+    """科目詳細ページの「授業の概要と目標」の本文。見つからなければ空文字列"""
+    for th_tag in root.iter('th'):
+        string = _single_string(th_tag) if has_class(th_tag, 'sbs-show') else None
+        if string is None or not re.search(r'【授業の概要と目標】', string):
+            continue
+        tr_tag = next(th_tag.iterancestors('tr'), None)
+        tr_overview_container = next(tr_tag.itersiblings('tr'), None) if tr_tag is not None else None
+        if tr_overview_container is None:
+            return ''
+        td_overview = find(tr_overview_container, 'td', class_name='sbs-show')
+        if td_overview is None:
+            return ''
+        p_tag = find(td_overview, 'p', class_name='ct')
+        return get_text(p_tag) if p_tag is not None else ''
+    return ''
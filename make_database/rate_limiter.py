@@ -0,0 +1,55 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット。
+    1分あたりの補充量 (rate_per_minute) と、一度に貯められる上限 (capacity) を指定する。
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive.")
+        self.rate_per_second = rate_per_minute / 60.0
+        # 既定では1秒分だけバーストを許す (1分間の合計が上限を大きく超えないようにするため)
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate_per_second)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def acquire(self, amount=1):
+        """amount分のトークンが貯まるまで待ってから消費する。待った秒数を返す"""
+        # バケットの容量を超える要求は、満タンになるのを待ってから全量を消費する。
+        # 残高はマイナス (借り) になり、次の呼び出しは借りを返し終えるまで待つため、1分あたりの合計は上限を超えない
+        required = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= required:
+                    self.tokens -= amount
+                    return waited
+                wait_time = (required - self.tokens) / self.rate_per_second
+            time.sleep(wait_time)
+            waited += wait_time
+
+
+class RateLimiter:
+    """リクエスト数/分 (RPM) とトークン数/分 (TPM) の両方を制限するレートリミッター"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=0):
+        """1リクエスト分 (とtokens分) の枠を確保する。待った秒数を返す"""
+        waited = self.request_bucket.acquire(1)
+        if self.token_bucket is not None and tokens > 0:
+            waited += self.token_bucket.acquire(tokens)
+        return waited
@@ -4,11 +4,86 @@ import re
 import time
 import csv
 import os
+import json
+import queue
+import threading
 from datetime import datetime
 import argparse
 from urllib.parse import urljoin  #
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+try:
+    from make_database.crawler import HostLimiter
+    from make_database.http_cache import HttpCache, ChangeManifest, ERROR, UNCHANGED_STATUSES
+    from make_database import lxml_parser
+except ImportError:
+    from crawler import HostLimiter
+    from http_cache import HttpCache, ChangeManifest, ERROR, UNCHANGED_STATUSES
+    import lxml_parser
 # CSV保存先のディレクトリ
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "..","data")
+# 詳細ページのHTTPキャッシュと、今回のクロールで変わった詳細ページの一覧 (後段の処理が差分だけを扱うためのマニフェスト)
+HTTP_CACHE_PATH = os.path.join(OUTPUT_DIR, "cache", "http_cache.sqlite3")
+CHANGES_PATH = os.path.join(OUTPUT_DIR, "cache", "changed_pages_syllabus.json")
+# 取得し終わった科目を1行ずつ追記するチェックポイント (中断した場合は次回そこから再開する)
+CHECKPOINT_PATH = os.path.join(OUTPUT_DIR, "cache", "syllabus_checkpoint_{year}.jsonl")
+DETAIL_WORKERS = 4 # 詳細ページを取得するスレッド数
+DETAIL_REQUESTS_PER_SECOND = 2.0 # 詳細ページのホストへの1秒間のリクエスト数 (以前の0.5秒間隔に相当)
+MAX_CONCURRENT_DETAILS = 2 # 詳細ページのホストに同時に送るリクエスト数の上限
+LIST_PAGE_WAIT = 2 # 検索結果のページ間の待機秒数
+# HTMLの解析に使うバックエンド ('bs4' または 'lxml'。lxmlが入っていれば 'lxml')。--parser で変えられる
+PARSER_BACKEND = lxml_parser.resolve_parser_backend()
+
+class SyllabusCheckpoint:
+    """
+    概要を取得し終わった科目をJSONLに1行ずつ追記する。
+    途中でプロセスが落ちても書き終わった行は残るため、次回は残っていない科目の詳細ページだけを取得すればよい。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def load(self):
+        """取得に成功した科目を {キー: (科目の情報, 詳細ページの状態)} で返す。最後の書きかけの行は無視する"""
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record['ok']:
+                    completed[record['key']] = (record['item'], record.get('status'))
+        return completed
+
+    def append(self, key, item, ok, status=None):
+        with self.lock:
+            if self.file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(json.dumps({'key': key, 'ok': ok, 'status': status, 'item': item}, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def remove(self):
+        """全件を取得し終わったらチェックポイントを消す"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _item_key(item):
+    """検索結果の1行を識別するキー (同じ詳細ページが複数の区分に出ることがあるため、行の内容全体から作る)"""
+    return json.dumps([item[name] for name in ('category', 'period', 'subject_name', 'schedule', 'teacher_name', 'detail_url')],
+                      ensure_ascii=False)
 
 def _fetch_page(session, url, method='GET', payload=None):
     """指定されたURLとメソッドでページを取得するヘルパー関数 (sessionを使用)"""
@@ -37,56 +112,76 @@ def _fetch_page(session, url, method='GET', payload=None):
         print(f"ページの取得中に予期せぬエラーが発生しました ({url}): {e}")
         raise # エラーを再発生させる
 
-def _extract_data_from_search_page(soup):
-    """検索結果のHTMLからカテゴリ、開講期間、科目名、時間割、教員名、詳細URLの情報を抽出する"""
-    data = []
-    
+def _search_page_rows(soup):
+    """
+    検索結果の2番目の <table class="list"> の行を (<td>のテキストのリスト, 科目のリンク (テキスト, href) またはNone,
+    リンクが無い場合は3列目の<td>のHTML) で返す。表が無い場合はNone。lxml で解析する場合は lxml_parser.search_page_rows を使う
+    """
     # 2番目の <table class="list"> を取得
     all_list_tables = soup.find_all('table', class_='list')
     if len(all_list_tables) < 2:
-        print("DEBUG: 2番目のテーブル (class='list') が見つかりませんでした。")
-        return data
-    
+        return None
+
     main_data_table = all_list_tables[1] # 2番目のテーブルを選択
-    # print("DEBUG: 2番目のメインのテーブル (class='list') が見つかりました。") # Debug
 
     # tbody内のすべての<tr>要素を取得
     tbody = main_data_table.find('tbody')
     if not tbody:
         print("DEBUG: メインのテーブル内に<tbody>が見つかりませんでした。")
-        return data
+        return []
+
+    data_rows = tbody.find_all('tr')
 
-    data_rows = tbody.find_all('tr') 
-    # print(f"DEBUG: <table><tbody>直下の<tr>要素の数: {len(data_rows)}") # Debug
-    
     # 最初の<tr>はヘッダーなのでスキップ (<th>タグがある行)
     if len(data_rows) > 0 and data_rows[0].find('th'):
-        data_rows = data_rows[1:] 
-        # print(f"DEBUG: ヘッダーをスキップした後のデータ行の数: {len(data_rows)}") # Debug
-    
+        data_rows = data_rows[1:]
+
+    rows = []
+    for row in data_rows:
+        # 各行の<td>要素を取得 (class='list-odd-left' は指定せず、すべてのtdを取得)
+        tds = row.find_all('td')
+        link = None
+        link_cell_html = None
+        if len(tds) >= 5:
+            subject_link_tag = tds[2].find('a', href=re.compile(r"JavaScript:showSbs"))
+            if subject_link_tag:
+                link = (subject_link_tag.get_text(strip=True), subject_link_tag.get('href'))
+            else:
+                link_cell_html = str(tds[2])
+        rows.append(([td.get_text(strip=True) for td in tds], link, link_cell_html))
+    return rows
+
+def _extract_data_from_search_page(soup):
+    """検索結果のHTML (BeautifulSoup) からカテゴリ、開講期間、科目名、時間割、教員名、詳細URLの情報を抽出する"""
+    return _items_from_search_rows(_search_page_rows(soup))
+
+def _items_from_search_rows(data_rows):
+    """検索結果の行 (_search_page_rows / lxml_parser.search_page_rows の戻り値) から科目の情報を作る"""
+    data = []
+    if data_rows is None:
+        print("DEBUG: 2番目のテーブル (class='list') が見つかりませんでした。")
+        return data
+
     if not data_rows:
         # print("DEBUG: データ行が見つかりませんでした。")
         return data
 
-    for i, row in enumerate(data_rows):
-        # 各行の<td>要素を取得 (class='list-odd-left' は指定せず、すべてのtdを取得)
-        tds = row.find_all('td')
+    for i, (tds, link, link_cell_html) in enumerate(data_rows):
         # print(f"DEBUG: 行 {i+1}: <td>要素の数: {len(tds)}") # Debug
         
         # 必要な情報が含まれる<td>が十分にあるか確認
         if len(tds) >= 5: # カテゴリ、開講期間、科目名、時間割、教員の5つ
-            category = tds[0].get_text(strip=True)
-            period = tds[1].get_text(strip=True) # 開講期間
-            
-            subject_link_tag = tds[2].find('a', href=re.compile(r"JavaScript:showSbs"))
-            subject_name = subject_link_tag.get_text(strip=True) if subject_link_tag else ""
-            
-            schedule = tds[3].get_text(strip=True) # 時間割
-            teacher_name = tds[4].get_text(strip=True)
+            category = tds[0]
+            period = tds[1] # 開講期間
+
+            subject_name = link[0] if link else ""
+
+            schedule = tds[3] # 時間割
+            teacher_name = tds[4]
 
             detail_url = ""
-            if subject_link_tag:
-                href_text = subject_link_tag.get('href') # href属性を取得
+            if link:
+                href_text = link[1] # href属性を取得
                 print(f"DEBUG: Row {i+1}, Subject Link href: {href_text}") # Debug: href属性の値を表示
                 if href_text: # href属性が存在する場合のみ処理
                     year = ""
@@ -116,7 +211,7 @@ def _extract_data_from_search_page(soup):
                 else:
                     print(f"DEBUG: Row {i+1}, Subject link tag found but href attribute is missing.") # Debug: href属性がない場合
             else:
-                print(f"DEBUG: Row {i+1}, Subject link tag not found in tds[2]. HTML of tds[2]: {tds[2]}") # Debug: リンクタグが見つからない場合
+                print(f"DEBUG: Row {i+1}, Subject link tag not found in tds[2]. HTML of tds[2]: {link_cell_html}") # Debug: リンクタグが見つからない場合
 
             if subject_name: # 科目名が取得できた場合のみ追加
                 data.append({
@@ -133,52 +228,89 @@ def _extract_data_from_search_page(soup):
             print(f"DEBUG: 行 {i+1}: 必要な数の<td>要素が見つかりませんでした (期待値 >= 5, 取得値 {len(tds)})。") # Debug
     return data
 
-def get_syllabus_overview(session, detail_url): # session を引数に追加
-    """科目詳細ページから「授業の概要と目標」を抽出する"""
+def _extract_overview(soup):
+    """科目詳細ページ (BeautifulSoup) から「授業の概要と目標」の本文を抽出する。見つからなければ空文字列"""
+    overview_text = ""
+    
+    # <th>タグで「授業の概要と目標」を探す
+    th_tag = soup.find('th', class_='sbs-show', string=re.compile(r'【授業の概要と目標】'))
+    
+    if th_tag:
+        print(f"DEBUG: '【授業の概要と目標】' のthタグが見つかりました。") # デバッグ出力
+        # thタグの親の<tr>を取得し、その次の兄弟<tr>を探す
+        tr_overview_container = th_tag.find_parent('tr').find_next_sibling('tr')
+        
+        if tr_overview_container:
+            # その<tr>の中の<td>タグを探す
+            td_overview = tr_overview_container.find('td', class_='sbs-show')
+            if td_overview:
+                # その<td>タグの中の<p class="ct">タグからテキストを抽出
+                p_tag = td_overview.find('p', class_='ct')
+                if p_tag:
+                    overview_text = p_tag.get_text(strip=True)
+                    print(f"DEBUG: 概要を抽出しました (先頭100文字): {overview_text[:100]}...") # デバッグ出力
+                else:
+                    print(f"DEBUG: td.sbs-show 内に p.ct タグが見つかりませんでした。")
+            else:
+                print(f"DEBUG: 概要コンテナのtr内に td.sbs-show タグが見つかりませんでした。")
+        else:
+            print(f"DEBUG: '【授業の概要と目標】' のthタグの次のtrが見つかりませんでした。")
+    else:
+        print(f"DEBUG: '【授業の概要と目標】' のthタグが見つかりませんでした。") # デバッグ出力
+        # h3タグが見つからない場合、HTML全体を一部出力して構造を確認
+        # print(f"DEBUG: 詳細ページHTML (thタグが見つからなかった場合、先頭1000文字):\n{response.text[:1000]}...") # デバッグ出力
+
+    return overview_text
+
+def extract_overview(html, backend=None):
+    """科目詳細ページのHTMLから「授業の概要と目標」の本文を抽出する。backend を省略した場合は PARSER_BACKEND で解析する"""
+    if (backend or PARSER_BACKEND) == 'lxml':
+        root = lxml_parser.parse_document(html)
+        return lxml_parser.extract_overview(root) if root is not None else ""
+    return _extract_overview(BeautifulSoup(html, 'html.parser'))
+
+def parse_search_page(html, backend=None):
+    """検索結果のページから科目の情報のリストと、次のページへのリンク (無ければNone) を返す"""
+    if (backend or PARSER_BACKEND) == 'lxml':
+        root = lxml_parser.parse_document(html)
+        if root is None:
+            return [], None
+        return _items_from_search_rows(lxml_parser.search_page_rows(root)), lxml_parser.next_page_href(root)
+    soup = BeautifulSoup(html, 'html.parser')
+    next_page_tag = soup.find('a', title="next page")
+    next_page_href = next_page_tag['href'] if next_page_tag and next_page_tag.has_attr('href') else None
+    return _extract_data_from_search_page(soup), next_page_href
+
+def get_syllabus_overview(session, detail_url, cache=None, manifest=None): # session を引数に追加
+    """
+    科目詳細ページから「授業の概要と目標」を抽出する。
+    cache (と manifest) を指定した場合は条件付きリクエストを送り、前回から変わっていないページは解析せずに前回の概要を返す。
+    """
     if not detail_url:
         print(f"DEBUG: 詳細URLが空のため、概要を抽出できません。")
         raise ValueError("詳細URLが空です。") # エラーを発生させる
 
     print(f"DEBUG: 概要抽出中 - 詳細ページURL: {detail_url}") # デバッグ出力
     try:
-        response = session.get(detail_url) # session を使用
-        response.encoding = response.apparent_encoding
+        headers = cache.request_headers(detail_url) if cache is not None else None
+        response = session.get(detail_url, headers=headers) # session を使用
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        if cache is not None:
+            status, entry = cache.check(detail_url, response)
+            if status in UNCHANGED_STATUSES:
+                cache.touch(detail_url, response)
+                manifest.record(detail_url, status)
+                print(f"DEBUG: 詳細ページは前回から変わっていません ({status})。前回の概要を使います。")
+                return entry['result']['overview']
+        response.encoding = response.apparent_encoding
+        overview_text = extract_overview(response.text)
 
-        overview_text = ""
-        
-        # <th>タグで「授業の概要と目標」を探す
-        th_tag = soup.find('th', class_='sbs-show', string=re.compile(r'【授業の概要と目標】'))
-        
-        if th_tag:
-            print(f"DEBUG: '【授業の概要と目標】' のthタグが見つかりました。") # デバッグ出力
-            # thタグの親の<tr>を取得し、その次の兄弟<tr>を探す
-            tr_overview_container = th_tag.find_parent('tr').find_next_sibling('tr')
-            
-            if tr_overview_container:
-                # その<tr>の中の<td>タグを探す
-                td_overview = tr_overview_container.find('td', class_='sbs-show')
-                if td_overview:
-                    # その<td>タグの中の<p class="ct">タグからテキストを抽出
-                    p_tag = td_overview.find('p', class_='ct')
-                    if p_tag:
-                        overview_text = p_tag.get_text(strip=True)
-                        print(f"DEBUG: 概要を抽出しました (先頭100文字): {overview_text[:100]}...") # デバッグ出力
-                    else:
-                        print(f"DEBUG: td.sbs-show 内に p.ct タグが見つかりませんでした。")
-                else:
-                    print(f"DEBUG: 概要コンテナのtr内に td.sbs-show タグが見つかりませんでした。")
-            else:
-                print(f"DEBUG: '【授業の概要と目標】' のthタグの次のtrが見つかりませんでした。")
-        else:
-            print(f"DEBUG: '【授業の概要と目標】' のthタグが見つかりませんでした。") # デバッグ出力
-            # h3タグが見つからない場合、HTML全体を一部出力して構造を確認
-            # print(f"DEBUG: 詳細ページHTML (thタグが見つからなかった場合、先頭1000文字):\n{response.text[:1000]}...") # デバッグ出力
-        
         if not overview_text:
             raise ValueError(f"詳細ページ {detail_url} から「授業の概要と目標」を抽出できませんでした。")
 
+        if cache is not None:
+            cache.store(detail_url, response, {'overview': overview_text})
+            manifest.record(detail_url, status)
         return overview_text
     except requests.exceptions.RequestException as e:
         print(f"詳細ページの取得中にエラーが発生しました ({detail_url}): {e}")
@@ -187,66 +319,130 @@ def get_syllabus_overview(session, detail_url): # session を引数に追加
         print(f"「授業の概要と目標」の抽出中に予期せぬエラーが発生しました ({detail_url}): {e}")
         raise # エラーを再発生させる
 
-def scrape_all_syllabus_data_with_overview(year='2025'):
+def scrape_all_syllabus_data_with_overview(year='2025', cache=None, manifest=None, checkpoint=None,
+                                           workers=DETAIL_WORKERS, requests_per_second=DETAIL_REQUESTS_PER_SECOND):
     """
     全シラバス検索結果からカテゴリ、科目名、教員名、授業概要をスクレイピングする (ページネーション対応)
+    検索結果のページを順にたどる間に、見つかった科目の詳細ページを workers 個のスレッドで並行して取得する
+    (詳細ページのホストへのリクエストは requests_per_second 件/秒まで)。
+    cacheを指定した場合、変わっていない詳細ページは解析し直さない (検索結果のページは毎回取得する)。
+    checkpointを指定した場合、取得し終わった科目を追記し、前回中断した実行で取得済みの科目は取得しない。
+    戻り値は (科目の情報のリスト, 検索結果を最終ページまでたどれたか)。途中のページの取得に失敗した場合は
+    それまでの結果と False を返す (チェックポイントを消したり、見つからなかった科目を削除扱いにしたりしてはいけない)。
     """
-    all_extracted_data = []
-    current_url = SEARCH_URL
-    page_num = 1
-    
-    # requests.Session() を作成
-    with requests.Session() as session:
-        # 最初のページはPOSTリクエストで取得
-        initial_payload = {
-            'sbj': '',  # 全件取得のため空
-            'tch': '',
-            'txt': '',
-            'year': year
-        }
-        html_content = _fetch_page(session, current_url, method='POST', payload=initial_payload) # session を渡す
-
-        if not html_content:
-            print("初期ページの取得に失敗しました。")
-            return all_extracted_data
-
-        while True:
-            print(f"スクレイピング中: ページ {page_num}")
-            
-            soup = BeautifulSoup(html_content, 'html.parser')
-            
-            # データ抽出
-            page_data = _extract_data_from_search_page(soup)
-            
-            # 各科目に対して詳細情報を取得
-            for item in page_data:
+    completed = checkpoint.load() if checkpoint is not None else {}
+    if completed:
+        print(f"チェックポイントから {len(completed)} 件の科目を再開します。")
+    results = {key: item for key, (item, _status) in completed.items()}
+    results_lock = threading.Lock()
+    row_keys = [] # 検索結果に出てきた順の行のキー (CSVの並び順)
+    seen_keys = set()
+    # 検索結果の取得が詳細ページの取得より先に進みすぎないよう、待ち行列の長さを制限する
+    detail_queue = queue.Queue(maxsize=workers * 4)
+    host_limiter = HostLimiter(requests_per_second, MAX_CONCURRENT_DETAILS)
+    stop = threading.Event()
+    complete = False
+
+    def fetch_details():
+        # requests.Session はスレッド間で共有しない
+        with requests.Session() as detail_session:
+            while True:
+                job = detail_queue.get()
+                if job is None:
+                    return
+                if stop.is_set():
+                    continue
+                key, item = job
                 try: # 個別の概要取得でエラーが発生しても全体を止めないようにtry-exceptを追加
-                    overview = get_syllabus_overview(session, item['detail_url'])
-                    item['overview'] = overview
+                    item['overview'] = host_limiter.request(
+                        item['detail_url'], lambda: get_syllabus_overview(detail_session, item['detail_url'], cache, manifest)
+                    )
+                    ok = True
                 except (requests.exceptions.RequestException, ValueError, Exception) as e:
                     print(f"WARNING: 科目 '{item.get('subject_name', '不明')}' の概要取得中にエラー: {e}")
                     item['overview'] = f"エラー: {e}" # エラーメッセージを概要として記録
-                all_extracted_data.append(item)
-                time.sleep(0.5) # 詳細ページ取得間の短い待機を延長
-                
-            # 次のページへのリンクを探す
-            next_page_tag = soup.find('a', title="next page")
-            
-            if next_page_tag and next_page_tag.has_attr('href'):
-                next_page_relative_url = next_page_tag['href'].replace('&amp;', '&')
-                # current_url = f"{BASE_URL}{next_page_relative_url.lstrip('/')}" # 絶対URLを構築
-                current_url = urljoin(current_url, next_page_relative_url) 
-                page_num += 1
-                time.sleep(2) # ページ間の待機を延長
-                html_content = _fetch_page(session, current_url, method='GET') # session を渡す
-                if not html_content:
-                    print(f"ページ {page_num} の取得に失敗しました。")
-                    break # 取得失敗時は終了
-            else:
-                print(f"ページ {page_num} で 'Next >>' リンクが見つかりませんでした。最終ページです。")
-                break # 次のページへのリンクがなければ終了
-                
-        return all_extracted_data
+                    if manifest is not None and item['detail_url']:
+                        manifest.record(item['detail_url'], ERROR, error=str(e))
+                    ok = False
+                with results_lock:
+                    results[key] = item
+                if checkpoint is not None:
+                    status = manifest.status(item['detail_url']) if manifest is not None else None
+                    checkpoint.append(key, item, ok, status)
+
+    threads = [threading.Thread(target=fetch_details, name=f"syllabus-detail-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    current_url = SEARCH_URL
+    page_num = 1
+    try:
+        # requests.Session() を作成
+        with requests.Session() as session:
+            # 最初のページはPOSTリクエストで取得
+            initial_payload = {
+                'sbj': '',  # 全件取得のため空
+                'tch': '',
+                'txt': '',
+                'year': year
+            }
+            html_content = _fetch_page(session, current_url, method='POST', payload=initial_payload) # session を渡す
+
+            if not html_content:
+                print("初期ページの取得に失敗しました。")
+                return [], False
+
+            while True:
+                print(f"スクレイピング中: ページ {page_num}")
+
+                # データ抽出
+                page_data, next_page_href = parse_search_page(html_content)
+
+                # 各科目の詳細ページは取得用のスレッドに渡す
+                for item in page_data:
+                    key = _item_key(item)
+                    if key not in seen_keys:
+                        seen_keys.add(key)
+                        if key in completed:
+                            status = completed[key][1]
+                            if manifest is not None and status is not None:
+                                manifest.record(item['detail_url'], status, resumed=True)
+                        else:
+                            detail_queue.put((key, item))
+                    row_keys.append(key)
+
+                # 次のページへのリンクがあればたどる
+                if next_page_href:
+                    next_page_relative_url = next_page_href.replace('&amp;', '&')
+                    current_url = urljoin(current_url, next_page_relative_url)
+                    page_num += 1
+                    time.sleep(LIST_PAGE_WAIT) # ページ間の待機
+                    html_content = _fetch_page(session, current_url, method='GET') # session を渡す
+                    if not html_content:
+                        print(f"ページ {page_num} の取得に失敗しました。")
+                        break # 取得失敗時は終了
+                elif page_num > 1 and not page_data:
+                    # 途中のページが空 (エラーページなど) の場合は、最終ページまで取得できたとはみなさない
+                    print(f"ページ {page_num} に科目が見つかりませんでした。検索結果を最後まで取得できなかった可能性があります。")
+                    break
+                else:
+                    print(f"ページ {page_num} で 'Next >>' リンクが見つかりませんでした。最終ページです。")
+                    complete = True
+                    break # 次のページへのリンクがなければ終了
+    except KeyboardInterrupt:
+        # Ctrl+Cで中断した場合は待ち行列に残った科目を取得しない (取得済みの科目はチェックポイントに残る)。
+        # 検索結果の取得に失敗した場合は、待ち行列に入っている科目を取得し終えてから終了する
+        stop.set()
+        raise
+    finally:
+        for _ in threads:
+            detail_queue.put(None)
+        for thread in threads:
+            thread.join()
+        if checkpoint is not None:
+            checkpoint.close()
+
+    return [results[key] for key in row_keys if key in results], complete
 
 if __name__ == "__main__":
     print("全シラバス検索結果と授業概要のスクレイピングを開始します...\n")
@@ -257,16 +453,36 @@ if __name__ == "__main__":
         default="https://ccap02.musabi.ac.jp/",
         help="ベースとなるURL（例: https://example.com/）"
     )
+    parser.add_argument("--year", type=str, default="2025", help="シラバスの年度")
+    parser.add_argument("--workers", type=int, default=DETAIL_WORKERS, help="詳細ページを並行して取得するスレッド数")
+    parser.add_argument("--rate", type=float, default=DETAIL_REQUESTS_PER_SECOND,
+                        help="詳細ページのホストへの1秒間のリクエスト数")
+    parser.add_argument("--fresh", action="store_true", help="前回中断したときのチェックポイントを使わず最初から取得する")
+    parser.add_argument("--parser", choices=lxml_parser.PARSER_BACKENDS, default=PARSER_BACKEND,
+                        help="HTMLの解析に使うバックエンド (bs4: BeautifulSoup + html.parser、lxml: 高速。既定はlxmlが入っていればlxml)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="HTTPキャッシュを使わず全ての詳細ページを取得・解析し直す (変更ページのマニフェストも書かない)")
     args = parser.parse_args()
 
     BASE_URL = args.base_url.rstrip("/")
     SEARCH_URL = f"{BASE_URL}/syllabus/pubSearchResult.php"
     SYLLABUS_DETAIL_BASE_URL = f"{BASE_URL}/syllabus/html/"
+    PARSER_BACKEND = lxml_parser.resolve_parser_backend(args.parser)
 
     # 出力ディレクトリが存在しない場合は作成
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    extracted_data = scrape_all_syllabus_data_with_overview()
+    # 詳細ページのURLには年度が含まれるため、年度ごとに分けてキャッシュする
+    cache_scope = f"syllabus_{args.year}"
+    cache = None if args.no_cache else HttpCache(HTTP_CACHE_PATH, cache_scope)
+    manifest = None if args.no_cache else ChangeManifest(CHANGES_PATH, cache_scope)
+
+    checkpoint = SyllabusCheckpoint(CHECKPOINT_PATH.format(year=args.year))
+    if args.fresh:
+        checkpoint.remove()
+
+    extracted_data, complete = scrape_all_syllabus_data_with_overview(args.year, cache, manifest, checkpoint,
+                                                            workers=args.workers, requests_per_second=args.rate)
     
     if extracted_data:
         print(f"\n合計で {len(extracted_data)} 件の科目情報が見つかりました。")
@@ -283,5 +499,19 @@ if __name__ == "__main__":
             writer.writerows(extracted_data)
                 
         print(f"\nスクレイピング結果を {csv_filename} に保存しました。")
+        if complete:
+            # 検索結果を最後まで取得してCSVを書き終えたので、次回は最初から取得する
+            checkpoint.remove()
+        else:
+            print("WARNING: 検索結果を最後まで取得できませんでした。次回はチェックポイントから再開します。")
+        if cache is not None:
+            if complete:
+                # 検索結果を最後まで取得できた場合だけ、一覧から消えた科目を削除されたものとして記録する
+                manifest.mark_removed(cache)
+            manifest.write()
+            print(f"詳細ページ: {manifest.summary()}")
+            print(f"変更ページのマニフェストを {CHANGES_PATH} に保存しました。")
     else:
-        print("科目情報が見つかりませんでした。スクレイピングを終了します。")
\ No newline at end of file
+        print("科目情報が見つかりませんでした。スクレイピングを終了します。")
+    if cache is not None:
+        cache.close()
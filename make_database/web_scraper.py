@@ -8,15 +8,38 @@ import time
 import re
 import json
 import argparse
+
+# make_databaseディレクトリから直接実行される場合とパッケージとして読み込まれる場合の両方に対応
+try:
+    from make_database.crawler import (
+        Crawler, FETCH_WORKERS, PARSE_WORKERS, REQUESTS_PER_SECOND_PER_HOST, MAX_CONCURRENT_PER_HOST,
+    )
+    from make_database.http_cache import HttpCache, ChangeManifest, ERROR, UNCHANGED_STATUSES
+    from make_database import lxml_parser
+except ImportError:
+    from crawler import Crawler, FETCH_WORKERS, PARSE_WORKERS, REQUESTS_PER_SECOND_PER_HOST, MAX_CONCURRENT_PER_HOST
+    from http_cache import HttpCache, ChangeManifest, ERROR, UNCHANGED_STATUSES
+    import lxml_parser
 # --- 設定 ---
 
 SAVE_DIR = os.path.join(os.path.dirname(__file__), '..','data','scraped_data_student_menu')
 WAIT_TIME = 1
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'http_cache.sqlite3')
+HTTP_CACHE_SCOPE = 'student_menu'
+# 今回のクロールで変わったページの一覧 (後段の処理が差分だけを扱うためのマニフェスト)
+CHANGES_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'cache', 'changed_pages_student_menu.json')
+# HTMLの解析に使うバックエンド ('bs4' または 'lxml'。lxmlが入っていれば 'lxml')。--parser で変えられる
+PARSER_BACKEND = lxml_parser.resolve_parser_backend()
+# <main>から取り除く要素 (ナビゲーション・ボタン・スクリプトなど)
+REMOVED_TAGS = ['header', 'footer', 'nav', 'script', 'style']
+REMOVED_CLASSES = ['p-main-visual__campus-link', 'p-carousel', 'p-utility-link', 'p-conversion', 'f-small', 'c-local-nav', 'p-section__button']
 SKIPPED_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.zip', '.mov', '.mp4', '.xls', '.xlsx', '.doc', '.docx', '.ppt', '.pptx']
 
 def get_student_menu_links(url, session):
     """
     トップページから「在学生の方（学2課程）」メニューに関連するリンクを収集する。
+    戻り値は (リンクのリスト, 一覧を取得できたか)。トップページの取得に失敗したかメニューが見つからなかった場合、
+    一覧を取得できたかは False になる (今回見つからなかったページを削除されたものとして扱ってはいけない)。
     """
     target_links = set()
     print(f"Fetching top page to find student menu links: {url}")
@@ -39,9 +62,11 @@ def get_student_menu_links(url, session):
                             target_links.add(full_url)
     except requests.exceptions.RequestException as e:
         print(f"Could not get page {url}: {e}")
+        return [], False
     except Exception as e:
         print(f"An error occurred while finding links: {e}")
-    return list(target_links)
+        return [], False
+    return list(target_links), bool(target_links)
 
 def parse_table(table_tag):
     """
@@ -160,53 +185,136 @@ def parse_element_to_structured_data(element, base_url):
 
     return structured_data
 
-def scrape_and_save_structured_json(url, session):
+def output_path(url):
+    """ページのJSONの保存先 (URLのパスから決まる)"""
+    parsed_url = urlparse(url)
+    path_segment = parsed_url.path.replace('/campus-2nd', '').strip('/').replace('/', '_')
+    if not path_segment:
+        path_segment = 'top'
+    return os.path.join(SAVE_DIR, f"{path_segment}.json")
+
+def parse_page(url, html, backend=None):
     """
-    URLからコンテンツをスクレイピングし、構造化されたJSONとして保存する。
+    ページのHTMLを解析し、構造化されたデータ (url・title・content の辞書) を返す。<main>が無いページはNone。
+    backend を省略した場合は PARSER_BACKEND で解析する。
     """
-    try:
-        time.sleep(WAIT_TIME)
-        response = session.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-
+    if (backend or PARSER_BACKEND) == 'lxml':
+        root = lxml_parser.parse_document(html)
+        if root is None:
+            return None
+        title_tag = next(root.iter('title'), None)
+        title = lxml_parser.get_text(title_tag) if title_tag is not None else 'No Title'
+        main_content = next(root.iter('main'), None)
+        if main_content is None:
+            return None
+        lxml_parser.remove_elements(main_content, REMOVED_TAGS, REMOVED_CLASSES)
+        children = lxml_parser.children(main_content)
+        parse_element = lxml_parser.parse_element_to_structured_data
+    else:
+        soup = BeautifulSoup(html, 'html.parser')
         title = soup.find('title').get_text(strip=True) if soup.find('title') else 'No Title'
         main_content = soup.find('main')
+        if not main_content:
+            return None
+        for tag in main_content.select(', '.join(REMOVED_TAGS + ['.' + class_name for class_name in REMOVED_CLASSES])):
+            tag.decompose()
+        children = main_content.children
+        parse_element = parse_element_to_structured_data
+
+    # 構造化データに変換
+    content_structure = []
+    for child in children:
+        content_structure.extend(parse_element(child, url))
+
+    return {
+        'url': url,
+        'title': title,
+        'content': content_structure
+    }
+
+def save_structured_json(url, html):
+    """
+    取得したページのHTMLを解析し、構造化されたJSONとして保存する。
+    保存したファイルのパスを返す (<main>が無いページはNone)。
+    """
+    data = parse_page(url, html)
+    if data is not None:
+        filename = output_path(url)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"Saved: {filename}")
+        return filename
 
-        if main_content:
-            for tag in main_content.select('header, footer, nav, script, style, .p-main-visual__campus-link, .p-carousel, .p-utility-link, .p-conversion, .f-small, .c-local-nav, .p-section__button'):
-                tag.decompose()
-
-            # 構造化データに変換
-            content_structure = []
-            for child in main_content.children:
-                content_structure.extend(parse_element_to_structured_data(child, url))
-
-            data = {
-                'url': url,
-                'title': title,
-                'content': content_structure
-            }
-
-            parsed_url = urlparse(url)
-            path_segment = parsed_url.path.replace('/campus-2nd', '').strip('/').replace('/', '_')
-            if not path_segment:
-                path_segment = 'top'
-            
-            filename = os.path.join(SAVE_DIR, f"{path_segment}.json")
-
-            os.makedirs(os.path.dirname(filename), exist_ok=True)
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"Saved: {filename}")
-            return True
+    return None
 
+def _output_reusable(entry):
+    """前回保存したJSONが残っていれば (<main>が無く保存しなかったページも)、変わっていないページは解析し直さなくてよい"""
+    file_name = entry['result'].get('file')
+    return file_name is None or os.path.exists(os.path.join(SAVE_DIR, file_name))
+
+def process_page(url, response, cache=None, manifest=None):
+    """
+    取得したレスポンスを解析して保存する。cache (と manifest) を指定した場合は、
+    前回から変わっていないページの解析と保存を省略し、ページの状態をマニフェストに記録する。
+    保存したファイルのパスを返す (保存しなかった場合はNone)。
+    """
+    if cache is None:
+        return save_structured_json(url, response.content)
+    status, _entry = cache.check(url, response, reusable=_output_reusable)
+    if status in UNCHANGED_STATUSES:
+        cache.touch(url, response)
+        manifest.record(url, status)
+        print(f"Unchanged: {url}")
+        return None
+    filename = save_structured_json(url, response.content)
+    file_name = os.path.basename(filename) if filename else None
+    cache.store(url, response, {'file': file_name})
+    manifest.record(url, status, file=file_name)
+    return filename
+
+def scrape_and_save_structured_json(url, session, cache=None, manifest=None):
+    """
+    URLからコンテンツをスクレイピングし、構造化されたJSONとして保存する。
+    cacheを指定した場合は条件付きリクエストを送り、変わっていないページは保存し直さない。
+    """
+    try:
+        time.sleep(WAIT_TIME)
+        headers = cache.request_headers(url, reusable=_output_reusable) if cache is not None else None
+        response = session.get(url, headers=headers, timeout=10)
+        response.raise_for_status()
+        return process_page(url, response, cache, manifest) is not None
     except requests.exceptions.RequestException as e:
         print(f"Could not scrape {url}: {e}")
+        if manifest is not None:
+            manifest.record(url, ERROR, error=str(e))
     except Exception as e:
         print(f"Error processing {url} for saving: {e}")
+        if manifest is not None:
+            manifest.record(url, ERROR, error=str(e))
     return False
 
+def scrape_concurrently(urls, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS,
+                        requests_per_second=REQUESTS_PER_SECOND_PER_HOST, max_per_host=MAX_CONCURRENT_PER_HOST,
+                        cache=None, manifest=None):
+    """
+    複数のページを並行してダウンロードし、解析と保存は別のスレッドで行う。
+    固定の待ち時間の代わりに、ホストごとのリクエスト数/秒と同時接続数の上限で負荷を抑える。戻り値は CrawlStats。
+    """
+    crawler = Crawler(fetch_workers=fetch_workers, parse_workers=parse_workers,
+                      requests_per_second_per_host=requests_per_second, max_concurrent_per_host=max_per_host)
+
+    def on_error(url, error):
+        print(f"Could not scrape {url}: {error}")
+        if manifest is not None:
+            manifest.record(url, ERROR, error=str(error))
+
+    request_headers = None
+    if cache is not None:
+        request_headers = lambda url: cache.request_headers(url, reusable=_output_reusable)
+    return crawler.crawl(urls, lambda url, response: process_page(url, response, cache, manifest),
+                         on_error=on_error, request_headers=request_headers)
+
 if __name__ == '__main__':
     os.makedirs(SAVE_DIR, exist_ok=True)
     print(f"Data will be saved in: {SAVE_DIR}")
@@ -217,11 +325,23 @@ if __name__ == '__main__':
         default="https://cc.musabi.ac.jp/campus-2nd/",
         help="ベースとなるURL（例: https://example.com/）"
     )
+    parser.add_argument("--concurrent", action="store_true", help="ページを並行して取得する (既定は1ページずつ)")
+    parser.add_argument("--workers", type=int, default=FETCH_WORKERS, help="--concurrent: 同時にダウンロードするスレッド数")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="--concurrent: 解析・保存するスレッド数")
+    parser.add_argument("--rate", type=float, default=REQUESTS_PER_SECOND_PER_HOST,
+                        help="--concurrent: 1ホストあたりの1秒間のリクエスト数")
+    parser.add_argument("--max-per-host", type=int, default=MAX_CONCURRENT_PER_HOST,
+                        help="--concurrent: 1ホストに同時に送るリクエスト数の上限")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="HTTPキャッシュを使わず全ページを取得・保存し直す (変更ページのマニフェストも書かない)")
+    parser.add_argument("--parser", choices=lxml_parser.PARSER_BACKENDS, default=PARSER_BACKEND,
+                        help="HTMLの解析に使うバックエンド (bs4: BeautifulSoup + html.parser、lxml: 高速。既定はlxmlが入っていればlxml)")
     args = parser.parse_args()
     BASE_URL = args.base_url.rstrip("/")
+    PARSER_BACKEND = lxml_parser.resolve_parser_backend(args.parser)
 
     with requests.Session() as session:
-        target_links = get_student_menu_links(BASE_URL, session)
+        target_links, links_complete = get_student_menu_links(BASE_URL, session)
         if BASE_URL not in target_links:
             target_links.append(BASE_URL)
 
@@ -234,9 +354,30 @@ if __name__ == '__main__':
                 print(f"- {link}")
             print("")
 
-            saved_count = 0
-            for link in sorted(target_links):
-                 if scrape_and_save_structured_json(link, session):
-                     saved_count += 1
-            print(f"\nScraping finished. Saved {saved_count} pages.")
+            cache = None if args.no_cache else HttpCache(HTTP_CACHE_PATH, HTTP_CACHE_SCOPE)
+            manifest = None if args.no_cache else ChangeManifest(CHANGES_PATH, HTTP_CACHE_SCOPE)
+            if args.concurrent:
+                stats = scrape_concurrently(sorted(target_links), fetch_workers=args.workers, parse_workers=args.parse_workers,
+                                            requests_per_second=args.rate, max_per_host=args.max_per_host,
+                                            cache=cache, manifest=manifest)
+                print(f"\nScraping finished. {stats.summary()}")
+            else:
+                start_time = time.perf_counter()
+                saved_count = 0
+                for link in sorted(target_links):
+                     if scrape_and_save_structured_json(link, session, cache, manifest):
+                         saved_count += 1
+                elapsed = time.perf_counter() - start_time
+                print(f"\nScraping finished. Saved {saved_count} pages in {elapsed:.1f}s "
+                      f"({len(target_links) / max(elapsed, 1e-9):.2f} pages/s).")
+            if cache is not None:
+                if links_complete:
+                    # リンクの一覧を取得できた場合だけ、一覧から消えたページを削除されたものとして記録する
+                    manifest.mark_removed(cache)
+                else:
+                    print("WARNING: The student menu links could not be fetched. Skipping removed-page detection.")
+                manifest.write()
+                cache.close()
+                print(f"Pages: {manifest.summary()}")
+                print(f"Changed pages manifest: {CHANGES_PATH}")
 
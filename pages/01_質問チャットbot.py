@@ -13,7 +13,10 @@ if os.getenv('GEMINI_API_KEY') is None:
 @st.cache_resource
 def load_rag_chat_system():
     try:
-        return RAGChatSystem()
+        system = RAGChatSystem()
+        # 高速起動モード (RAG_FAST_START=1) では、画面を表示している間に裏でインデックスなどをロードしておく
+        system.warm_up(background=True)
+        return system
     except Exception as e:
         st.error(f"RAGチャットシステムの初期化に失敗しました: {e}")
         st.stop()
@@ -30,6 +33,11 @@ st.warning("注意:入力トークン制限に達し、エラーが出る可能
 if "last_page_loaded" not in st.session_state or st.session_state.last_page_loaded != "general_chat":
     st.session_state.messages = []
     st.session_state.last_page_loaded = "general_chat"
+    # 会話状態 (前回の参照情報など) はセッションごとに持ち、共有のRAGChatSystemには持たせない
+    st.session_state.rag_session = rag_chat_system.new_session()
+
+if "rag_session" not in st.session_state:
+    st.session_state.rag_session = rag_chat_system.new_session()
 
 # 過去のメッセージを表示
 for message in st.session_state.messages:
@@ -49,28 +57,32 @@ if prompt := st.chat_input("質問を入力してください..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("回答を生成中..."):
-            try:
-                # st.session_state.messagesからチャット履歴を構築
-                chat_history_for_rag = []
-                for msg in st.session_state.messages:
-                    chat_history_for_rag.append({"role": msg["role"], "content": msg["content"]})
+        try:
+            # st.session_state.messagesからチャット履歴を構築
+            chat_history_for_rag = []
+            for msg in st.session_state.messages:
+                chat_history_for_rag.append({"role": msg["role"], "content": msg["content"]})
 
-                final_answer, source_documents_used = rag_chat_system.process_chat_query(prompt, chat_history=chat_history_for_rag)
-                st.markdown(final_answer)
+            # 最初に情報源のリストが返り、その後は回答が生成された順に少しずつ返る
+            answer_stream = rag_chat_system.stream_chat_query(
+                prompt, chat_history=chat_history_for_rag, session=st.session_state.rag_session
+            )
+            with st.spinner("関連情報を検索中..."):
+                source_documents_used = next(answer_stream)
+            final_answer = st.write_stream(answer_stream)
 
-                # 参照情報を回答と同時に表示
-                if source_documents_used:
-                    with st.expander("参照情報"):
-                        for i, source_url in enumerate(source_documents_used):
-                            st.write(f"**参照 {i+1}:** {source_url}")
-                else:
-                    st.write("関連情報が見つかりませんでした。")
+            # 参照情報を回答の後に表示
+            if source_documents_used:
+                with st.expander("参照情報"):
+                    for i, source_url in enumerate(source_documents_used):
+                        st.write(f"**参照 {i+1}:** {source_url}")
+            else:
+                st.write("関連情報が見つかりませんでした。")
 
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
-                final_answer = f"エラーが発生しました: {e}"
-                source_documents_used = [] # エラー時は情報源なし
-                # st.stop() # エラー時にアプリが停止しないようにコメントアウト
+        except Exception as e:
+            st.error(f"エラーが発生しました: {e}")
+            final_answer = f"エラーが発生しました: {e}"
+            source_documents_used = [] # エラー時は情報源なし
+            # st.stop() # エラー時にアプリが停止しないようにコメントアウト
         # アシスタントの回答を履歴に追加 (情報源も一緒に保存)
         st.session_state.messages.append({"role": "assistant", "content": final_answer, "sources": source_documents_used})
@@ -1,11 +1,13 @@
 import streamlit as st
 import os
 import google.generativeai as genai
-import pandas as pd
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
 
+from syllabus_search.syllabus_index import SyllabusRetriever, format_syllabuses_for_llm
+from syllabus_search.syllabus_db import csv_fingerprint
+
 # --- Constants ---
 # CSV_FILE_PATH = os.path.join(os.path.dirname(__file__), "all_syllabus_with_overview.csv") # ここを修正
 CSV_FILE_PATH = os.path.join(os.path.dirname(__file__), "..","data", "all_syllabus_with_overview.csv")
@@ -38,40 +40,38 @@ def get_api_key():
             st.stop() # APIキーがない場合はアプリを停止
     return api_key
 
-@st.cache_data
-def load_all_syllabus_data(csv_path):
-    """CSVファイルから全てのシラバスデータを読み込む"""
+def file_version(filepath):
+    """キャッシュのキーにするファイルの版 (更新日時とサイズ)。ファイルが無い場合はNone"""
+    return csv_fingerprint(filepath) if os.path.exists(filepath) else None
+
+# 以下の2つは全セッションで共有し、ファイルが更新されて引数の版が変わったときだけ作り直す
+# (max_entries=1 なので古い版は破棄され、セッション数や更新回数に応じてメモリが増えない)
+@st.cache_resource(max_entries=1)
+def load_syllabus_retriever(csv_path, csv_version, api_key):
+    """シラバスの検索インデックスを読み込む"""
     try:
-        df = pd.read_csv(csv_path)
-        required_cols = ['subject_name', 'overview', 'detail_url']
-        if not all(col in df.columns for col in required_cols):
-            st.error(f"CSVファイルに必要なカラム ({', '.join(required_cols)}) が見つかりません。")
-            st.stop()
-        df = df.fillna('')
-        return df
+        return SyllabusRetriever(csv_path, api_key=api_key)
     except FileNotFoundError:
         st.error(f"エラー: シラバスCSVファイルが見つかりません: {csv_path}")
         st.stop()
     except Exception as e:
-        st.error(f"エラー: CSVファイルの読み込み中に問題が発生しました: {e}")
+        st.error(f"エラー: シラバスの検索インデックスの読み込み中に問題が発生しました: {e}")
         st.stop()
 
-def format_syllabuses_for_llm(df):
-    """DataFrameのシラバスデータをLLMに渡せる形式に整形する"""
-    return "---\n".join(
-        f"科目名: {row['subject_name']}\n概要: {row['overview']}\n科目URL: {row['detail_url']}"
-        for index, row in df.iterrows()
-    )
+def build_retrieval_query(chat_history, user_question):
+    """直前の質問も含めて検索する (「もっと実技寄りのものは？」のような続きの質問に対応するため)"""
+    previous_questions = [message.content for message in chat_history[:-1] if isinstance(message, HumanMessage)]
+    return "\n".join(previous_questions[-1:] + [user_question])
 
 # --- LangChain Setup ---
-def create_langchain_chain(api_key, all_syllabuses_text):
-    """LangChainのチェーンを作成する"""
+@st.cache_resource(max_entries=1)
+def create_langchain_chain(api_key, prompt_version):
+    """LangChainのチェーンを作成する (シラバス情報は質問ごとに syllabus_context として渡す)"""
     # LLM
     llm = ChatGoogleGenerativeAI(model=GENERATIVE_MODEL, google_api_key=api_key, stream=True)
 
     # Prompt
-    system_prompt_template = load_prompt_from_file(SYSTEM_PROMPT_PATH)
-    system_prompt = system_prompt_template.format(all_syllabuses_text=all_syllabuses_text)
+    system_prompt = load_prompt_from_file(SYSTEM_PROMPT_PATH)
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", system_prompt),
@@ -87,7 +87,6 @@ def create_langchain_chain(api_key, all_syllabuses_text):
 st.set_page_config(page_title="シラバスAIチャット", page_icon="🎓")
 st.title("🎓 シラバス検索")
 st.write("ムサビ通信のシラバスをチャット形式で検索できます。")
-st.warning("注意:入力トークン制限に達し、エラーが出る可能性があります。")
 
 # ページがロードされたときにチャット履歴をリセット
 if "last_page_loaded" not in st.session_state or st.session_state.last_page_loaded != "syllabus_chat_page":
@@ -102,12 +101,21 @@ except Exception as e:
     st.error(f"APIキーの設定中にエラーが発生しました: {e}")
     st.stop()
 
-all_syllabus_df = load_all_syllabus_data(CSV_FILE_PATH)
-all_syllabuses_formatted_text = format_syllabuses_for_llm(all_syllabus_df)
-
-# LangChainのチェーンをセッション状態で管理
-if "chain" not in st.session_state:
-    st.session_state.chain = create_langchain_chain(api_key, all_syllabuses_formatted_text)
+syllabus_retriever = load_syllabus_retriever(CSV_FILE_PATH, file_version(CSV_FILE_PATH), api_key)
+chain = create_langchain_chain(api_key, file_version(SYSTEM_PROMPT_PATH))
+
+# --- Keyword Search ---
+# AIを使わずに、科目名・概要・教員名の全文検索 (SQLite FTS5) の結果をすぐに表示する
+with st.expander("キーワード検索（AIを使わずにすぐ検索）"):
+    keyword_query = st.text_input("科目名・教員名・キーワード", key="syllabus_keyword_query")
+    if keyword_query:
+        keyword_results = syllabus_retriever.database.search(keyword_query)
+        if not keyword_results:
+            st.write("該当する授業が見つかりませんでした。")
+        for result in keyword_results:
+            st.markdown(f"- [{result['subject_name']}]({result['detail_url']})（{result['teacher_name']}）")
+            if result['snippet']:
+                st.caption(result['snippet'])
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
@@ -133,9 +141,12 @@ if user_question := st.chat_input("どのような授業を探しますか？"):
     with st.chat_message("assistant"):
         with st.spinner("AIが考えています..."):
             try:
-                response_stream = st.session_state.chain.stream({
+                # 全シラバスではなく、質問に関連する授業だけをプロンプトに入れる
+                matched_syllabuses = syllabus_retriever.search(build_retrieval_query(st.session_state.chat_history, user_question))
+                response_stream = chain.stream({
                     "chat_history": st.session_state.chat_history,
-                    "question": user_question
+                    "question": user_question,
+                    "syllabus_context": format_syllabuses_for_llm(matched_syllabuses),
                 })
                 full_response = st.write_stream(response_stream)
                 st.session_state.chat_history.append(AIMessage(content=full_response))
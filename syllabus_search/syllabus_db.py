@@ -0,0 +1,154 @@
+import os
+import re
+import sys
+import csv
+import logging
+import sqlite3
+import threading
+
+# pagesからパッケージとして読み込まれる場合と、syllabus_search内で直接実行される場合の両方に対応
+try:
+    from web_search.keyword_extractor import normalize_text
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from web_search.keyword_extractor import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# --- 定数 ---
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SYLLABUS_CSV_PATH = os.path.join(BASE_DIR, 'data', 'all_syllabus_with_overview.csv')
+# CSVから作り直せるため、Embeddingキャッシュと同じくgit管理外の data/cache に置く
+SYLLABUS_DB_PATH = os.path.join(BASE_DIR, 'data', 'cache', 'syllabus.sqlite3')
+SYLLABUS_COLUMNS = ['category', 'period', 'subject_name', 'schedule', 'teacher_name', 'detail_url', 'overview']
+# 全文検索の対象の列と、bm25() での重み (科目名での一致を最も重くする)
+FTS_COLUMNS = ['subject_name', 'overview', 'teacher_name', 'category']
+FTS_COLUMN_WEIGHTS = [10.0, 1.0, 5.0, 2.0]
+# trigramトークナイザーは3文字未満の語を索引から引けないため、それより短い語は部分一致で探す
+TRIGRAM_MIN_LENGTH = 3
+QUERY_TERM_SPLIT_PATTERN = re.compile(r'[\s、。，．,.!?！？「」『』（）()]+')
+SEARCH_LIMIT = 20
+SNIPPET_TOKENS = 16
+
+
+def csv_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def build_syllabus_database(csv_path=SYLLABUS_CSV_PATH, db_path=SYLLABUS_DB_PATH):
+    """
+    シラバスCSVをSQLiteに読み込み、FTS5 (trigram) の全文検索索引を作る。
+    一時ファイルに作ってから置き換えるため、作り直し中も古いデータベースを読める。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        rows = [{column: (row.get(column) or '') for column in SYLLABUS_COLUMNS} for row in csv.DictReader(f)]
+
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(f"CREATE TABLE syllabus (row_id INTEGER PRIMARY KEY, {', '.join(f'{c} TEXT' for c in SYLLABUS_COLUMNS)})")
+        # 全文検索側には正規化 (NFKC・小文字化) したテキストを入れ、質問文と表記の揺れを揃える
+        conn.execute(f"CREATE VIRTUAL TABLE syllabus_fts USING fts5({', '.join(FTS_COLUMNS)}, tokenize='trigram')")
+        conn.execute("CREATE TABLE build_info (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            f"INSERT INTO syllabus (row_id, {', '.join(SYLLABUS_COLUMNS)}) VALUES (?, {', '.join('?' for _ in SYLLABUS_COLUMNS)})",
+            [(row_id, *(row[c] for c in SYLLABUS_COLUMNS)) for row_id, row in enumerate(rows)],
+        )
+        conn.executemany(
+            f"INSERT INTO syllabus_fts (rowid, {', '.join(FTS_COLUMNS)}) VALUES (?, {', '.join('?' for _ in FTS_COLUMNS)})",
+            [(row_id, *(normalize_text(row[c]) for c in FTS_COLUMNS)) for row_id, row in enumerate(rows)],
+        )
+        conn.executemany("INSERT INTO build_info (key, value) VALUES (?, ?)", [
+            ('csv_path', os.path.abspath(csv_path)),
+            ('csv_fingerprint', csv_fingerprint(csv_path)),
+            ('row_count', str(len(rows))),
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return len(rows)
+
+
+class SyllabusDatabase:
+    """
+    build_syllabus_database で作ったSQLiteデータベースへの読み取り専用のアクセス。
+    接続は1つを全セッションで共有し、ロックで直列化する (検索は1ミリ秒未満で終わる)。
+    """
+
+    def __init__(self, db_path=SYLLABUS_DB_PATH):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, csv_path=SYLLABUS_CSV_PATH, db_path=SYLLABUS_DB_PATH):
+        """データベースを開く。無い場合やCSVが更新されている場合は作り直してから開く"""
+        build_info = read_build_info(db_path) if os.path.exists(db_path) else {}
+        if (build_info.get('csv_path') != os.path.abspath(csv_path)
+                or build_info.get('csv_fingerprint') != csv_fingerprint(csv_path)):
+            logger.info("Building syllabus database %s from %s", db_path, csv_path)
+            build_syllabus_database(csv_path, db_path)
+        return cls(db_path)
+
+    def rows(self):
+        """全シラバスを row_id (CSVの行順) の順に辞書のリストで返す"""
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT {', '.join(SYLLABUS_COLUMNS)} FROM syllabus ORDER BY row_id")
+            return [dict(row) for row in cursor]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        科目名・概要・教員名・区分にすべての語を含むシラバスを返す (語は空白や句読点で区切る)。
+        3文字以上の語はFTS5のtrigram索引で引き、関連度 (bm25) の高い順に並べる。
+        戻り値は各列に row_id と snippet (一致箇所の前後) を加えた辞書のリスト。
+        """
+        terms = [term for term in QUERY_TERM_SPLIT_PATTERN.split(normalize_text(query)) if term]
+        if not terms:
+            return []
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+        short_terms = [term for term in terms if len(term) < TRIGRAM_MIN_LENGTH]
+
+        searchable = " || ' ' || ".join(f"f.{c}" for c in FTS_COLUMNS)
+        conditions = [f"instr({searchable}, ?) > 0" for _ in short_terms]
+        params = list(short_terms)
+        columns = ', '.join(f"s.{c}" for c in SYLLABUS_COLUMNS)
+        if long_terms:
+            match = " AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms)
+            sql = (
+                f"SELECT s.row_id, {columns}, snippet(syllabus_fts, -1, '**', '**', '…', {SNIPPET_TOKENS}) AS snippet "
+                f"FROM syllabus_fts f JOIN syllabus s ON s.row_id = f.rowid "
+                f"WHERE syllabus_fts MATCH ? {''.join(' AND ' + c for c in conditions)} "
+                f"ORDER BY bm25(syllabus_fts, {', '.join(str(w) for w in FTS_COLUMN_WEIGHTS)}) LIMIT ?"
+            )
+            params = [match] + params + [limit]
+        else:
+            # 短い語だけの場合は全件を部分一致で調べる (数百件なので索引が無くても速い)
+            sql = (
+                f"SELECT s.row_id, {columns}, '' AS snippet FROM syllabus_fts f JOIN syllabus s ON s.row_id = f.rowid "
+                f"WHERE {' AND '.join(conditions)} "
+                f"ORDER BY instr(f.subject_name, ?) = 0, s.row_id LIMIT ?"
+            )
+            params = params + [short_terms[0], limit]
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def read_build_info(db_path):
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM build_info").fetchall())
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import datetime
+
+# pagesからパッケージとして読み込まれる場合と、syllabus_search内で直接実行される場合の両方に対応
+try:
+    from web_search.keyword_extractor import normalize_text
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from web_search.keyword_extractor import normalize_text
+
+# --- 定数 ---
+CATEGORY_SEPARATOR = '/'
+TEACHER_SEPARATOR_PATTERN = re.compile(r'[、,，/／]')
+# 教員名の末尾に付く職位 (長いものから順に照合する)
+TEACHER_TITLES = ('名誉教授', '客員教授', '特任教授', '非常勤講師', '准教授', '特任講師', '教授', '講師', '助教', '助手')
+# 質問文中の「○○先生」から教員名を取り出す
+TEACHER_QUERY_PATTERN = re.compile(r'([一-龥々ァ-ヶー・A-Za-z]+?)(?:先生|名誉教授|准教授|教授|講師)')
+# 時間割の日付 (例: 2025/7/26, 7月26日, 7.26)。年が無い場合は年度から補う
+DATE_PATTERN = re.compile(r'(?:(\d{4})\s*[/年.\-]\s*)?(\d{1,2})\s*[/月.\-]\s*(\d{1,2})\s*日?')
+RANGE_SEPARATOR_PATTERN = re.compile(r'\s*[～〜~\-－―]\s*')
+# 月だけの指定 (例: 7月～8月, 8月)
+MONTH_QUERY_PATTERN = re.compile(r'(\d{1,2})\s*月(?:\s*[～〜~\-－から]+\s*(\d{1,2})\s*月)?')
+# 季節ごとの月の範囲 (スクーリングの開講時期の目安)
+SEASON_MONTHS = {'春': (4, 5), '夏': (7, 9), '秋': (10, 11), '冬': (12, 2)}
+# 時期として書かれた季節 (例: 夏の, 夏休み, 夏期, 夏季スクーリング, 文末の「夏」)。「秋山先生」のような名前の一部は除く
+SEASON_QUERY_PATTERN = re.compile(r'([春夏秋冬])(?=の|休み|期|季|学期|スクーリング|に|頃|ごろ|開講|$|[、。,.？?！!\s])')
+# detail_url の 2025_157.html から年度を取り出す
+ACADEMIC_YEAR_PATTERN = re.compile(r'/(\d{4})_\d+\.html')
+# 学年度は4月始まり
+ACADEMIC_YEAR_START_MONTH = 4
+
+
+def split_categories(category):
+    """「造形文化科目/文化総合科目」のような区分を階層ごとに分ける"""
+    return tuple(part.strip() for part in category.split(CATEGORY_SEPARATOR) if part.strip())
+
+
+def strip_teacher_title(name):
+    name = name.strip()
+    for title in TEACHER_TITLES:
+        if name.endswith(title) and len(name) > len(title):
+            return name[:-len(title)].strip()
+    return name
+
+
+def split_teachers(teacher_name):
+    """「足立圭准教授、乗木大朗講師」を職位を除いた名前のタプルにする"""
+    return tuple(strip_teacher_title(name) for name in TEACHER_SEPARATOR_PATTERN.split(teacher_name) if name.strip())
+
+
+def academic_year_date(academic_year, month, day):
+    """年度と月日から日付を作る (1～3月は翌年になる)"""
+    year = academic_year + 1 if month < ACADEMIC_YEAR_START_MONTH else academic_year
+    return datetime.date(year, month, day)
+
+
+def _parse_date(match, academic_year):
+    year, month, day = match.group(1), int(match.group(2)), int(match.group(3))
+    if year:
+        return datetime.date(int(year), month, day)
+    if academic_year is None:
+        return None
+    return academic_year_date(academic_year, month, day)
+
+
+def parse_schedule(schedule, academic_year=None):
+    """
+    時間割の文字列から日付の範囲 ((開始日, 終了日) のタプル) を取り出す。
+    「7/26～7/28」は1つの範囲、「7/26, 8/2」は1日ずつの範囲になる。「なし」など日付が無ければ空のタプル。
+    """
+    ranges = []
+    text = normalize_text(schedule)
+    matches = list(DATE_PATTERN.finditer(text))
+    i = 0
+    while i < len(matches):
+        try:
+            start = _parse_date(matches[i], academic_year)
+        except ValueError:
+            start = None
+        end = start
+        # 次の日付との間が「～」だけなら範囲とみなす
+        if i + 1 < len(matches) and RANGE_SEPARATOR_PATTERN.fullmatch(text[matches[i].end():matches[i + 1].start()]):
+            try:
+                end = _parse_date(matches[i + 1], academic_year)
+            except ValueError:
+                end = None
+            i += 1
+        if start is not None and end is not None:
+            ranges.append((min(start, end), max(start, end)))
+        i += 1
+    return tuple(ranges)
+
+
+class SyllabusFacets:
+    """1科目分の、型を揃えたファセットの値"""
+
+    __slots__ = ('row_id', 'categories', 'period', 'schedule_ranges', 'teachers')
+
+    def __init__(self, row_id, categories, period, schedule_ranges, teachers):
+        self.row_id = row_id
+        self.categories = categories # 区分の階層 (str のタプル)
+        self.period = period # 開講期間 (例: 通年)
+        self.schedule_ranges = schedule_ranges # 時間割の日付の範囲 ((datetime.date, datetime.date) のタプル)
+        self.teachers = teachers # 職位を除いた教員名のタプル
+
+    @classmethod
+    def from_row(cls, row_id, row):
+        match = ACADEMIC_YEAR_PATTERN.search(row.get('detail_url', ''))
+        academic_year = int(match.group(1)) if match else None
+        return cls(
+            row_id,
+            split_categories(row.get('category', '')),
+            row.get('period', '').strip(),
+            parse_schedule(row.get('schedule', ''), academic_year),
+            split_teachers(row.get('teacher_name', '')),
+        )
+
+    def overlaps(self, date_from, date_to):
+        return any(start <= date_to and date_from <= end for start, end in self.schedule_ranges)
+
+
+class FacetQuery:
+    """ファセットでの絞り込み条件。指定しなかった条件 (None) は絞り込まない"""
+
+    def __init__(self, categories=None, periods=None, teachers=None, date_ranges=None, has_schedule=None):
+        self.categories = categories # いずれかの区分に属する
+        self.periods = periods # いずれかの開講期間
+        self.teachers = teachers # いずれかの教員名を含む (部分一致)
+        self.date_ranges = date_ranges # 時間割がいずれかの期間と重なる
+        self.has_schedule = has_schedule # 時間割 (スクーリングの日程) があるか
+
+    def is_empty(self):
+        return all(value is None for value in (self.categories, self.periods, self.teachers, self.date_ranges, self.has_schedule))
+
+    def to_dict(self):
+        return {
+            'categories': self.categories,
+            'periods': self.periods,
+            'teachers': self.teachers,
+            'date_ranges': [(start.isoformat(), end.isoformat()) for start, end in self.date_ranges] if self.date_ranges else None,
+            'has_schedule': self.has_schedule,
+        }
+
+
+class SyllabusFacetIndex:
+    """
+    シラバスCSVの構造化された列 (区分・開講期間・時間割・教員) をメモリ上に索引化し、
+    検索や回答生成の前に候補の科目をファセットで絞り込む。
+    """
+
+    def __init__(self, rows):
+        self.facets = [SyllabusFacets.from_row(row_id, row) for row_id, row in enumerate(rows)]
+        self.by_category = {} # {区分: {row_id}}
+        self.by_period = {} # {開講期間: {row_id}}
+        self.by_teacher = {} # {教員名: {row_id}}
+        self.scheduled = set() # 時間割に日付がある科目
+        for facet in self.facets:
+            for category in facet.categories:
+                self.by_category.setdefault(category, set()).add(facet.row_id)
+            if facet.period:
+                self.by_period.setdefault(facet.period, set()).add(facet.row_id)
+            for teacher in facet.teachers:
+                self.by_teacher.setdefault(teacher, set()).add(facet.row_id)
+            if facet.schedule_ranges:
+                self.scheduled.add(facet.row_id)
+        # 質問文との照合用に正規化した値 (質問ごとに正規化し直さないよう起動時に作っておく)
+        self._normalized_categories = [(normalize_text(c), c) for c in self.by_category]
+        self._normalized_periods = [(normalize_text(p), p) for p in self.by_period]
+        self._normalized_teachers = [(normalize_text(t), t) for t in self.by_teacher]
+        # 質問文の「夏」などを日付に直すときの年度 (CSVで最も多い年度)
+        years = [int(m.group(1)) for m in (ACADEMIC_YEAR_PATTERN.search(row.get('detail_url', '')) for row in rows) if m]
+        self.academic_year = max(set(years), key=years.count) if years else datetime.date.today().year
+
+    def query(self, facet_query):
+        """条件をすべて満たす科目の row_id を昇順のリストで返す"""
+        candidates = set(range(len(self.facets)))
+        if facet_query.categories is not None:
+            candidates &= set().union(*(self.by_category.get(c, set()) for c in facet_query.categories))
+        if facet_query.periods is not None:
+            candidates &= set().union(*(self.by_period.get(p, set()) for p in facet_query.periods))
+        if facet_query.teachers is not None:
+            matched = set()
+            for teacher, row_ids in self.by_teacher.items():
+                if any(name in teacher for name in facet_query.teachers):
+                    matched |= row_ids
+            candidates &= matched
+        if facet_query.has_schedule is not None:
+            candidates = candidates & self.scheduled if facet_query.has_schedule else candidates - self.scheduled
+        if facet_query.date_ranges is not None:
+            candidates = {
+                row_id for row_id in candidates
+                if any(self.facets[row_id].overlaps(start, end) for start, end in facet_query.date_ranges)
+            }
+        return sorted(candidates)
+
+    def _season_ranges(self, text):
+        ranges = []
+        for season in dict.fromkeys(match.group(1) for match in SEASON_QUERY_PATTERN.finditer(text)):
+            ranges.append(self._month_range(*SEASON_MONTHS[season]))
+        for match in MONTH_QUERY_PATTERN.finditer(text):
+            first_month = int(match.group(1))
+            last_month = int(match.group(2)) if match.group(2) else first_month
+            if 1 <= first_month <= 12 and 1 <= last_month <= 12:
+                ranges.append(self._month_range(first_month, last_month))
+        return ranges
+
+    def _month_range(self, first_month, last_month):
+        start = academic_year_date(self.academic_year, first_month, 1)
+        end = academic_year_date(self.academic_year, last_month, 1)
+        if end < start: # 冬 (12月～2月) のように年度内で年をまたぐ場合
+            end = datetime.date(end.year + 1, end.month, 1)
+        next_month = datetime.date(end.year + end.month // 12, end.month % 12 + 1, 1)
+        return start, next_month - datetime.timedelta(days=1)
+
+    def parse_question(self, question):
+        """
+        質問文からファセットの条件を取り出す (LLMは使わない)。
+        例: 「夏のスクーリング科目」→ 時間割が7～9月と重なる科目、「清水先生の授業」→ 教員名に「清水」を含む科目。
+        """
+        text = normalize_text(question)
+        categories = [c for normalized, c in self._normalized_categories if normalized in text]
+        periods = [p for normalized, p in self._normalized_periods if normalized in text]
+        teachers = [t for normalized, t in self._normalized_teachers if normalized in text]
+        teachers += [m.group(1) for m in TEACHER_QUERY_PATTERN.finditer(question) if m.group(1) not in teachers]
+        # 時間割に日付のある科目が1つも無いCSVでは、時期やスクーリングの有無では絞り込めない。
+        # 季節は教員名として取り出した部分 (例: 秋山先生) を除いた残りから探す
+        season_text = question
+        for teacher in teachers:
+            season_text = season_text.replace(teacher, ' ' * len(teacher))
+        date_ranges = self._season_ranges(season_text) if self.scheduled else []
+        has_schedule = True if self.scheduled and not date_ranges and 'スクーリング' in question else None
+        return FacetQuery(
+            categories=categories or None,
+            periods=periods or None,
+            teachers=teachers or None,
+            date_ranges=date_ranges or None,
+            has_schedule=has_schedule,
+        )
@@ -0,0 +1,137 @@
+import os
+import sys
+import csv
+import json
+import logging
+import numpy as np
+import faiss
+
+# pagesからパッケージとして読み込まれる場合と、syllabus_search内で直接実行される場合の両方に対応
+try:
+    from web_search.model_providers import GeminiProvider
+    from web_search.lexical_index import BM25Index, reciprocal_rank_fusion
+    from web_search.vector_index import load_index
+    from syllabus_search.syllabus_facets import SyllabusFacetIndex
+    from syllabus_search.syllabus_db import SYLLABUS_DB_PATH, SyllabusDatabase
+except ImportError:
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    from web_search.model_providers import GeminiProvider
+    from web_search.lexical_index import BM25Index, reciprocal_rank_fusion
+    from web_search.vector_index import load_index
+    from syllabus_facets import SyllabusFacetIndex
+    from syllabus_db import SYLLABUS_DB_PATH, SyllabusDatabase
+
+logger = logging.getLogger(__name__)
+
+# --- 定数 ---
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SYLLABUS_CSV_PATH = os.path.join(BASE_DIR, 'data', 'all_syllabus_with_overview.csv')
+SYLLABUS_VECTOR_STORE_DIR = os.path.join(BASE_DIR, 'data', 'syllabus_vector_store')
+SYLLABUS_FAISS_INDEX_PATH = os.path.join(SYLLABUS_VECTOR_STORE_DIR, 'faiss_index.bin')
+SYLLABUS_METADATA_PATH = os.path.join(SYLLABUS_VECTOR_STORE_DIR, 'metadata.json')
+# プロンプトに入れる授業の数 (回答では最大5つを提案させるため、少し多めに渡す)
+SYLLABUS_TOP_K = 10
+# BM25とFAISSのそれぞれから取り出してRRFで統合する候補数
+SYLLABUS_CANDIDATES = 30
+
+
+def load_syllabus_rows(csv_path=SYLLABUS_CSV_PATH):
+    """シラバスCSVを行ごとの辞書のリストとして読み込む (空欄は空文字列)"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        return [{key: value or '' for key, value in row.items()} for row in csv.DictReader(f)]
+
+
+def syllabus_document_text(row):
+    """検索 (Embedding・BM25) の対象にするテキスト"""
+    return f"{row['subject_name']}\n{row['overview']}"
+
+
+def format_syllabuses_for_llm(rows):
+    """シラバスの行をLLMに渡せる形式に整形する"""
+    return "---\n".join(
+        f"科目名: {row['subject_name']}\n概要: {row['overview']}\n科目URL: {row['detail_url']}"
+        for row in rows
+    )
+
+
+class SyllabusRetriever:
+    """
+    質問に関連するシラバスを検索する。
+    科目名+概要に対するBM25 (起動時にメモリ上で作る) と、create_syllabus_vector_db.py で作った
+    FAISSインデックスの順位をRRFで統合する。FAISSインデックスが無い場合はBM25だけで検索する。
+    質問に教員名・区分・時期などが含まれる場合は、先にファセットで候補を絞り込んでから検索する。
+    シラバスの行はCSVではなくSQLiteのデータベース (syllabus_db.py) から読み込み、
+    キーワードだけの即時検索には database.search() を使う。
+    """
+
+    def __init__(self, csv_path=SYLLABUS_CSV_PATH, provider=None, api_key=None, db_path=SYLLABUS_DB_PATH):
+        """
+        provider: 質問のEmbeddingに使うModelProvider。省略時はFAISSインデックスがある場合だけGemini APIを使う。
+        api_key: provider省略時に使うGemini APIキー (省略時は環境変数 GEMINI_API_KEY)。
+        db_path: シラバスのSQLiteデータベース。無い場合やCSVより古い場合は作り直す。
+        """
+        self.api_key = api_key
+        self.database = SyllabusDatabase.open(csv_path, db_path)
+        self.rows = self.database.rows()
+        self.lexical_index = BM25Index.build([syllabus_document_text(row) for row in self.rows])
+        self.facet_index = SyllabusFacetIndex(self.rows)
+        self.index = None
+        self.provider = provider
+        self._load_vector_index()
+        logger.info("SyllabusRetriever loaded %d syllabuses (vector index: %s).", len(self.rows), 'yes' if self.index is not None else 'no')
+
+    def _load_vector_index(self):
+        if not os.path.exists(SYLLABUS_FAISS_INDEX_PATH) or not os.path.exists(SYLLABUS_METADATA_PATH):
+            logger.warning("Syllabus vector index not found in %s. Using BM25 only.", SYLLABUS_VECTOR_STORE_DIR)
+            return
+        with open(SYLLABUS_METADATA_PATH, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        # CSVが更新されてインデックスと行が対応しなくなっていたら使わない
+        expected = [(row['subject_name'], row['detail_url']) for row in self.rows]
+        if [(item['subject_name'], item['detail_url']) for item in metadata] != expected:
+            logger.warning("Syllabus vector index does not match the CSV. Run create_syllabus_vector_db.py again. Using BM25 only.")
+            return
+        self.index, _config = load_index(SYLLABUS_FAISS_INDEX_PATH)
+        if self.provider is None:
+            self.provider = GeminiProvider(api_key=self.api_key)
+
+    def _vector_ranking(self, query, k, allowed_ids=None):
+        try:
+            query_embedding = self.provider.embed(query, task_type="RETRIEVAL_QUERY")
+            query_embedding_np = np.array([query_embedding]).astype('float32')
+            if allowed_ids is None:
+                _distances, indices = self.index.search(query_embedding_np, k)
+            else:
+                selector = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype='int64'))
+                _distances, indices = self.index.search(query_embedding_np, k, params=faiss.SearchParameters(sel=selector))
+            return [int(idx) for idx in indices[0] if 0 <= idx < len(self.rows)]
+        except Exception as e:
+            logger.warning("Syllabus vector search failed: %s. Using BM25 only.", e)
+            return []
+
+    def filter_by_facets(self, query):
+        """
+        質問文から取り出したファセットの条件に合う科目の row_id のリストを返す。
+        条件が無い場合、または条件に合う科目が1つも無い場合はNone (絞り込まない)。
+        """
+        facet_query = self.facet_index.parse_question(query)
+        if facet_query.is_empty():
+            return None
+        row_ids = self.facet_index.query(facet_query)
+        if not row_ids:
+            logger.debug("No syllabus matched facets %s. Searching without facets.", facet_query.to_dict())
+            return None
+        return row_ids
+
+    def search(self, query, k=SYLLABUS_TOP_K):
+        """質問に関連するシラバスの行を関連度の高い順に最大k件返す"""
+        allowed_ids = self.filter_by_facets(query)
+        candidates = max(k, SYLLABUS_CANDIDATES)
+        lexical_ranking, _scores = self.lexical_index.search(query, candidates, allowed_ids=allowed_ids)
+        vector_ranking = self._vector_ranking(query, candidates, allowed_ids) if self.index is not None else []
+        ranked_ids = [row_id for row_id, _score in reciprocal_rank_fusion([lexical_ranking, vector_ranking])]
+        if allowed_ids is not None:
+            # 「○○先生の授業」のように本文と重ならない質問でも、ファセットに合う科目は候補に残す
+            ranked = set(ranked_ids)
+            ranked_ids += [row_id for row_id in allowed_ids if row_id not in ranked]
+        return [self.rows[row_id] for row_id in ranked_ids[:k]]
@@ -0,0 +1,57 @@
+"""web_search/answer_cache.py のテスト"""
+import pytest
+
+from web_search import answer_cache
+from web_search.answer_cache import SemanticAnswerCache
+
+SOURCES = ['https://example.com/a']
+VERSION = ('v1', 0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_lookup_hits_similar_question_with_same_sources(clock):
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], SOURCES, "回答", VERSION, sources=['https://example.com/b'])
+    hit = cache.lookup([0.99, 0.01], SOURCES, VERSION)
+    assert hit['answer'] == "回答"
+    assert hit['sources'] == ['https://example.com/b']
+    assert cache.lookup([0.0, 1.0], SOURCES, VERSION) is None
+    assert cache.lookup([1.0, 0.0], ['https://example.com/c'], VERSION) is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store([1.0, 0.0], SOURCES, "回答", VERSION)
+    clock[0] += 60
+    assert cache.lookup([1.0, 0.0], SOURCES, VERSION) is not None
+    clock[0] += 1
+    assert cache.lookup([1.0, 0.0], SOURCES, VERSION) is None
+    assert not cache.entries
+
+
+def test_version_change_discards_all_entries(clock):
+    cache = SemanticAnswerCache()
+    cache.store([1.0, 0.0], SOURCES, "回答", VERSION)
+    cache.store([0.0, 1.0], SOURCES, "別の回答", VERSION)
+    # ベクトルストアの版が変わっても、ドキュメントの版が変わっても捨てる
+    assert cache.lookup([1.0, 0.0], SOURCES, ('v2', 0)) is None
+    assert not cache.entries
+    cache.store([1.0, 0.0], SOURCES, "新しい回答", ('v2', 0))
+    assert cache.lookup([1.0, 0.0], SOURCES, ('v2', 1)) is None
+    assert not cache.entries
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store([1.0, 0.0], SOURCES, "A", VERSION)
+    cache.store([0.0, 1.0], SOURCES, "B", VERSION)
+    assert cache.lookup([1.0, 0.0], SOURCES, VERSION)['answer'] == "A"
+    cache.store([-1.0, 0.0], SOURCES, "C", VERSION)
+    assert cache.lookup([0.0, 1.0], SOURCES, VERSION) is None
+    assert cache.lookup([1.0, 0.0], SOURCES, VERSION)['answer'] == "A"
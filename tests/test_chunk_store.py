@@ -0,0 +1,71 @@
+"""web_search/chunk_store.py のテスト"""
+import mmap
+import json
+
+import numpy as np
+import pytest
+
+from web_search.chunk_store import STRINGS_FILE, ChunkStore, chunk_store_exists
+
+RECORDS = [
+    {'source': 'https://example.com/a', 'title': 'A', 'headings': ['学費'], 'text': '学費\n年額は10万円です。', 'offset': [0, 20]},
+    {'source': 'https://example.com/a', 'title': 'A', 'headings': ['学費', '納入方法'], 'text': '学費 > 納入方法\n振込', 'offset': [21, 40]},
+    {'source': 'https://example.com/b', 'title': 'B', 'headings': ['学費'], 'text': 'emoji 🎓 と日本語'},
+    {'source': 'https://example.com/b', 'title': 'B', 'headings': [], 'text': ''},
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    ChunkStore.write(RECORDS, str(tmp_path))
+    store = ChunkStore.load(str(tmp_path))
+    yield store
+    store.close()
+
+
+def test_round_trip_matches_records(store, tmp_path):
+    assert chunk_store_exists(str(tmp_path))
+    assert len(store) == len(RECORDS)
+    assert [chunk.to_dict() for chunk in store] == RECORDS
+    assert list(store.texts()) == [record['text'] for record in RECORDS]
+    assert store[-1].chunk_id == 3
+    with pytest.raises(IndexError):
+        store[len(RECORDS)]
+
+
+def test_strings_and_heading_paths_are_shared(store):
+    # 情報源・タイトル・見出しは文字列表に1回だけ持ち、同じ見出しの階層は同じタプルを共有する
+    assert sorted(store.strings) == sorted({'https://example.com/a', 'https://example.com/b', 'A', 'B', '学費', '納入方法'})
+    assert store[0].headings is store[2].headings
+    assert store[3].headings == ()
+    assert store[2].offset is None
+
+
+def test_load_memory_maps_columns_and_texts(store):
+    assert isinstance(store.columns, np.memmap)
+    assert isinstance(store._texts, mmap.mmap)
+    store.close()
+    assert store._mmap is None
+
+
+def test_from_records_keeps_data_in_memory():
+    store = ChunkStore.from_records(RECORDS)
+    assert not isinstance(store.columns, np.memmap)
+    assert [chunk.to_dict() for chunk in store] == RECORDS
+
+
+def test_empty_store_round_trip(tmp_path):
+    ChunkStore.write([], str(tmp_path))
+    store = ChunkStore.load(str(tmp_path))
+    assert len(store) == 0
+    assert list(store) == []
+
+
+def test_load_rejects_mismatched_chunk_count(tmp_path):
+    ChunkStore.write(RECORDS, str(tmp_path))
+    strings_path = tmp_path / STRINGS_FILE
+    data = json.loads(strings_path.read_text(encoding='utf-8'))
+    data['num_chunks'] += 1
+    strings_path.write_text(json.dumps(data), encoding='utf-8')
+    with pytest.raises(ValueError):
+        ChunkStore.load(str(tmp_path))
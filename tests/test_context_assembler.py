@@ -0,0 +1,105 @@
+"""web_search/context_assembler.py のテスト (合成したドキュメントを使う)"""
+import pytest
+
+from web_search.context_assembler import (
+    PRIORITY_DOCUMENT, PRIORITY_HIT, PRIORITY_NEIGHBOR, PRIORITY_PREVIOUS, PRIORITY_SUBTREE, SECTION_GAP_MARKER,
+    ContextAssembler, estimate_tokens, subtree_end,
+)
+from web_search.document_store import render_markdown, split_sections
+
+A = 'https://example.com/a'
+B = 'https://example.com/b'
+C = 'https://example.com/c'
+
+
+def make_document(url, headings):
+    """[(見出しのレベル, 見出し)] から、見出しごとに本文の段落を1つ持つ DocumentStore と同じ形のドキュメントを作る"""
+    content = []
+    for level, text in headings:
+        content.append({'type': 'heading', 'level': level, 'text': text})
+        content.append({'type': 'paragraph', 'text': f"{text}についての説明です。"})
+    data = {'url': url, 'title': url.rsplit('/', 1)[-1], 'content': content}
+    markdown, item_spans = render_markdown(data)
+    sections = split_sections(data, markdown, item_spans)
+    return {'url': url, 'title': data['title'], 'markdown': markdown, 'sections': sections}
+
+
+@pytest.fixture(scope='module')
+def doc_a():
+    # 0 概要 / 1 学費 (2 納入方法, 3 減免) / 4 問い合わせ / 5 その他
+    return make_document(A, [(2, '概要'), (2, '学費'), (3, '納入方法'), (3, '減免'), (2, '問い合わせ'), (2, 'その他')])
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("学費abcd") == 3
+
+
+def test_subtree_end(doc_a):
+    sections = doc_a['sections']
+    assert [section['level'] for section in sections] == [2, 2, 3, 3, 2, 2]
+    assert subtree_end(sections, 1) == 4
+    assert subtree_end(sections, 2) == 3
+    assert subtree_end(sections, 5) == 6
+
+
+def test_hit_then_subtree_then_neighbors(doc_a):
+    context = ContextAssembler(budget_tokens=10_000, neighbor_sections=1).assemble({A: doc_a}, {(A, 1): 1.0})
+    assert context.sections == [
+        (A, 1, PRIORITY_HIT), (A, 2, PRIORITY_SUBTREE), (A, 3, PRIORITY_SUBTREE),
+        (A, 0, PRIORITY_NEIGHBOR), (A, 4, PRIORITY_NEIGHBOR),
+    ]
+    # セクションは本文の順に並べ、連続しているので省略の印は入らない
+    assert context.text.index('## 概要') < context.text.index('## 学費') < context.text.index('### 減免')
+    assert 'その他' not in context.text
+    assert SECTION_GAP_MARKER not in context.text
+    assert context.sources == [A]
+    assert context.tokens == estimate_tokens(f"--- Document 1 (Source: {A})\n# a") + sum(
+        doc_a['sections'][index]['tokens'] for index in range(5))
+
+
+def test_gap_marker_between_non_adjacent_sections(doc_a):
+    context = ContextAssembler(budget_tokens=10_000, neighbor_sections=0).assemble({A: doc_a}, {(A, 0): 2.0, (A, 4): 1.0})
+    assert [index for _source, index, _priority in context.sections] == [0, 4]
+    assert SECTION_GAP_MARKER in context.text
+
+
+def test_budget_skips_sections_that_do_not_fit(doc_a):
+    header_tokens = estimate_tokens(f"--- Document 1 (Source: {A})\n# a")
+    sections = doc_a['sections']
+    # ヒットしたセクションと、小見出しの1つ分だけが入る上限
+    budget = header_tokens + sections[1]['tokens'] + sections[2]['tokens']
+    context = ContextAssembler(budget_tokens=budget, neighbor_sections=1).assemble({A: doc_a}, {(A, 1): 1.0})
+    assert context.sections == [(A, 1, PRIORITY_HIT), (A, 2, PRIORITY_SUBTREE)]
+    assert context.tokens == budget
+
+
+def test_truncates_top_section_when_it_alone_exceeds_budget(doc_a):
+    context = ContextAssembler(budget_tokens=25, neighbor_sections=1).assemble({A: doc_a}, {(A, 1): 1.0})
+    assert context.sections == [(A, 1, PRIORITY_HIT)]
+    assert context.tokens == 25
+    assert estimate_tokens(context.text) <= 25 + estimate_tokens("\n\n\n")
+
+
+def test_unmatched_and_previous_documents(doc_a):
+    doc_b = make_document(B, [(2, '申込'), (2, '締切')])
+    doc_c = make_document(C, [(2, '前回の話題')])
+    context = ContextAssembler(budget_tokens=10_000, neighbor_sections=0).assemble(
+        {A: doc_a, B: doc_b}, {(A, 1): 1.0}, {C: doc_c, A: doc_a})
+    priorities = [(source, priority) for source, _index, priority in context.sections]
+    assert priorities[:3] == [(A, PRIORITY_HIT), (A, PRIORITY_SUBTREE), (A, PRIORITY_SUBTREE)]
+    assert priorities[3:] == [(B, PRIORITY_DOCUMENT), (B, PRIORITY_DOCUMENT), (C, PRIORITY_PREVIOUS)]
+    # 今回選ばれたドキュメントと重なる前回のドキュメントは重複して入れない
+    assert context.sources == [A, B, C]
+    assert context.text.count(f"(Source: {A})") == 1
+    assert "--- Document 3 (Source: https://example.com/c)" in context.text
+
+
+def test_documents_mode_ignores_section_scores(doc_a):
+    context = ContextAssembler(budget_tokens=10_000, mode='documents').assemble({A: doc_a}, {(A, 4): 1.0})
+    assert [index for _source, index, _priority in context.sections] == list(range(6))
+    assert {priority for _source, _index, priority in context.sections} == {PRIORITY_DOCUMENT}
+    with pytest.raises(ValueError):
+        ContextAssembler(mode='pages')
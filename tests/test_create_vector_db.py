@@ -0,0 +1,47 @@
+"""make_database/create_vector_db.py のEmbeddingのバッチ処理のテスト (APIは呼ばない)"""
+import pytest
+
+from make_database import create_vector_db
+from make_database.embedding_cache import EmbeddingCache, make_cache_key
+from make_database.create_vector_db import EMBEDDING_TASK_TYPE, embed_texts_with_cache
+
+MODEL = 'models/test-embedding'
+
+
+@pytest.fixture
+def embed_calls(monkeypatch):
+    """genai.embed_content の代わりに、'失敗' を含むテキストのバッチで例外を送出する関数を使う"""
+    calls = []
+
+    def embed_content(model, content, task_type):
+        calls.append(list(content))
+        if any('失敗' in text for text in content):
+            raise ValueError("invalid content")
+        return {'embedding': [[float(len(text)), 1.0] for text in content]}
+
+    monkeypatch.setattr(create_vector_db.genai, 'embed_content', embed_content)
+    monkeypatch.setattr(create_vector_db.time, 'sleep', lambda seconds: None)
+    return calls
+
+
+def test_completed_batches_are_cached_before_a_later_batch_fails(tmp_path, embed_calls):
+    cache = EmbeddingCache(str(tmp_path / 'cache.sqlite3'))
+    texts = ["本文1", "本文2", "失敗する本文", "本文4"]
+    try:
+        with pytest.raises(ValueError):
+            embed_texts_with_cache(texts, MODEL, cache, batch_size=2, workers=1, requests_per_minute=60_000)
+        keys = [make_cache_key(text, MODEL, EMBEDDING_TASK_TYPE) for text in texts]
+        assert set(cache.get_many(keys)) == set(keys[:2])
+
+        # やり直すときは、保存済みのバッチのAPIを呼ばない
+        embed_calls.clear()
+        embeddings = embed_texts_with_cache(["本文1", "本文2", "本文4"], MODEL, cache, batch_size=2, workers=1, requests_per_minute=60_000)
+        assert embed_calls == [["本文4"]]
+        assert [list(vector) for vector in embeddings] == [[3.0, 1.0], [3.0, 1.0], [3.0, 1.0]]
+    finally:
+        cache.close()
+
+
+def test_estimate_tokens_is_shared_with_context_assembler():
+    from web_search import context_assembler
+    assert create_vector_db.estimate_tokens is context_assembler.estimate_tokens
@@ -0,0 +1,52 @@
+"""web_search/document_store.py のテスト"""
+import os
+import json
+
+import pytest
+
+from web_search.document_store import DocumentStore
+
+
+def write_page(directory, name, url, text):
+    page = {'url': url, 'title': name, 'content': [{'type': 'heading', 'level': 2, 'text': name}, {'type': 'paragraph', 'text': text}]}
+    with open(os.path.join(directory, f"{name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(page, f, ensure_ascii=False)
+
+
+def test_get_does_not_rescan_directory(tmp_path):
+    write_page(tmp_path, 'a', 'https://example.com/a', "本文A")
+    store = DocumentStore(str(tmp_path))
+    write_page(tmp_path, 'b', 'https://example.com/b', "本文B")
+
+    # 検索時にはディレクトリを見ない。新しいファイルは refreshed() で作り直したストアにだけ現れる
+    with pytest.raises(KeyError):
+        store.get('https://example.com/b')
+    refreshed = store.refreshed()
+    assert refreshed is not store
+    assert refreshed.version == store.version + 1
+    assert "本文B" in refreshed.get_markdown('https://example.com/b')
+    assert list(store.documents) == ['https://example.com/a']
+
+
+def test_refreshed_reuses_unchanged_documents(tmp_path):
+    write_page(tmp_path, 'a', 'https://example.com/a', "本文A")
+    write_page(tmp_path, 'b', 'https://example.com/b', "本文B")
+    store = DocumentStore(str(tmp_path))
+    assert store.refreshed() is store
+
+    write_page(tmp_path, 'b', 'https://example.com/b', "更新した本文B")
+    os.remove(os.path.join(tmp_path, 'a.json'))
+    refreshed = store.refreshed()
+    assert list(refreshed.documents) == ['https://example.com/b']
+    assert "更新した本文B" in refreshed.get_markdown('https://example.com/b')
+    # 元のストアは変わらない (処理中のクエリは古い内容のまま終わる)
+    assert "更新した" not in store.get_markdown('https://example.com/b')
+    assert 'https://example.com/a' in store.documents
+
+
+def test_refreshed_keeps_unchanged_entries(tmp_path):
+    write_page(tmp_path, 'a', 'https://example.com/a', "本文A")
+    store = DocumentStore(str(tmp_path))
+    write_page(tmp_path, 'b', 'https://example.com/b', "本文B")
+    refreshed = store.refreshed()
+    assert refreshed.get('https://example.com/a') is store.get('https://example.com/a')
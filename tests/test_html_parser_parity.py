@@ -0,0 +1,32 @@
+"""
+スクレイパーのHTML解析の各バックエンドが、benchmarks/fixtures/html/ の保存したページで
+正解 (golden.json、bs4 の出力) と同じ結果を返すかのテスト。正解は
+python -m benchmarks.bench_html_parser --update-golden で作り直す。
+"""
+import pytest
+
+from benchmarks import bench_html_parser
+from make_database import lxml_parser
+
+FIXTURES = bench_html_parser.load_fixtures()
+GOLDEN = bench_html_parser.load_golden()
+PAGES = [(kind, name, html) for kind, pages in FIXTURES.items() for name, html in pages]
+
+
+@pytest.fixture(autouse=True)
+def fixture_urls(monkeypatch):
+    monkeypatch.setattr(bench_html_parser.syllabus_scraper, 'SYLLABUS_DETAIL_BASE_URL',
+                        bench_html_parser.SYLLABUS_DETAIL_BASE_URL, raising=False)
+
+
+def test_golden_covers_all_fixtures():
+    assert sorted(GOLDEN) == sorted(name for _, name, _ in PAGES)
+
+
+@pytest.mark.parametrize('backend', lxml_parser.PARSER_BACKENDS)
+@pytest.mark.parametrize('kind, name, html', PAGES, ids=[name for _, name, _ in PAGES])
+def test_backend_matches_golden(backend, kind, name, html):
+    if backend == 'lxml' and not lxml_parser.LXML_AVAILABLE:
+        pytest.skip("lxml is not installed")
+    outputs = bench_html_parser.normalize(bench_html_parser.structured_outputs(kind, name, html, backend))
+    assert outputs == GOLDEN[name]
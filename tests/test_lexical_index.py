@@ -0,0 +1,66 @@
+"""web_search/lexical_index.py のテスト"""
+import pytest
+
+from web_search.lexical_index import BM25Index, RRF_K, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "学費の納入方法について",
+    "スクーリングの申込期限",
+    "学費と教材費の一覧",
+    "Web Campus login guide",
+    "",
+]
+
+
+@pytest.fixture(scope='module')
+def index():
+    return BM25Index.build(TEXTS)
+
+
+def test_tokenize_words_and_bigrams():
+    assert tokenize("ＷＥＢキャンパス 2025年") == ['web', 'キャ', 'ャン', 'ンパ', 'パス', '2025', '年']
+
+
+def test_search_ranks_by_bm25(index):
+    chunk_ids, scores = index.search("学費", 10)
+    # 同じ語を含む文書のうち短い方が上位。含まない文書は返さない
+    assert chunk_ids == [2, 0]
+    assert scores[0] > scores[1] > 0
+    assert index.search("web login", 10)[0] == [3]
+    assert index.search("存在しない語", 10) == ([], [])
+
+
+def test_search_respects_k_and_allowed_ids(index):
+    assert index.search("学費", 1)[0] == [2]
+    assert index.search("学費", 10, allowed_ids=[0, 3])[0] == [0]
+
+
+def test_repeated_query_tokens_add_weight(index):
+    # キーワードを足したクエリでは、その語のスコアが加算されて順位が変わる
+    assert index.search("学費 申込", 10)[0][0] == 1
+    assert index.search("学費 学費 申込", 10)[0][0] == 2
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    path = tmp_path / 'bm25_index.json'
+    index.save(str(path))
+    loaded = BM25Index.load(str(path))
+    assert loaded.num_docs == index.num_docs
+    for query in ("学費", "スクーリング", "web"):
+        assert loaded.search(query, 10)[0] == index.search(query, 10)[0]
+        assert loaded.search(query, 10)[1] == pytest.approx(index.search(query, 10)[1], abs=1e-3)
+
+
+def test_load_rejects_unknown_format(tmp_path):
+    path = tmp_path / 'bm25_index.json'
+    path.write_text('{"format": "other"}', encoding='utf-8')
+    with pytest.raises(ValueError):
+        BM25Index.load(str(path))
+
+
+def test_reciprocal_rank_fusion_combines_rankings():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]])
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2]
+    assert dict(fused)[1] == pytest.approx(1 / (RRF_K + 1) + 1 / (RRF_K + 2))
+    assert dict(fused)[2] == pytest.approx(1 / (RRF_K + 2))
+    assert reciprocal_rank_fusion([[], []]) == []
@@ -0,0 +1,41 @@
+"""web_search/model_providers.py のテスト (Gemini APIは呼ばない)"""
+import asyncio
+import types
+
+from web_search.model_providers import GeminiProvider, is_transient_error
+
+
+def fake_gemini_provider():
+    """Gemini APIの代わりに固定の値を返す GeminiProvider (同期版のAPIだけを持つ)"""
+    class FakeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def generate_content(self, prompt):
+            return types.SimpleNamespace(text=f"answer to {prompt}")
+
+    genai = types.SimpleNamespace(
+        embed_content=lambda model, content, task_type: {'embedding': [float(len(content))]},
+        GenerativeModel=FakeModel,
+    )
+    provider = GeminiProvider.__new__(GeminiProvider)
+    provider.genai = genai
+    provider.embedding_model = 'embedding'
+    provider.generation_model = 'generation'
+    return provider
+
+
+def test_async_calls_work_across_event_loops():
+    # リクエストごとに asyncio.run しても、同期版を別スレッドで呼ぶため2回目以降も動く
+    provider = fake_gemini_provider()
+    for _ in range(3):
+        assert asyncio.run(provider.aembed("abc")) == [3.0]
+        assert asyncio.run(provider.agenerate("q")) == "answer to q"
+
+
+def test_is_transient_error():
+    ResourceExhausted = type('ResourceExhausted', (Exception,), {})
+    assert is_transient_error(ResourceExhausted("429"))
+    assert is_transient_error(ConnectionError("reset"))
+    assert not is_transient_error(RuntimeError("Event loop is closed"))
+    assert not is_transient_error(ValueError("invalid api key"))
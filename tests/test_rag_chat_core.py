@@ -0,0 +1,219 @@
+"""web_search/rag_chat_core.py のテスト (LocalStubProvider を使い、APIは呼ばない)"""
+import os
+import json
+import asyncio
+
+import numpy as np
+import pytest
+
+from make_database.create_vector_db import create_chunks, build_chunk_store, build_lexical_index
+from web_search import rag_chat_core
+from web_search.answer_cache import SemanticAnswerCache
+from web_search.model_providers import LocalStubProvider
+from web_search.rag_chat_core import RAGChatSystem
+from web_search.tracing import Tracer
+from web_search.vector_index import build_index, save_index
+from web_search.vector_store import FAISS_INDEX_FILE, METADATA_FILE, begin_bundle, publish_bundle
+
+QUERY = "学費はいくらですか？"
+HISTORY = [{"role": "user", "content": "こんにちは"}, {"role": "assistant", "content": "こんにちは。"}]
+
+
+class CountingProvider(LocalStubProvider):
+    """Embeddingの呼び出し回数を数える"""
+
+    def __init__(self):
+        super().__init__()
+        self.embed_calls = 0
+
+    def embed(self, *args, **kwargs):
+        self.embed_calls += 1
+        return super().embed(*args, **kwargs)
+
+    async def aembed(self, *args, **kwargs):
+        self.embed_calls += 1
+        return await super().aembed(*args, **kwargs)
+
+
+@pytest.fixture(scope='module')
+def system():
+    return RAGChatSystem(provider=CountingProvider(), answer_cache=SemanticAnswerCache())
+
+
+def run(system, mode, chat_history):
+    session = system.new_session()
+    if mode == 'sync':
+        return system.process_chat_query(QUERY, chat_history, session=session)
+    if mode == 'async':
+        return asyncio.run(system.process_chat_query_async(QUERY, chat_history, session=session))
+    sources, *parts = list(system.stream_chat_query(QUERY, chat_history, session=session))
+    return "".join(parts), sources
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async', 'stream'])
+def test_cache_reuses_retrieval_embedding_without_history(system, mode):
+    system.answer_cache.clear()
+    system.provider.embed_calls = 0
+    answer, sources = run(system, mode, [])
+    assert system.provider.embed_calls == 1
+
+    # 同じ質問は、コンテキストを組み立てずに保存済みの回答と情報源を返す
+    hits = system.answer_cache.hits
+    assert run(system, mode, []) == (answer, sources)
+    assert system.answer_cache.hits == hits + 1
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async', 'stream'])
+def test_cache_embeds_question_separately_with_history(system, mode):
+    system.provider.embed_calls = 0
+    run(system, mode, HISTORY)
+    assert system.provider.embed_calls == 2
+
+
+class FailingProvider(LocalStubProvider):
+    """最初の failures 回のEmbeddingで error を送出する"""
+
+    def __init__(self, error, failures):
+        super().__init__()
+        self.error = error
+        self.failures = failures
+        self.embed_calls = 0
+
+    async def aembed(self, *args, **kwargs):
+        self.embed_calls += 1
+        if self.embed_calls <= self.failures:
+            raise self.error
+        return await super().aembed(*args, **kwargs)
+
+
+def embedding_system(provider):
+    return RAGChatSystem(provider=provider, answer_cache=False, fast_start=True)
+
+
+def test_embedding_fails_fast_on_non_transient_error(monkeypatch):
+    async def no_sleep(seconds):
+        raise AssertionError("should not wait before failing")
+    monkeypatch.setattr(asyncio, 'sleep', no_sleep)
+    provider = FailingProvider(RuntimeError("Event loop is closed"), failures=10)
+    system = embedding_system(provider)
+    with pytest.raises(RuntimeError):
+        asyncio.run(system._get_embedding_async(QUERY))
+    assert provider.embed_calls == 1
+
+
+def test_embedding_retries_transient_error(monkeypatch):
+    sleeps = []
+    async def no_sleep(seconds):
+        sleeps.append(seconds)
+    monkeypatch.setattr(asyncio, 'sleep', no_sleep)
+    provider = FailingProvider(ConnectionError("reset"), failures=2)
+    system = embedding_system(provider)
+    assert len(asyncio.run(system._get_embedding_async(QUERY))) == provider.dimension
+    assert provider.embed_calls == 3
+    assert [seconds for seconds in sleeps if seconds] == [5, 5]
+
+
+class LoopBoundProvider(LocalStubProvider):
+    """google.generativeai の非同期クライアントと同じく、最初に使ったイベントループでしか非同期版が動かない"""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.embed_calls = 0
+
+    def embed(self, *args, **kwargs):
+        self.embed_calls += 1
+        return super().embed(*args, **kwargs)
+
+    def _check_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        elif self.loop is not loop:
+            raise RuntimeError("Event loop is closed")
+
+    async def aembed(self, *args, **kwargs):
+        self._check_loop()
+        return await super().aembed(*args, **kwargs)
+
+    async def agenerate(self, *args, **kwargs):
+        self._check_loop()
+        return await super().agenerate(*args, **kwargs)
+
+
+@pytest.mark.parametrize('chat_history', [[], HISTORY])
+def test_stream_chat_query_twice_with_loop_bound_provider(chat_history):
+    provider = LoopBoundProvider()
+    system = RAGChatSystem(provider=provider, answer_cache=SemanticAnswerCache())
+    results = []
+    for _ in range(2):
+        session = system.new_session()
+        sources, *parts = list(system.stream_chat_query(QUERY, chat_history, session=session))
+        results.append((sources, "".join(parts)))
+    # 2回目もFAISS検索が行われ、1回目と同じ情報源と回答 (2回目は回答キャッシュから) を返す
+    assert results[0] == results[1]
+    assert results[0][0]
+    assert provider.embed_calls == (2 if not chat_history else 4)
+
+
+def write_document(documents_dir, text):
+    page = {
+        'url': 'https://example.com/fees',
+        'title': '学費',
+        'content': [{'type': 'heading', 'level': 2, 'text': '学費'}, {'type': 'paragraph', 'text': text}],
+    }
+    with open(os.path.join(documents_dir, 'fees.json'), 'w', encoding='utf-8') as f:
+        json.dump(page, f, ensure_ascii=False)
+    return page
+
+
+def publish_test_bundle(root, page, provider):
+    """create_vector_db.py と同じファイル構成の版を、スタブのEmbeddingで作って公開する"""
+    metadata = create_chunks(page)
+    vectors = np.array([provider.embed(chunk['text'], task_type='RETRIEVAL_DOCUMENT') for chunk in metadata], dtype='float32')
+    index, index_config = build_index(vectors, 'flat')
+    bundle = begin_bundle(root)
+    save_index(index, index_config, os.path.join(bundle, FAISS_INDEX_FILE))
+    with open(os.path.join(bundle, METADATA_FILE), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    build_chunk_store(metadata, bundle)
+    build_lexical_index(metadata, bundle)
+    return publish_bundle(root, bundle)
+
+
+class RecordingProvider(LocalStubProvider):
+    """回答生成に渡されたプロンプトを記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        return super().generate(prompt)
+
+
+def test_reload_swaps_documents_with_vector_store(tmp_path, monkeypatch):
+    root = tmp_path / 'vector_store'
+    documents_dir = tmp_path / 'documents'
+    root.mkdir()
+    documents_dir.mkdir()
+    monkeypatch.setattr(rag_chat_core, 'VECTOR_STORE_DIR', str(root))
+    monkeypatch.setattr(rag_chat_core, 'DOCUMENTS_DIR', str(documents_dir))
+    provider = RecordingProvider()
+    publish_test_bundle(str(root), write_document(str(documents_dir), "学費は年額10万円です。"), provider)
+    system = RAGChatSystem(provider=provider, tracer=Tracer(enabled=False), answer_cache=SemanticAnswerCache())
+
+    system.process_chat_query(QUERY, session=system.new_session())
+    assert "年額10万円" in provider.prompts[-1]
+
+    # 本文が変わったページで次の版を公開すると、チャンクとドキュメントがどちらも新しい版に切り替わる
+    version = publish_test_bundle(str(root), write_document(str(documents_dir), "学費は年額200万円です。"), provider)
+    assert system.reload_vector_store()
+    assert system.vector_store_version == version
+    assert any("年額200万円" in chunk.text for chunk in system.metadata)
+
+    system.process_chat_query(QUERY, session=system.new_session())
+    assert len(provider.prompts) == 2 # 版が変わったので回答キャッシュは使わない
+    assert "年額200万円" in provider.prompts[-1]
+    assert "年額10万円" not in provider.prompts[-1]
@@ -0,0 +1,41 @@
+"""make_database/rate_limiter.py のテスト"""
+from make_database import rate_limiter
+from make_database.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    """time.monotonic と time.sleep の代わり。sleep した分だけ時刻を進める"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_large_request_is_charged_in_full(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, 'sleep', clock.sleep)
+    bucket = TokenBucket(60000) # 1000 トークン/秒、容量は1秒分
+
+    assert bucket.acquire(30000) == 0.0
+    # 30000 トークンの借りを返し、次の1000トークンが貯まるまで (30秒) 待つ
+    assert abs(bucket.acquire(1000) - 30.0) < 1e-6
+    # 続けて要求しても、最後の要求より前の分は 1000 トークン/秒 (と最初の容量) を超えて消費できない
+    for _ in range(10):
+        bucket.acquire(30000)
+    consumed_before_last = 30000 + 1000 + 9 * 30000
+    assert clock.now * 1000 + bucket.capacity >= consumed_before_last - 1e-6
+
+
+def test_small_requests_within_capacity_do_not_wait(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, 'sleep', clock.sleep)
+    bucket = TokenBucket(600, capacity=10)
+    assert sum(bucket.acquire(1) for _ in range(10)) == 0.0
+    assert bucket.acquire(1) > 0.0
@@ -0,0 +1,78 @@
+"""syllabus_search/syllabus_db.py のテスト (合成したシラバスのCSVを使う)"""
+import csv
+
+import pytest
+
+from syllabus_search.syllabus_db import SYLLABUS_COLUMNS, SyllabusDatabase, read_build_info
+
+ROWS = [
+    {'category': '造形文化科目', 'period': '通年', 'subject_name': '日本美術史', 'schedule': 'なし',
+     'teacher_name': '清水花子准教授', 'detail_url': 'https://example.com/2025_1.html', 'overview': '古代から近代までの美術を概観する。'},
+    {'category': '専門教育科目', 'period': '前期', 'subject_name': '油彩画演習', 'schedule': '7/26～7/28',
+     'teacher_name': '秋山太郎教授', 'detail_url': 'https://example.com/2025_2.html', 'overview': '日本美術史の知識をもとに油彩で描く。'},
+    {'category': '専門教育科目', 'period': '後期', 'subject_name': '西洋美術史', 'schedule': 'なし',
+     'teacher_name': '乗木大朗講師', 'detail_url': 'https://example.com/2025_3.html', 'overview': 'ルネサンス以降の絵画を扱う。'},
+]
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SYLLABUS_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def database(tmp_path):
+    csv_path = tmp_path / 'syllabus.csv'
+    write_csv(csv_path, ROWS)
+    database = SyllabusDatabase.open(str(csv_path), str(tmp_path / 'syllabus.sqlite3'))
+    yield database
+    database.close()
+
+
+def test_rows_keep_csv_order(database):
+    assert database.rows() == ROWS
+
+
+def test_search_ranks_subject_name_matches_first(database):
+    results = database.search('日本美術史')
+    # 科目名での一致は概要での一致より重い
+    assert [row['row_id'] for row in results] == [0, 1]
+    assert results[0]['subject_name'] == '日本美術史'
+    assert '**' in results[1]['snippet']
+
+
+def test_search_requires_all_terms(database):
+    assert [row['row_id'] for row in database.search('美術史 ルネサンス')] == [2]
+    assert database.search('美術史 彫刻') == []
+
+
+def test_search_short_terms_use_substring_match(database):
+    # trigram索引で引けない2文字以下の語は部分一致で探し、科目名で一致したものを先に返す
+    assert [row['row_id'] for row in database.search('油彩')] == [1]
+    assert [row['row_id'] for row in database.search('清水')] == [0]
+    assert [row['row_id'] for row in database.search('美術 秋山')] == [1]
+
+
+def test_search_normalizes_query_and_ignores_empty(database):
+    # 半角カナもNFKCで揃えて引ける
+    assert [row['row_id'] for row in database.search('ﾙﾈｻﾝｽ')] == [2]
+    assert [row['row_id'] for row in database.search('「西洋美術史」')] == [2]
+    assert database.search('、。 ') == []
+    assert len(database.search('美術', limit=1)) == 1
+
+
+def test_open_rebuilds_when_csv_changes(tmp_path):
+    csv_path = tmp_path / 'syllabus.csv'
+    db_path = tmp_path / 'syllabus.sqlite3'
+    write_csv(csv_path, ROWS[:1])
+    SyllabusDatabase.open(str(csv_path), str(db_path)).close()
+    assert read_build_info(str(db_path))['row_count'] == '1'
+
+    write_csv(csv_path, ROWS)
+    database = SyllabusDatabase.open(str(csv_path), str(db_path))
+    try:
+        assert len(database.rows()) == 3
+    finally:
+        database.close()
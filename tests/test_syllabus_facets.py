@@ -0,0 +1,88 @@
+"""syllabus_search/syllabus_facets.py のテスト (合成したシラバスの行を使う)"""
+import datetime
+
+import pytest
+
+from syllabus_search.syllabus_facets import FacetQuery, SyllabusFacetIndex, parse_schedule, split_teachers
+
+D = datetime.date
+
+ROWS = [
+    {'category': '造形文化科目/文化総合科目', 'period': '通年', 'schedule': '7/26～7/28',
+     'teacher_name': '秋山太郎教授', 'detail_url': 'https://example.com/2025_1.html'},
+    {'category': '造形文化科目/文化総合科目', 'period': '前期', 'schedule': '10/4, 11/8',
+     'teacher_name': '清水花子准教授、乗木大朗講師', 'detail_url': 'https://example.com/2025_2.html'},
+    {'category': '専門教育科目', 'period': '後期', 'schedule': '12/20～1/10',
+     'teacher_name': '冬木一郎講師', 'detail_url': 'https://example.com/2025_3.html'},
+    {'category': '専門教育科目', 'period': '通年', 'schedule': 'なし',
+     'teacher_name': '清水花子准教授', 'detail_url': 'https://example.com/2025_4.html'},
+]
+
+
+@pytest.fixture(scope='module')
+def facet_index():
+    return SyllabusFacetIndex(ROWS)
+
+
+@pytest.mark.parametrize('schedule, expected', [
+    ('7/26～7/28', ((D(2025, 7, 26), D(2025, 7, 28)),)),
+    ('7/26, 8/2', ((D(2025, 7, 26), D(2025, 7, 26)), (D(2025, 8, 2), D(2025, 8, 2)))),
+    ('12/20～1/10', ((D(2025, 12, 20), D(2026, 1, 10)),)), # 1～3月は翌年
+    ('7月26日～7月28日', ((D(2025, 7, 26), D(2025, 7, 28)),)),
+    ('なし', ()),
+    ('2/30', ()), # 存在しない日付は飛ばす
+])
+def test_parse_schedule(schedule, expected):
+    assert parse_schedule(schedule, 2025) == expected
+
+
+def test_parse_schedule_without_academic_year_needs_explicit_year():
+    assert parse_schedule('7/26') == ()
+    assert parse_schedule('2025/7/26') == ((D(2025, 7, 26), D(2025, 7, 26)),)
+
+
+def test_split_teachers_strips_titles():
+    assert split_teachers('清水花子准教授、乗木大朗講師') == ('清水花子', '乗木大朗')
+
+
+def test_parse_question_summer_schooling(facet_index):
+    facet_query = facet_index.parse_question('夏のスクーリング科目を教えて')
+    assert facet_query.date_ranges == [(D(2025, 7, 1), D(2025, 9, 30))]
+    assert facet_query.has_schedule is None
+    assert facet_index.query(facet_query) == [0]
+
+
+def test_parse_question_winter_wraps_into_next_year(facet_index):
+    facet_query = facet_index.parse_question('冬期の科目')
+    assert facet_query.date_ranges == [(D(2025, 12, 1), D(2026, 2, 28))]
+    assert facet_index.query(facet_query) == [2]
+
+
+def test_parse_question_ignores_season_in_teacher_name(facet_index):
+    facet_query = facet_index.parse_question('秋山先生の授業は？')
+    assert facet_query.teachers == ['秋山']
+    assert facet_query.date_ranges is None
+    assert facet_index.query(facet_query) == [0]
+    # 教員名に季節が含まれていても、時期として書かれた季節は読み取る
+    facet_query = facet_index.parse_question('冬木先生の冬のスクーリング')
+    assert facet_query.date_ranges == [(D(2025, 12, 1), D(2026, 2, 28))]
+    assert facet_index.query(facet_query) == [2]
+
+
+def test_parse_question_months_categories_and_schooling(facet_index):
+    facet_query = facet_index.parse_question('10月～11月の文化総合科目')
+    assert facet_query.categories == ['文化総合科目']
+    assert facet_query.date_ranges == [(D(2025, 10, 1), D(2025, 11, 30))]
+    assert facet_index.query(facet_query) == [1]
+
+    facet_query = facet_index.parse_question('清水先生のスクーリング')
+    assert facet_query.has_schedule is True
+    assert facet_index.query(facet_query) == [1]
+
+
+def test_query_combines_facets(facet_index):
+    assert facet_index.query(FacetQuery()) == [0, 1, 2, 3]
+    assert facet_index.query(FacetQuery(periods=['通年'])) == [0, 3]
+    assert facet_index.query(FacetQuery(categories=['専門教育科目'], has_schedule=False)) == [3]
+    assert facet_index.query(FacetQuery(teachers=['清水'], periods=['前期', '通年'])) == [1, 3]
+    assert facet_index.query(FacetQuery(date_ranges=[(D(2026, 1, 1), D(2026, 1, 31))])) == [2]
@@ -0,0 +1,48 @@
+"""make_database/syllabus_scraper.py の検索結果のページネーションのテスト"""
+import os
+
+import pytest
+
+from make_database import syllabus_scraper
+from make_database.syllabus_scraper import SyllabusCheckpoint
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'fixtures', 'html', 'syllabus')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def offline_scraper(monkeypatch):
+    """検索結果のページを順に返し、詳細ページは取得せずに概要を返すようにする"""
+    def install(pages):
+        pages = list(pages)
+        monkeypatch.setattr(syllabus_scraper, 'LIST_PAGE_WAIT', 0)
+        # 検索と詳細のURLはスクレイパーの実行時に --base-url から決まる
+        monkeypatch.setattr(syllabus_scraper, 'SEARCH_URL', "https://ccap02.musabi.ac.jp/syllabus/pubSearchResult.php",
+                            raising=False)
+        monkeypatch.setattr(syllabus_scraper, 'SYLLABUS_DETAIL_BASE_URL', "https://ccap02.musabi.ac.jp/syllabus/html/",
+                            raising=False)
+        monkeypatch.setattr(syllabus_scraper, '_fetch_page', lambda session, url, method='GET', payload=None: pages.pop(0))
+        monkeypatch.setattr(syllabus_scraper, 'get_syllabus_overview',
+                            lambda session, detail_url, cache=None, manifest=None: "overview")
+    return install
+
+
+def test_complete_when_last_page_reached(offline_scraper, tmp_path):
+    offline_scraper([read_fixture('search_page_1.html'), read_fixture('search_page_2.html')])
+    items, complete = syllabus_scraper.scrape_all_syllabus_data_with_overview(
+        checkpoint=SyllabusCheckpoint(str(tmp_path / 'checkpoint.jsonl')), requests_per_second=1000)
+    assert complete
+    assert items
+
+
+def test_incomplete_when_page_is_empty_mid_pagination(offline_scraper, tmp_path):
+    offline_scraper([read_fixture('search_page_1.html'), ""])
+    checkpoint = SyllabusCheckpoint(str(tmp_path / 'checkpoint.jsonl'))
+    items, complete = syllabus_scraper.scrape_all_syllabus_data_with_overview(checkpoint=checkpoint, requests_per_second=1000)
+    assert not complete
+    # 取得済みの科目はチェックポイントに残り、次回はそこから再開できる
+    assert len(checkpoint.load()) == len(items) > 0
@@ -0,0 +1,56 @@
+"""web_search/vector_index.py のテスト"""
+import os
+
+import faiss
+import numpy as np
+import pytest
+
+from web_search import vector_index
+
+needs_proc_maps = pytest.mark.skipif(not os.path.exists('/proc/self/maps'), reason="needs /proc/self/maps")
+
+
+@needs_proc_maps
+@pytest.mark.parametrize('index_type, options', [(index_type, {}) for index_type in vector_index.INDEX_TYPES] + [
+    ('sq8', {'refine': True}),
+    ('pq', {'refine': True}),
+])
+def test_read_index_mmap_maps_the_file(tmp_path, index_type, options):
+    vectors = np.random.default_rng(0).random((2000, 64), dtype='float32')
+    index, config = vector_index.build_index(vectors, index_type, **options)
+    index_path = str(tmp_path / f'faiss_index_{index_type}.bin')
+    vector_index.save_index(index, config, index_path)
+
+    loaded, _ = vector_index.load_index(index_path, mmap=True)
+    assert vector_index.is_memory_mapped(index_path)
+    _, ids = loaded.search(vectors[:5], 1)
+    assert ids[:, 0].tolist() == list(range(5))
+
+    del loaded
+    copied, _ = vector_index.load_index(index_path, mmap=False)
+    assert not vector_index.is_memory_mapped(index_path)
+    _, ids = copied.search(vectors[:5], 1)
+    assert ids[:, 0].tolist() == list(range(5))
+
+
+@pytest.mark.parametrize('index_type', ['sq8', 'pq'])
+def test_refine_layer_is_optional(tmp_path, index_type):
+    vectors = np.random.default_rng(0).random((2000, 64), dtype='float32')
+    index, config = vector_index.build_index(vectors, index_type)
+    refined, refined_config = vector_index.build_index(vectors, index_type, refine=True)
+    # 既定では元のベクトルを持たないため、flat (4バイト × 次元数) よりずっと小さい
+    assert not isinstance(faiss.downcast_index(index), faiss.IndexRefineFlat)
+    assert config['refine'] is False and 'refine_k_factor' not in config
+    assert isinstance(faiss.downcast_index(refined), faiss.IndexRefineFlat)
+    assert refined_config['refine'] is True
+    flat_bytes = vectors.nbytes
+    assert faiss.serialize_index(index).size < flat_bytes / 2
+    assert faiss.serialize_index(refined).size > flat_bytes
+
+    # 保存した設定から、並べ直しの有無に合わせて検索パラメータを設定し直せる
+    for built, built_config, name in ((index, config, 'plain'), (refined, refined_config, 'refine')):
+        index_path = str(tmp_path / f'{index_type}_{name}.bin')
+        vector_index.save_index(built, built_config, index_path)
+        loaded, loaded_config = vector_index.load_index(index_path)
+        assert loaded_config == built_config
+        assert loaded.search(vectors[:1], 5)[1].shape == (1, 5)
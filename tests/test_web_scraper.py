@@ -0,0 +1,44 @@
+"""make_database/web_scraper.py のリンク収集のテスト"""
+import requests
+
+from make_database import web_scraper
+
+TOP_PAGE = b"""<html><body><ul><li class="js-accordion">
+<a class="js-accordion-trigger" href="/campus-2nd">campus</a>
+<div class="l-global-nav__second"><a href="/campus-2nd/news">news</a><a href="/campus-2nd/guide.pdf">pdf</a></div>
+</li></ul></body></html>"""
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, content=None, error=None):
+        self.content = content
+        self.error = error
+
+    def get(self, url, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return FakeResponse(self.content)
+
+
+def test_links_complete_when_menu_found():
+    links, complete = web_scraper.get_student_menu_links("https://cc.musabi.ac.jp", FakeSession(TOP_PAGE))
+    assert links == ["https://cc.musabi.ac.jp/campus-2nd/news"]
+    assert complete
+
+
+def test_links_incomplete_when_top_page_fails():
+    session = FakeSession(error=requests.exceptions.ConnectionError("down"))
+    assert web_scraper.get_student_menu_links("https://cc.musabi.ac.jp", session) == ([], False)
+
+
+def test_links_incomplete_when_menu_missing():
+    session = FakeSession(b"<html><body><p>maintenance</p></body></html>")
+    assert web_scraper.get_student_menu_links("https://cc.musabi.ac.jp", session) == ([], False)
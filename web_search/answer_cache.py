@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# --- 定数 (環境変数で上書き可能) ---
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('RAG_ANSWER_CACHE_MAX_ENTRIES', '256'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('RAG_ANSWER_CACHE_TTL_SECONDS', '3600'))
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('RAG_ANSWER_CACHE_THRESHOLD', '0.95'))
+
+
+class SemanticAnswerCache:
+    """
+    質問のEmbeddingをキーに回答を保存するキャッシュ。
+    新しい質問とのコサイン類似度が閾値以上で、かつ回答に使う情報源ファイルが同じなら保存済みの回答を返す。
+    件数の上限を超えたら最も長く使われていないものから捨て (LRU)、TTLを過ぎたものは使わない。
+    version (ベクトルストアとドキュメントの版) が変わったら全件破棄する。
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict() # {entry_id: エントリの辞書} (末尾ほど最近使われたもの)
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _normalize(self, vector):
+        vector = np.asarray(vector, dtype='float32')
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, version):
+        # ロックを保持した状態で呼ぶこと
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def _evict_expired(self, now):
+        # ロックを保持した状態で呼ぶこと
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry['created_at'] > self.ttl_seconds]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+    def lookup(self, query_vector, source_documents, version):
+        """
+        類似した質問の回答があれば {'answer', 'sources', 'similarity'} を返す。無ければNone。
+        """
+        query_vector = self._normalize(query_vector)
+        source_key = frozenset(source_documents)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            self._evict_expired(now)
+            best_id, best_similarity = None, -1.0
+            for entry_id, entry in self.entries.items():
+                if entry['source_key'] != source_key:
+                    continue
+                similarity = float(np.dot(query_vector, entry['vector']))
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(best_id)
+            self.hits += 1
+            entry = self.entries[best_id]
+            return {'answer': entry['answer'], 'sources': list(entry['sources']), 'similarity': best_similarity}
+
+    def store(self, query_vector, source_documents, answer, version, sources=None):
+        """
+        回答をキャッシュに保存する。上限を超えたら最も古く使われたものを捨てる。
+        source_documents は照合に使う情報源、sources はヒットしたときに返す情報源 (省略時は source_documents)。
+        """
+        entry = {
+            'vector': self._normalize(query_vector),
+            'source_key': frozenset(source_documents),
+            'sources': list(sources if sources is not None else source_documents),
+            'answer': answer,
+            'created_at': time.monotonic(),
+        }
+        with self._lock:
+            self._check_version(version)
+            self._next_id += 1
+            self.entries[self._next_id] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,209 @@
+import os
+import json
+import mmap
+import numpy as np
+
+# --- 定数 ---
+CHUNK_STORE_FORMAT = 'chunk-store-v1'
+COLUMNS_FILE = 'columns.npy'
+TEXTS_FILE = 'texts.bin'
+STRINGS_FILE = 'strings.json'
+# チャンクごとの列。文字列は文字列表の番号、本文はtexts.bin上のバイト範囲で持つ
+# offset_start/offset_end はページのMarkdown上の範囲 (create_vector_db.py の offset)。無い場合は -1
+COLUMN_DTYPE = np.dtype([
+    ('source', '<i4'),
+    ('title', '<i4'),
+    ('headings', '<i4'), # 見出しの階層の表 (heading_paths) の番号
+    ('text_start', '<i8'),
+    ('text_end', '<i8'),
+    ('offset_start', '<i4'),
+    ('offset_end', '<i4'),
+])
+
+
+def chunk_store_paths(directory):
+    """チャンクストアを構成するファイルのパスのリスト"""
+    return [os.path.join(directory, name) for name in (COLUMNS_FILE, TEXTS_FILE, STRINGS_FILE)]
+
+
+def chunk_store_exists(directory):
+    return all(os.path.exists(path) for path in chunk_store_paths(directory))
+
+
+class ChunkView:
+    """
+    チャンクストアの1チャンクを指す軽量なビュー。
+    値はアクセスされたときに列と文字列表から引くため、チャンクごとの辞書や文字列のコピーを持たない。
+    """
+
+    __slots__ = ('_store', 'chunk_id')
+
+    def __init__(self, store, chunk_id):
+        self._store = store
+        self.chunk_id = chunk_id
+
+    @property
+    def source(self):
+        return self._store.strings[self._store._column['source'][self.chunk_id]]
+
+    @property
+    def title(self):
+        return self._store.strings[self._store._column['title'][self.chunk_id]]
+
+    @property
+    def headings(self):
+        """見出しの階層 (文字列のタプル)。同じ階層のチャンクは同じタプルを共有する"""
+        return self._store.heading_paths[self._store._column['headings'][self.chunk_id]]
+
+    @property
+    def text(self):
+        return self._store.text(self.chunk_id)
+
+    @property
+    def offset(self):
+        """Markdown上の範囲 (開始, 終了)。古いメタデータから作った場合はNone"""
+        start = int(self._store._column['offset_start'][self.chunk_id])
+        if start < 0:
+            return None
+        return start, int(self._store._column['offset_end'][self.chunk_id])
+
+    def to_dict(self):
+        """metadata.json と同じ形式の辞書にする"""
+        record = {'source': self.source, 'title': self.title, 'headings': list(self.headings), 'text': self.text}
+        if self.offset is not None:
+            record['offset'] = list(self.offset)
+        return record
+
+    def __repr__(self):
+        return f"ChunkView({self.chunk_id}, source={self.source!r})"
+
+
+class ChunkStore:
+    """
+    チャンクのメタデータを列形式で持つ読み取り専用のストア (FAISS・BM25と同じ並び)。
+    情報源URL・タイトル・見出しは文字列表に1回だけ持って整数で参照し、列はNumPyの配列、
+    本文は1つのバイナリにまとめてメモリマップから範囲で読む。
+    ロード時にチャンク数に比例する解析をしないため、チャンクが増えても起動はほぼ一定時間で済む。
+    """
+
+    def __init__(self, columns, strings, heading_paths, texts):
+        self.columns = columns # COLUMN_DTYPE の構造化配列 (メモリマップの場合は読み取り専用)
+        # np.memmap の添字アクセスは遅いため、同じメモリを指す通常のndarrayとして列ごとに持っておく
+        self._column = {name: np.asarray(columns)[name] for name in COLUMN_DTYPE.names}
+        self.strings = strings
+        self.heading_paths = heading_paths # 見出しの階層のタプルのリスト
+        self._texts = texts # 本文をつなげたUTF-8のバイト列 (mmapまたはbytes)
+        self._mmap = texts if isinstance(texts, mmap.mmap) else None
+
+    @classmethod
+    def from_records(cls, records):
+        """metadata.json 形式の辞書のリストから作る (メモリ上に持つ)"""
+        columns, strings, heading_paths, texts = _encode_records(records)
+        return cls(columns, strings, heading_paths, texts)
+
+    @classmethod
+    def load(cls, directory):
+        """write() で保存したストアをロードする。列と本文はメモリマップで開く"""
+        columns_path, texts_path, strings_path = chunk_store_paths(directory)
+        with open(strings_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != CHUNK_STORE_FORMAT:
+            raise ValueError(f"Unsupported chunk store format: {data.get('format')}")
+        columns = np.load(columns_path, mmap_mode='r')
+        if columns.dtype != COLUMN_DTYPE or len(columns) != data['num_chunks']:
+            raise ValueError(f"Chunk store columns do not match {strings_path}")
+        strings = data['strings']
+        heading_paths = [tuple(strings[string_id] for string_id in path) for path in data['heading_paths']]
+        # 空のファイルはメモリマップできないため、そのまま空のバイト列として扱う
+        if os.path.getsize(texts_path) == 0:
+            texts = b''
+        else:
+            with open(texts_path, 'rb') as f:
+                texts = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(columns, strings, heading_paths, texts)
+
+    @staticmethod
+    def write(records, directory):
+        """
+        metadata.json 形式の辞書のリストを保存する。
+        読み込み中のプロセスが壊れたファイルを見ないよう、一時ファイルに書いてから置き換える。
+        """
+        os.makedirs(directory, exist_ok=True)
+        columns, strings, heading_paths, texts = _encode_records(records)
+        string_ids = {value: string_id for string_id, value in enumerate(strings)}
+        data = {
+            'format': CHUNK_STORE_FORMAT,
+            'num_chunks': len(columns),
+            'strings': strings,
+            'heading_paths': [[string_ids[heading] for heading in path] for path in heading_paths],
+        }
+        columns_path, texts_path, strings_path = chunk_store_paths(directory)
+        with open(columns_path + '.tmp', 'wb') as f:
+            np.save(f, columns)
+        with open(texts_path + '.tmp', 'wb') as f:
+            f.write(texts)
+        with open(strings_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        # strings.json にチャンク数が入っているため、最後に置き換える
+        for path in (columns_path, texts_path, strings_path):
+            os.replace(path + '.tmp', path)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, chunk_id):
+        if not -len(self) <= chunk_id < len(self):
+            raise IndexError(f"chunk id out of range: {chunk_id}")
+        return ChunkView(self, chunk_id % len(self))
+
+    def __iter__(self):
+        for chunk_id in range(len(self)):
+            yield ChunkView(self, chunk_id)
+
+    def text(self, chunk_id):
+        start = int(self._column['text_start'][chunk_id])
+        return self._texts[start:int(self._column['text_end'][chunk_id])].decode('utf-8')
+
+    def texts(self):
+        """全チャンクの本文を順に返す (BM25インデックスを作るときなどに使う)"""
+        for chunk_id in range(len(self)):
+            yield self.text(chunk_id)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def _encode_records(records):
+    """辞書のリストを (列, 文字列表, 見出しの階層の表, 本文のバイト列) に変換する"""
+    strings = []
+    string_ids = {}
+    heading_paths = []
+    heading_path_ids = {}
+
+    def intern(value):
+        string_id = string_ids.get(value)
+        if string_id is None:
+            string_id = string_ids[value] = len(strings)
+            strings.append(value)
+        return string_id
+
+    columns = np.zeros(len(records), dtype=COLUMN_DTYPE)
+    text_parts = []
+    position = 0
+    for chunk_id, record in enumerate(records):
+        path = tuple(record['headings'])
+        path_id = heading_path_ids.get(path)
+        if path_id is None:
+            path_id = heading_path_ids[path] = len(heading_paths)
+            heading_paths.append(tuple(strings[intern(heading)] for heading in path))
+        encoded = record['text'].encode('utf-8')
+        text_parts.append(encoded)
+        offset = record.get('offset') or (-1, -1)
+        columns[chunk_id] = (
+            intern(record['source']), intern(record['title']), path_id,
+            position, position + len(encoded), offset[0], offset[1],
+        )
+        position += len(encoded)
+    return columns, strings, heading_paths, b''.join(text_parts)
@@ -0,0 +1,169 @@
+import os
+import math
+
+# --- 定数 ---
+# 回答生成のプロンプトに入れるコンテキストのトークン数の上限 (環境変数 RAG_CONTEXT_TOKEN_BUDGET で変更可能)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKEN_BUDGET', '4000'))
+# コンテキストの作り方: sections はヒットしたセクション (と配下の小見出し・前後のセクション) だけ、
+# documents は選ばれたページ全体を先頭から入れる (どちらもトークン数の上限までに収める)
+CONTEXT_MODES = ('sections', 'documents')
+CONTEXT_MODE = os.getenv('RAG_CONTEXT_MODE', 'sections')
+# ヒットしたセクション (配下の小見出しを含む) の前後に加えるセクション数
+NEIGHBOR_SECTIONS = int(os.getenv('RAG_CONTEXT_WINDOW', '1'))
+# 英数字は約4文字で1トークン。日本語はおおよそ1文字1トークン以下なので1文字1トークンとして多めに見積もる
+ASCII_CHARS_PER_TOKEN = 4
+# 選ばれる順 (コンテキストに入れる優先度)
+PRIORITY_HIT = 'hit'
+PRIORITY_SUBTREE = 'subtree'
+PRIORITY_NEIGHBOR = 'neighbor'
+PRIORITY_DOCUMENT = 'document'
+PRIORITY_PREVIOUS = 'previous'
+SECTION_GAP_MARKER = '(中略)'
+
+
+def estimate_tokens(text):
+    """トークン数の概算 (APIを呼ばずにローカルで数える)"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil(ascii_chars / ASCII_CHARS_PER_TOKEN) + len(text) - ascii_chars
+
+
+def _truncate_to_tokens(text, max_tokens):
+    """textを先頭からmax_tokens以内に切り詰める"""
+    if max_tokens <= 0:
+        return ''
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+class AssembledContext:
+    """組み立てたコンテキストと、その内訳"""
+
+    def __init__(self, text, sources, tokens, budget, sections):
+        self.text = text
+        self.sources = sources # コンテキストに1つ以上のセクションが入ったドキュメントの情報源URL
+        self.tokens = tokens # 見出しなどを含むコンテキスト全体の推定トークン数
+        self.budget = budget
+        self.sections = sections # [(情報源URL, セクション番号, 優先度)] (選ばれた順)
+
+    def to_dict(self):
+        counts = {}
+        for _source, _index, priority in self.sections:
+            counts[priority] = counts.get(priority, 0) + 1
+        return {'tokens': self.tokens, 'budget': self.budget, 'sections': counts}
+
+
+def subtree_end(sections, index):
+    """index のセクションの配下 (より深い見出し) が続く範囲の終わり (その次のセクション番号) を返す"""
+    level = sections[index]['level']
+    end = index + 1
+    if level > 0:
+        while end < len(sections) and sections[end]['level'] > level:
+            end += 1
+    return end
+
+
+class ContextAssembler:
+    """
+    ドキュメントをセクション (見出しごとの区切り) 単位でトークン数の上限まで詰めてコンテキストを作る。
+    sections モードでは、検索でヒットしたセクションをスコア順に、次にその配下の小見出しのセクションを、
+    次に前後 neighbor_sections 個のセクションを、最後に前回の回答で使ったドキュメントのセクションを、
+    上限に収まる限り入れる。
+    """
+
+    def __init__(self, budget_tokens=CONTEXT_TOKEN_BUDGET, neighbor_sections=NEIGHBOR_SECTIONS, mode=CONTEXT_MODE):
+        if mode not in CONTEXT_MODES:
+            raise ValueError(f"Unknown context mode: {mode}. Choose from {', '.join(CONTEXT_MODES)}.")
+        self.budget_tokens = budget_tokens
+        self.neighbor_sections = neighbor_sections
+        self.mode = mode
+
+    def _candidates(self, documents, section_scores, previous_documents):
+        """(情報源URL, セクション番号, 優先度) を優先度の高い順に返す"""
+        if self.mode == 'documents':
+            section_scores = {}
+        hits = sorted(section_scores.items(), key=lambda item: item[1], reverse=True)
+        for (source, index), _score in hits:
+            yield source, index, PRIORITY_HIT
+        for (source, index), _score in hits:
+            for child in range(index + 1, subtree_end(documents[source]['sections'], index)):
+                yield source, child, PRIORITY_SUBTREE
+        for (source, index), _score in hits:
+            sections = documents[source]['sections']
+            end = subtree_end(sections, index)
+            for offset in range(1, self.neighbor_sections + 1):
+                for neighbor in (index - offset, end - 1 + offset):
+                    if 0 <= neighbor < len(sections):
+                        yield source, neighbor, PRIORITY_NEIGHBOR
+        # ヒットしたセクションが対応付けられなかったドキュメント (documents モードでは全ドキュメント) は先頭から入れる
+        hit_sources = {source for source, _index in section_scores}
+        for source, doc in documents.items():
+            if source not in hit_sources:
+                for index in range(len(doc['sections'])):
+                    yield source, index, PRIORITY_DOCUMENT
+        for source, doc in previous_documents.items():
+            for index in range(len(doc['sections'])):
+                yield source, index, PRIORITY_PREVIOUS
+
+    def _document_header(self, number, source, doc):
+        header = f"--- Document {number} (Source: {source})"
+        if doc.get('title'):
+            header += f"\n# {doc['title']}"
+        return header
+
+    def assemble(self, documents, section_scores, previous_documents=None):
+        """
+        documents: 今回選ばれたドキュメント {情報源URL: DocumentStoreのドキュメント情報} (順序付き)。
+        section_scores: ヒットしたセクションのスコア {(情報源URL, セクション番号): スコア}。
+        previous_documents: 前回の回答で使ったドキュメント (documents と同じ形式)。
+        """
+        previous_documents = {
+            source: doc for source, doc in (previous_documents or {}).items() if source not in documents
+        }
+        all_documents = dict(documents)
+        all_documents.update(previous_documents)
+        document_numbers = {source: number for number, source in enumerate(all_documents, start=1)}
+
+        used_tokens = 0
+        selected = {} # {情報源URL: {セクション番号: セクションのMarkdown}}
+        order = []
+        for source, index, priority in self._candidates(documents, section_scores, previous_documents):
+            chosen = selected.get(source)
+            if chosen is not None and index in chosen:
+                continue
+            doc = all_documents[source]
+            section_text = doc['sections'][index]['markdown']
+            cost = doc['sections'][index]['tokens']
+            if chosen is None:
+                cost += estimate_tokens(self._document_header(document_numbers[source], source, doc))
+            if used_tokens + cost > self.budget_tokens:
+                if order:
+                    continue # 入らないセクションは飛ばし、より小さいセクションで残りを埋める
+                # 最もスコアの高いセクションだけで上限を超える場合は切り詰めてでも入れる
+                section_text = _truncate_to_tokens(section_text, self.budget_tokens - (cost - doc['sections'][index]['tokens']))
+                cost = self.budget_tokens
+            selected.setdefault(source, {})[index] = section_text
+            order.append((source, index, priority))
+            used_tokens += cost
+
+        parts = []
+        sources = []
+        for source, doc in all_documents.items():
+            chosen = selected.get(source)
+            if not chosen:
+                continue
+            sources.append(source)
+            lines = [self._document_header(document_numbers[source], source, doc)]
+            previous_index = None
+            for index in sorted(chosen):
+                if previous_index is not None and index != previous_index + 1:
+                    lines.append(SECTION_GAP_MARKER)
+                lines.append(chosen[index])
+                previous_index = index
+            parts.append("\n\n".join(lines) + "\n")
+        return AssembledContext("\n\n".join(parts), sources, used_tokens, self.budget_tokens, order)
@@ -0,0 +1,180 @@
+import os
+import json
+import logging
+
+# pagesからパッケージとして読み込まれる場合と、web_search内で直接実行される場合の両方に対応
+try:
+    from web_search.context_assembler import estimate_tokens
+except ImportError:
+    from context_assembler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def render_markdown(json_data):
+    """
+    構造化JSONデータをMarkdown形式に変換する。
+    戻り値は (Markdown, 各contentの要素がMarkdown内で占める範囲 [(開始, 終了)] のリスト)。
+    """
+    markdown_parts = []
+    item_parts = [] # 各要素の (最初の行の番号, 最後の行の次の番号)
+
+    if 'title' in json_data and json_data['title']:
+        markdown_parts.append(f"# {json_data['title']}")
+    if 'url' in json_data and json_data['url']:
+        markdown_parts.append(f"URL: {json_data['url']}\n")
+
+    for item in json_data['content']:
+        first_part = len(markdown_parts)
+        if item['type'] == 'heading':
+            level = min(item['level'], 6)
+            markdown_parts.append(f"{'#' * level} {item['text']}")
+        elif item['type'] == 'paragraph':
+            markdown_parts.append(item['text'])
+        elif item['type'] == 'list':
+            for li_item in item['items']:
+                markdown_parts.append(f"- {li_item}")
+        elif item['type'] == 'table':
+            headers = item.get('headers', [])
+            rows = item.get('rows', [])
+
+            if headers:
+                markdown_parts.append("| " + " | ".join(headers) + " |")
+                markdown_parts.append("|" + "---"*len(headers) + "|")
+
+            for row in rows:
+                markdown_parts.append("| " + " | ".join(row) + " |")
+
+        item_parts.append((first_part, len(markdown_parts)))
+        markdown_parts.append("")
+
+    # 行の番号を、行を改行で結合した文字列の中の位置に直す
+    part_offsets = [0]
+    for part in markdown_parts:
+        part_offsets.append(part_offsets[-1] + len(part) + 1)
+    raw = "\n".join(markdown_parts)
+    markdown = raw.strip()
+    leading = len(raw) - len(raw.lstrip())
+
+    def clamp(position):
+        return min(max(position - leading, 0), len(markdown))
+
+    item_spans = [
+        (clamp(part_offsets[first]), clamp(part_offsets[last] - 1 if last > first else part_offsets[first]))
+        for first, last in item_parts
+    ]
+    return markdown, item_spans
+
+
+def convert_json_to_markdown(json_data):
+    """構造化JSONデータをMarkdown形式に変換する"""
+    return render_markdown(json_data)[0]
+
+
+def split_sections(json_data, markdown, item_spans):
+    """
+    本文を見出しごとのセクションに分け、Markdown上の範囲と推定トークン数を持たせる。
+    各セクションの headings は create_vector_db.py のチャンクと同じ見出しの階層、
+    level は見出しのレベル (最初の見出しより前の本文は0)。
+    """
+    sections = []
+    boundaries = [] # (開始位置, 見出しの階層, レベル)
+    current_headings = []
+    for item, (item_start, _item_end) in zip(json_data['content'], item_spans):
+        if item['type'] == 'heading':
+            current_headings = current_headings[:item['level'] - 1]
+            current_headings.append(item['text'])
+            boundaries.append((item_start, tuple(current_headings), item['level']))
+        elif not boundaries:
+            boundaries.append((item_start, (), 0))
+
+    for i, (start, headings, level) in enumerate(boundaries):
+        end = boundaries[i + 1][0] if i + 1 < len(boundaries) else len(markdown)
+        section_markdown = markdown[start:end].strip()
+        if section_markdown:
+            sections.append({
+                'headings': headings,
+                'level': level,
+                'start': start,
+                'end': end,
+                'markdown': section_markdown,
+                'tokens': estimate_tokens(section_markdown),
+            })
+    return sections
+
+
+class DocumentStore:
+    """
+    スクレイピング済みJSONを読み込み、Markdownに変換してメモリに保持する。キーは各ページの情報源URL ('url')。
+    作った後は書き換えず、検索時にはファイルI/Oを行わない。ファイルの変更は、ベクトルストアの新しい版を
+    ロードするときに refreshed() で読み直す (更新時刻とサイズが変わったファイルだけを読み、残りは使い回す)。
+    """
+
+    def __init__(self, directory, previous=None, file_stats=None):
+        """previous: 変更の無いファイルのエントリを使い回す、同じディレクトリの以前の DocumentStore"""
+        self.directory = directory
+        self._file_stats = file_stats if file_stats is not None else self._scan() # {file_path: (mtime_ns, size)}
+        self.documents = self._load(previous) # {source_url: ドキュメント情報の辞書}
+        # 内容が変わるたびに増える (回答キャッシュの無効化に使う)
+        self.version = previous.version + 1 if previous is not None else 0
+        logger.info("Document store loaded %d documents from %s", len(self.documents), self.directory)
+
+    def _scan(self):
+        file_stats = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.json'):
+                stat = entry.stat()
+                file_stats[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return file_stats
+
+    def _load_file(self, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        markdown, item_spans = render_markdown(data)
+        sections = split_sections(data, markdown, item_spans)
+        return {
+            'url': data.get('url', ''),
+            'title': data.get('title', ''),
+            'file_path': file_path,
+            'data': data,
+            'markdown': markdown,
+            'sections': sections,
+            'section_starts': [section['start'] for section in sections], # チャンクの位置からセクションを引くため
+        }
+
+    def _load(self, previous):
+        entries_by_path = {}
+        if previous is not None:
+            entries_by_path = {doc['file_path']: doc for doc in previous.documents.values()}
+        documents = {}
+        for file_path, file_stat in sorted(self._file_stats.items()):
+            doc = entries_by_path.get(file_path)
+            if doc is None or previous._file_stats.get(file_path) != file_stat:
+                try:
+                    doc = self._load_file(file_path)
+                except Exception as e:
+                    logger.warning("Failed to load document %s: %s. Skipping this file.", file_path, e)
+                    continue
+            documents[doc['url']] = doc
+        return documents
+
+    def refreshed(self):
+        """
+        ディレクトリを走査し、追加・変更・削除されたファイルを反映した新しい DocumentStore を返す。
+        変更が無ければ自身を返す (このオブジェクトを使っている処理中のクエリには影響しない)。
+        """
+        file_stats = self._scan()
+        if file_stats == self._file_stats:
+            return self
+        return DocumentStore(self.directory, previous=self, file_stats=file_stats)
+
+    def get(self, source_url):
+        """情報源URLに対応するドキュメント情報を返す。見つからなければKeyError"""
+        doc = self.documents.get(source_url)
+        if doc is None:
+            raise KeyError(f"Document not found for source: {source_url}")
+        return doc
+
+    def get_markdown(self, source_url):
+        """情報源URLに対応するドキュメントのMarkdownを返す"""
+        return self.get(source_url)['markdown']
@@ -0,0 +1,108 @@
+import re
+import unicodedata
+from collections import deque
+
+# 見出しから辞書語を作るときに取り除く記号
+HEADING_STRIP_PATTERN = re.compile(r'[【】「」『』（）()［］\[\]〈〉《》・:：\s]+')
+# 辞書に入れる見出しの長さの範囲 (短すぎる語は誤検出、長すぎる語は質問に現れないため除く)
+MIN_TERM_LENGTH = 2
+MAX_HEADING_TERM_LENGTH = 16
+
+
+def normalize_text(text):
+    """全角英数字・記号の揺れと大文字小文字を吸収する"""
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+class AhoCorasickAutomaton:
+    """複数の文字列パターンを1回の走査で検出するAho-Corasickオートマトン"""
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build_failure_links()
+
+    def _add(self, pattern):
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        if pattern not in self.output[state]:
+            self.output[state].append(pattern)
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """(開始位置, 終了位置, パターン) を出現順に返す"""
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for pattern in self.output[state]:
+                yield i - len(pattern) + 1, i + 1, pattern
+
+
+def heading_terms(documents):
+    """DocumentStoreのドキュメントから、辞書語として使う見出しを集める"""
+    terms = set()
+    for doc in documents:
+        for item in doc['data'].get('content', []):
+            if item.get('type') != 'heading':
+                continue
+            term = HEADING_STRIP_PATTERN.sub('', item.get('text', ''))
+            if MIN_TERM_LENGTH <= len(term) <= MAX_HEADING_TERM_LENGTH:
+                terms.add(term)
+    return terms
+
+
+class LocalKeywordExtractor:
+    """
+    辞書 (各ページの見出し) に載っている語を質問文から検出する。
+    分かち書きの無い日本語でも使え、LLMを呼ばずにマイクロ秒単位で終わる。
+    """
+
+    def __init__(self, terms):
+        # 正規化した語 -> 元の表記 (抽出結果はトレースなどに元の表記で残すため)
+        self.terms = {}
+        for term in terms:
+            normalized = normalize_text(term)
+            if len(normalized) >= MIN_TERM_LENGTH and normalized not in self.terms:
+                self.terms[normalized] = term
+        self.automaton = AhoCorasickAutomaton(self.terms.keys())
+
+    def extract(self, query):
+        """
+        質問文に含まれる辞書語を出現順に返す。
+        「受講料」に含まれる「受講」のように、より長い一致の内側にある語は除く。
+        """
+        matches = sorted(self.automaton.iter_matches(normalize_text(query)), key=lambda m: (m[0], -(m[1] - m[0])))
+        keywords = []
+        covered_until = -1
+        for start, end, pattern in matches:
+            if end <= covered_until:
+                continue
+            covered_until = max(covered_until, end)
+            keyword = self.terms[pattern]
+            if keyword not in keywords:
+                keywords.append(keyword)
+        return keywords
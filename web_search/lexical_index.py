@@ -0,0 +1,129 @@
+import re
+import json
+import math
+from collections import Counter
+import numpy as np
+
+# pagesからパッケージとして読み込まれる場合と、web_search内で直接実行される場合の両方に対応
+try:
+    from web_search.keyword_extractor import normalize_text
+except ImportError:
+    from keyword_extractor import normalize_text
+
+# --- 定数 ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+# RRFの定数 (大きいほど下位の順位も効く。原論文の既定値は60)
+RRF_K = 60
+# 英数字の連続は単語として、それ以外の文字 (日本語など) の連続はbi-gramに分割する
+TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[^\W0-9a-z_]+')
+LEXICAL_INDEX_FORMAT = 'bm25-bigram-v1'
+
+
+def tokenize(text):
+    """NFKC正規化した上で、英数字は単語単位、日本語は文字bi-gramのトークン列にする"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(normalize_text(text)):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    チャンクのテキストに対するBM25の転置インデックス。
+    各ポスティングにはBM25の重み (idf × 文書長で正規化したtf) を構築時に計算して持たせるため、
+    検索はクエリのトークンごとに重みを足し合わせるだけで済む。
+    """
+
+    def __init__(self, postings, num_docs, k1=BM25_K1, b=BM25_B):
+        self.postings = postings # {token: (チャンクIDの配列, 重みの配列)}
+        self.num_docs = num_docs
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        """チャンクのテキストのリスト (添字がチャンクID) からインデックスを作る"""
+        term_freqs = [Counter(tokenize(text)) for text in texts]
+        doc_lengths = np.array([sum(tf.values()) for tf in term_freqs], dtype='float32')
+        avg_length = float(doc_lengths.mean()) if len(doc_lengths) and doc_lengths.mean() > 0 else 1.0
+
+        inverted = {}
+        for doc_id, tf in enumerate(term_freqs):
+            for token, count in tf.items():
+                inverted.setdefault(token, []).append((doc_id, count))
+
+        num_docs = len(texts)
+        postings = {}
+        for token, entries in inverted.items():
+            doc_ids = np.array([doc_id for doc_id, _ in entries], dtype='int32')
+            counts = np.array([count for _, count in entries], dtype='float32')
+            idf = math.log(1 + (num_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            length_norm = k1 * (1 - b + b * doc_lengths[doc_ids] / avg_length)
+            weights = idf * counts * (k1 + 1) / (counts + length_norm)
+            postings[token] = (doc_ids, weights.astype('float32'))
+        return cls(postings, num_docs, k1, b)
+
+    def search(self, query, k, allowed_ids=None):
+        """
+        クエリに対するBM25スコアの上位k件を返す。戻り値は (チャンクIDのリスト, スコアのリスト)。
+        クエリ内で繰り返されるトークンは重みが加算される (抽出したキーワードを足して強調するため)。
+        allowed_ids を指定した場合はそのIDの中だけから選ぶ。
+        """
+        scores = np.zeros(self.num_docs, dtype='float32')
+        for token in tokenize(query):
+            posting = self.postings.get(token)
+            if posting is not None:
+                doc_ids, weights = posting
+                scores[doc_ids] += weights
+        if allowed_ids is not None:
+            mask = np.zeros(self.num_docs, dtype=bool)
+            mask[np.asarray(allowed_ids, dtype='int64')] = True
+            scores[~mask] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) == 0:
+            return [], []
+        top = candidates[np.argsort(-scores[candidates], kind='stable')[:k]]
+        return top.tolist(), scores[top].tolist()
+
+    def save(self, path):
+        data = {
+            'format': LEXICAL_INDEX_FORMAT,
+            'k1': self.k1,
+            'b': self.b,
+            'num_docs': self.num_docs,
+            'postings': {
+                token: [doc_ids.tolist(), [round(float(w), 4) for w in weights]]
+                for token, (doc_ids, weights) in self.postings.items()
+            },
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != LEXICAL_INDEX_FORMAT:
+            raise ValueError(f"Unsupported lexical index format: {data.get('format')}")
+        postings = {
+            token: (np.array(doc_ids, dtype='int32'), np.array(weights, dtype='float32'))
+            for token, (doc_ids, weights) in data['postings'].items()
+        }
+        return cls(postings, data['num_docs'], data['k1'], data['b'])
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    複数の検索結果の順位 (チャンクIDのリスト) をRRFで統合する。
+    スコアの尺度が違う検索 (BM25とベクトル距離) でも順位だけで公平に混ぜられる。
+    戻り値は (チャンクID, RRFスコア) のリスト (スコアの降順)。
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,134 @@
+import os
+import time
+import asyncio
+import hashlib
+import numpy as np
+
+# --- 定数 ---
+API_KEY = os.getenv('GEMINI_API_KEY')
+EMBEDDING_MODEL = 'models/text-embedding-004'
+GENERATION_MODEL = 'gemini-2.5-flash'
+EMBEDDING_DIMENSION = 768 # text-embedding-004 の次元数
+# 待って再試行すれば成功しうる (一時的な) APIエラーの型名 (google.api_core.exceptions のもの)
+TRANSIENT_ERROR_NAMES = frozenset({
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded',
+    'GatewayTimeout', 'Aborted',
+})
+
+
+def is_transient_error(error):
+    """再試行する価値のあるエラーか。認証エラー・不正な引数・イベントループの不整合などはすぐに諦める"""
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+class ModelProvider:
+    """RAGChatSystemが利用するEmbedding/文章生成のインターフェース"""
+
+    def embed(self, content, task_type="RETRIEVAL_QUERY"):
+        """テキストのEmbeddingベクトル (floatのリスト) を返す"""
+        raise NotImplementedError
+
+    def generate(self, prompt):
+        """プロンプトに対する生成テキストを返す"""
+        raise NotImplementedError
+
+    def generate_stream(self, prompt):
+        """生成テキストを生成された順に少しずつ返すイテレータ。既定では一度に全文を返す"""
+        yield self.generate(prompt)
+
+    # 非同期版。既定では同期版を別スレッドで実行する
+    async def aembed(self, content, task_type="RETRIEVAL_QUERY"):
+        return await asyncio.to_thread(self.embed, content, task_type)
+
+    async def agenerate(self, prompt):
+        return await asyncio.to_thread(self.generate, prompt)
+
+
+class GeminiProvider(ModelProvider):
+    """Gemini APIを利用するプロバイダー (本番用)"""
+
+    def __init__(self, api_key=None, embedding_model=EMBEDDING_MODEL, generation_model=GENERATION_MODEL):
+        api_key = api_key or API_KEY
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable not set.")
+        # google.generativeai は読み込みに1秒近くかかるため、モジュールの読み込み時ではなくここで読み込む
+        import google.generativeai as genai
+        self.genai = genai
+        genai.configure(api_key=api_key)
+        self.embedding_model = embedding_model
+        self.generation_model = generation_model
+
+    def embed(self, content, task_type="RETRIEVAL_QUERY"):
+        result = self.genai.embed_content(model=self.embedding_model, content=content, task_type=task_type)
+        return result['embedding']
+
+    def generate(self, prompt):
+        model = self.genai.GenerativeModel(self.generation_model)
+        response = model.generate_content(prompt)
+        return response.text
+
+    def generate_stream(self, prompt):
+        model = self.genai.GenerativeModel(self.generation_model)
+        for chunk in model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+    # google.generativeai の非同期クライアント (grpc_asyncio) はモジュール全体で共有され、最初に使ったイベントループに
+    # 結び付くため、リクエストごとに asyncio.run する呼び出し元では2回目から 'Event loop is closed' になる。
+    # 非同期版は ModelProvider の既定どおり、同期版を別スレッドで実行する
+
+class LocalStubProvider(ModelProvider):
+    """
+    APIキーなしで動作する決定的なローカル代替プロバイダー (ベンチマーク・テスト用)。
+    同じ入力には常に同じ出力を返し、各呼び出しのレイテンシを擬似的に設定できる。
+    """
+
+    def __init__(self, dimension=EMBEDDING_DIMENSION, embed_latency=0.0, generate_latency=0.0, responses=None,
+                 stream_chunks=8):
+        self.dimension = dimension
+        self.embed_latency = embed_latency
+        self.generate_latency = generate_latency
+        # ストリーミング時に応答を何分割して返すか (generate_latency を均等に割り振る)
+        self.stream_chunks = stream_chunks
+        # {プロンプトの末尾文字列: 返す応答} の辞書。最初に一致したものを返す
+        self.responses = responses or {}
+
+    def _seed(self, text):
+        return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+
+    def _vector(self, content, task_type):
+        rng = np.random.default_rng(self._seed(f"{task_type}:{content}"))
+        vector = rng.standard_normal(self.dimension).astype('float32')
+        vector /= np.linalg.norm(vector)
+        return vector.tolist()
+
+    def _answer(self, prompt):
+        for needle, response in self.responses.items():
+            if prompt.rstrip().endswith(needle):
+                return response
+        return f"[stub answer {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}]"
+
+    def embed(self, content, task_type="RETRIEVAL_QUERY"):
+        time.sleep(self.embed_latency)
+        return self._vector(content, task_type)
+
+    def generate(self, prompt):
+        time.sleep(self.generate_latency)
+        return self._answer(prompt)
+
+    def generate_stream(self, prompt):
+        answer = self._answer(prompt)
+        chunk_size = max(1, -(-len(answer) // self.stream_chunks))
+        chunks = [answer[i:i + chunk_size] for i in range(0, len(answer), chunk_size)] or [answer]
+        for chunk in chunks:
+            time.sleep(self.generate_latency / len(chunks))
+            yield chunk
+
+    # キャンセル可能なように、非同期版はasyncio.sleepで待つ
+    async def aembed(self, content, task_type="RETRIEVAL_QUERY"):
+        await asyncio.sleep(self.embed_latency)
+        return self._vector(content, task_type)
+
+    async def agenerate(self, prompt):
+        await asyncio.sleep(self.generate_latency)
+        return self._answer(prompt)
@@ -1,335 +1,867 @@
 import os
-import json
+import bisect
+import asyncio
 import numpy as np
-import faiss
-import google.generativeai as genai
 import time
+import logging
 import threading
-import traceback
-
-# --- 定数 ---
-API_KEY = os.getenv('GEMINI_API_KEY')
-EMBEDDING_MODEL = 'models/text-embedding-004'
-GENERATION_MODEL = 'gemini-2.5-flash'
+from concurrent.futures import ThreadPoolExecutor
+
+# pagesからパッケージとして読み込まれる場合と、web_search内で直接実行される場合の両方に対応
+try:
+    from web_search.model_providers import GeminiProvider, is_transient_error
+    from web_search.document_store import DocumentStore
+    from web_search.tracing import Tracer, env_flag
+    from web_search.answer_cache import SemanticAnswerCache
+    from web_search.keyword_extractor import LocalKeywordExtractor, heading_terms
+    from web_search.lexical_index import reciprocal_rank_fusion
+    from web_search.context_assembler import ContextAssembler
+    from web_search.vector_store import load_vector_store, current_version, bundle_dir, verify_bundle, VectorStore
+except ImportError:
+    from model_providers import GeminiProvider, is_transient_error
+    from document_store import DocumentStore
+    from tracing import Tracer, env_flag
+    from answer_cache import SemanticAnswerCache
+    from keyword_extractor import LocalKeywordExtractor, heading_terms
+    from lexical_index import reciprocal_rank_fusion
+    from context_assembler import ContextAssembler
+    from vector_store import load_vector_store, current_version, bundle_dir, verify_bundle, VectorStore
+
+logger = logging.getLogger(__name__)
 
 # パス設定
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# ベクトルストアのルート。create_vector_db.py が versions/<版>/ に作り、CURRENT で今の版を指す
+# (ファイルの配置は web_search/vector_store.py を参照)
 VECTOR_STORE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),'..','data', 'vector_store'))
-FAISS_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, 'faiss_index.bin')
-METADATA_PATH = os.path.join(VECTOR_STORE_DIR, 'metadata.json')
+DOCUMENTS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'scraped_data_student_menu'))
 
-# FAISS検索のタイムアウト (秒)
-FAISS_SEARCH_TIMEOUT = 30
+# ハイブリッド検索で、BM25とFAISSのそれぞれから取り出してRRFで統合する候補数
+HYBRID_CANDIDATES = 20
+# コンテキストのセクションを選ぶときに使う、統合した順位の上位チャンク数
+CONTEXT_HIT_CHUNKS = 10
+
+# stream_chat_query のファイル選定で、API呼び出しを並行して行うスレッド数
+PLAN_WORKERS = 4
+
+NO_RESULT_MESSAGE = "関連する情報を見つけることができませんでした。"
+
+# 回答キャッシュを使うか (RAG_ANSWER_CACHE=0 で無効)
+ANSWER_CACHE_ENABLED = env_flag('RAG_ANSWER_CACHE', True)
+# ローカルの辞書で何も見つからなかったときに、LLMで抽出したキーワードをBM25のクエリに足すか (既定は無効)
+KEYWORD_LLM_FALLBACK = env_flag('RAG_KEYWORD_LLM_FALLBACK', False)
+# 高速起動モード (RAG_FAST_START=1): インスタンスの作成時には何もロードせず、最初のクエリ (または warm_up) で
+# プロバイダー・インデックス・メタデータ・ドキュメントをロードする。FAISSのインデックスはメモリマップで開く
+FAST_START = env_flag('RAG_FAST_START', False)
+
+# 新しい版のベクトルストアが公開されていないかを確かめる間隔 (秒)。0以下なら確かめない
+VECTOR_STORE_RELOAD_INTERVAL = float(os.getenv('RAG_VECTOR_STORE_RELOAD_INTERVAL', '10'))
+
+class ChatSession:
+    """
+    1ユーザー (Streamlitのセッション) ごとの会話状態。
+    RAGChatSystem本体はインデックスとコーパスだけを持つ読み取り専用のエンジンとして全セッションで共有し、
+    セッション固有の状態はこのオブジェクトに持たせてクエリごとに渡す。
+    """
 
-class RAGChatSystem:
     def __init__(self):
-        print("[DEBUG] RAGChatSystem initializing...")
-        if not API_KEY:
-            raise ValueError("GEMINI_API_KEY environment variable not set.")
-        genai.configure(api_key=API_KEY)
-        print("[DEBUG] GEMINI_API_KEY is set and configured.")
-        self.index = None
-        self.metadata = None
-        self._load_vector_store()
         self.previous_source_documents = [] # 過去の参照ドキュメントを記憶するためのリスト
-        print("[DEBUG] RAGChatSystem initialized successfully.")
-
-    def _load_vector_store(self):
-        """FAISSインデックスとメタデータをロードする"""
-        print("[DEBUG] Loading vector store...")
-        if not os.path.exists(FAISS_INDEX_PATH) or not os.path.exists(METADATA_PATH):
-            raise FileNotFoundError(
-                f"Vector store files not found. Please run create_vector_db.py first.\n"
-                f"Expected: {FAISS_INDEX_PATH} and {METADATA_PATH}"
-            )
-        self.index = faiss.read_index(FAISS_INDEX_PATH)
-        with open(METADATA_PATH, 'r', encoding='utf-8') as f:
-            self.metadata = json.load(f)
-        print(f"Loaded FAISS index with {self.index.ntotal} vectors.")
-        print(f"Loaded metadata for {len(self.metadata)} chunks.")
-        print(f"[DEBUG] Loaded FAISS index dimension: {self.index.d}")
-
-        # --- FAISS機能テスト ---
+
+    def remember_sources(self, source_documents):
+        """今回の回答で使用した情報源を次の質問のために記憶する"""
+        self.previous_source_documents = list(source_documents)
+
+class LoadedBundle:
+    """
+    1つの版のベクトルストア (FAISSインデックス・チャンクストア・BM25) と、それと一緒に読み込んだ
+    ドキュメントストア・キーワード抽出器。作った後は書き換えない。
+    版の差し替えはこのオブジェクトへの参照を置き換えるだけで行うため、クエリは開始時に取り出した
+    1つのオブジェクトから、すべて同じ版の部品を使う。
+    """
+
+    def __init__(self, vector_store, document_store):
+        self.vector_store = vector_store
+        self.document_store = document_store
+        # 各ページの見出しを辞書にした抽出器
+        self.keyword_extractor = LocalKeywordExtractor(heading_terms(document_store.documents.values()))
+
+    @property
+    def version(self):
+        return self.vector_store.version
+
+    @property
+    def cache_version(self):
+        """回答キャッシュの有効性を判定するための、ベクトルストアとドキュメントの版"""
+        return (self.vector_store.version, self.document_store.version)
+
+class RAGChatSystem:
+    """
+    ベクトルストア (FAISSインデックス・メタデータ・BM25) とドキュメントストアを保持するRAGエンジン。
+    クエリ処理中にインスタンスの状態を書き換えないため、@st.cache_resource で
+    1つのインスタンスを複数セッションから同時に使ってもよい (会話状態は ChatSession で渡す)。
+    新しい版のベクトルストアが公開されると、ドキュメントストアと合わせて裏でロードし (LoadedBundle)、
+    まとめて差し替える。各クエリは開始時の LoadedBundle を最後まで使う。
+    """
+
+    def __init__(self, provider=None, tracer=None, answer_cache=None, keyword_llm_fallback=None, context_assembler=None,
+                 fast_start=None):
+        """
+        provider: Embeddingと文章生成を行うModelProvider。
+                  省略時はGemini APIを利用する (GEMINI_API_KEYが必要)。
+        tracer: 処理ステージの計測に使うTracer。省略時は環境変数の設定に従う。
+        answer_cache: 類似質問の回答を再利用するSemanticAnswerCache。
+                      省略時は環境変数 RAG_ANSWER_CACHE が無効でなければ既定の設定で作る。Falseで無効。
+        keyword_llm_fallback: ローカル辞書でキーワードが見つからなかった場合にLLMで抽出し直すか。
+                              省略時は環境変数 RAG_KEYWORD_LLM_FALLBACK に従う (既定は無効)。
+        context_assembler: 回答生成のコンテキストをトークン数の上限まで詰めるContextAssembler。
+                           省略時は環境変数 RAG_CONTEXT_TOKEN_BUDGET の上限で作る。
+        fast_start: Trueならロードを最初のクエリまで遅らせ、インデックスをメモリマップで開く。
+                    省略時は環境変数 RAG_FAST_START に従う (既定は無効)。
+        """
+        self.fast_start = FAST_START if fast_start is None else fast_start
+        self._provider = provider
+        self._bundle = None # LoadedBundle
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._reload_lock = threading.Lock()
+        self._last_reload_check = time.monotonic()
+        self._failed_version = None # ロードに失敗した版 (同じ版を何度も読み直さないため)
+        # stream_chat_query で、Embedding+FAISS検索や回答キャッシュ用のEmbeddingを並行して行うスレッド
+        self._plan_executor = ThreadPoolExecutor(max_workers=PLAN_WORKERS, thread_name_prefix='rag-plan')
+        self.tracer = tracer if tracer is not None else Tracer()
+        if answer_cache is None and ANSWER_CACHE_ENABLED:
+            answer_cache = SemanticAnswerCache()
+        self.answer_cache = answer_cache or None
+        self.keyword_llm_fallback = KEYWORD_LLM_FALLBACK if keyword_llm_fallback is None else keyword_llm_fallback
+        self.context_assembler = context_assembler if context_assembler is not None else ContextAssembler()
+        # プロンプトのテンプレートは起動時に一度だけ読み込む
+        self.keyword_extraction_prompt_template = self._load_prompt('keyword_extraction_prompt.txt')
+        self.rag_chat_prompt_template = self._load_prompt('rag_chat_prompt.txt')
+        if not self.fast_start:
+            self._ensure_loaded()
+        logger.debug("RAGChatSystem initialized (fast_start=%s).", self.fast_start)
+
+    @property
+    def provider(self):
+        """Embeddingと文章生成を行うModelProvider (高速起動モードでは最初に使うときに作る)"""
+        self._ensure_loaded()
+        return self._provider
+
+    def _ensure_loaded(self):
+        """プロバイダー・ベクトルストア・ドキュメントストアをまだロードしていなければロードする"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            start_time = time.perf_counter()
+            if self._provider is None:
+                self._provider = GeminiProvider()
+            logger.debug("Model provider: %s", type(self._provider).__name__)
+            self._bundle = LoadedBundle(load_vector_store(VECTOR_STORE_DIR, mmap=self.fast_start), DocumentStore(DOCUMENTS_DIR))
+            self._loaded = True
+            logger.info("RAGChatSystem loaded in %.3fs (fast_start=%s).", time.perf_counter() - start_time, self.fast_start)
+
+    def warm_up(self, background=False):
+        """
+        最初のクエリを待たずにロードする。background=Trueなら別スレッドでロードし、すぐに戻る
+        (ロード中に届いたクエリはロードの完了を待つ)。
+        """
+        if background:
+            threading.Thread(target=self._ensure_loaded, name='rag-warm-up', daemon=True).start()
+        else:
+            self._ensure_loaded()
+
+    def new_session(self):
+        """このエンジンで使う新しい会話状態を作る"""
+        return ChatSession()
+
+    def _load_prompt(self, file_name):
+        """prompts/ 以下のプロンプトテンプレートを読み込む"""
+        with open(os.path.join(BASE_DIR, 'prompts', file_name), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    # 以下は現在の版の内容 (デバッグやベンチマーク用)。クエリの処理では開始時の LoadedBundle を使う
+    @property
+    def vector_store(self):
+        return self._bundle.vector_store if self._bundle is not None else None
+
+    @property
+    def document_store(self):
+        return self._bundle.document_store if self._bundle is not None else None
+
+    @property
+    def index(self):
+        return self.vector_store.index if self.vector_store is not None else None
+
+    @property
+    def index_config(self):
+        return self.vector_store.index_config if self.vector_store is not None else None
+
+    @property
+    def metadata(self):
+        return self.vector_store.metadata if self.vector_store is not None else None
+
+    @property
+    def lexical_index(self):
+        return self.vector_store.lexical_index if self.vector_store is not None else None
+
+    @property
+    def vector_store_version(self):
+        return self.vector_store.version if self.vector_store is not None else None
+
+    def _current_bundle(self):
+        """クエリの開始時に呼び、そのクエリで使う LoadedBundle を返す。新しい版があれば裏でのロードを始める"""
+        self._ensure_loaded()
+        self._check_for_new_version()
+        return self._bundle
+
+    def _check_for_new_version(self):
+        """一定間隔で CURRENT を確かめ、今と違う版が公開されていれば別スレッドでロードを始める"""
+        if VECTOR_STORE_RELOAD_INTERVAL <= 0:
+            return
+        now = time.monotonic()
+        if now - self._last_reload_check < VECTOR_STORE_RELOAD_INTERVAL:
+            return
+        self._last_reload_check = now
+        version = current_version(VECTOR_STORE_DIR)
+        if version is None or version in (self._bundle.version, self._failed_version):
+            return
+        # 既に別のスレッドがロード中なら何もしない
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        threading.Thread(target=self._reload_vector_store, args=(version,), name='rag-vector-store-reload', daemon=True).start()
+
+    def _reload_vector_store(self, version):
+        """
+        _reload_lock を取った状態で呼ぶ。指定した版を検証してロードし、その版に合わせてドキュメントストアと
+        キーワード抽出器も作り直して、すべて揃ってから差し替える
+        """
         try:
-            test_query_vec = np.random.rand(1, self.index.d).astype('float32')
-            test_distances, test_indices = self.index.search(test_query_vec, 1)
-            print(f"[DEBUG] FAISS self-test successful. Test distance: {test_distances[0][0]:.4f}, Test index: {test_indices[0][0]}")
+            start_time = time.perf_counter()
+            directory = bundle_dir(VECTOR_STORE_DIR, version)
+            verify_bundle(directory)
+            vector_store = VectorStore.load(directory, version=version, mmap=self.fast_start)
+            # ドキュメントの更新は版の公開に合わせてここで読み直す (クエリのたびにはディレクトリを確かめない)
+            bundle = LoadedBundle(vector_store, self._bundle.document_store.refreshed())
+            # 参照の置き換え1回で差し替える。処理中のクエリは古い LoadedBundle を参照したまま終わる
+            self._bundle = bundle
+            logger.info("Swapped in vector store version %s (%.3fs).", version, time.perf_counter() - start_time)
         except Exception as e:
-            print(f"[DEBUG] ERROR: FAISS self-test failed during load: {e}")
-            raise
-        # --- FAISS機能テスト終わり ---
+            self._failed_version = version
+            logger.warning("Failed to load vector store version %s: %s. Keeping %s.", version, e, self._bundle.version)
+        finally:
+            self._reload_lock.release()
+
+    def reload_vector_store(self):
+        """
+        新しい版のベクトルストアが公開されていれば、今のスレッドでロードして差し替える。
+        差し替えた場合はTrueを返す (間隔を待たずに反映したいとき用)。
+        """
+        self._ensure_loaded()
+        version = current_version(VECTOR_STORE_DIR)
+        if version is None or version == self._bundle.version:
+            return False
+        self._reload_lock.acquire()
+        self._reload_vector_store(version)
+        return self._bundle.version == version
+
+    def _build_embedding_content(self, text, chat_history=None):
+        """チャット履歴がある場合は履歴と質問を結合したEmbedding対象のテキストを作る"""
+        if not chat_history:
+            return text
+        # Streamlitのst.session_state.messagesの形式を想定
+        history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
+        return f"{history_str}\nユーザーの質問: {text}"
 
     def _get_embedding(self, text, task_type="RETRIEVAL_QUERY", chat_history=None, max_retries=5):
-        """Gemini APIでEmbeddingを取得する (リトライ機能付き、チャット履歴を考慮)"""
-        content_to_embed = text
-        if chat_history:
-            # Streamlitのst.session_state.messagesの形式を想定
-            history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history])
-            content_to_embed = f"{history_str}\nユーザーの質問: {text}"
-
-        print(f"[DEBUG] Getting embedding for content (first 50 chars): {content_to_embed[:50]}...")
+        """
+        Gemini APIでEmbeddingを取得する (リトライ機能付き、チャット履歴を考慮)。
+        一時的でないエラー (認証エラーなど) は再試行せずにすぐ送出する。
+        """
+        content_to_embed = self._build_embedding_content(text, chat_history)
         try:
-            time.sleep(0.1)
-            result = genai.embed_content(model=EMBEDDING_MODEL, content=content_to_embed, task_type=task_type)
-            print("[DEBUG] Embedding obtained successfully.")
-            return result['embedding']
+            return self.provider.embed(content_to_embed, task_type=task_type)
         except Exception as e:
-            print(f"[DEBUG] Embedding API Error: {e}. Retrying...")
+            if not is_transient_error(e):
+                logger.error("Embedding API Error (not retrying): %r", e)
+                raise
+            logger.warning("Embedding API Error: %s. Retrying...", e)
             if max_retries > 0:
                 time.sleep(5)
                 return self._get_embedding(text, task_type, chat_history, max_retries - 1)
             else:
-                print("[DEBUG] Failed to get embedding after multiple retries.")
+                logger.error("Failed to get embedding after multiple retries.")
                 raise
 
-    def _faiss_search_thread(self, query_embedding_np, k, result_container):
-        """FAISS検索を別スレッドで実行する"""
-        try:
-            distances, indices = self.index.search(query_embedding_np, k)
-            result_container['result'] = (distances, indices)
-        except Exception as e:
-            error_message = f"FAISS search thread exception: {e}\n{traceback.format_exc()}"
-            print(f"[DEBUG] {error_message}")
-            result_container['error'] = error_message
-
-    def _convert_json_to_markdown(self, json_data):
-        """構造化JSONデータをMarkdown形式に変換する"""
-        markdown_parts = []
-        
-        if 'title' in json_data and json_data['title']:
-            markdown_parts.append(f"# {json_data['title']}")
-        if 'url' in json_data and json_data['url']:
-            markdown_parts.append(f"URL: {json_data['url']}\n")
-
-        for item in json_data['content']:
-            if item['type'] == 'heading':
-                level = min(item['level'], 6)
-                markdown_parts.append(f"{'#' * level} {item['text']}")
-            elif item['type'] == 'paragraph':
-                markdown_parts.append(item['text'])
-            elif item['type'] == 'list':
-                for li_item in item['items']:
-                    markdown_parts.append(f"- {li_item}")
-            elif item['type'] == 'table':
-                headers = item.get('headers', [])
-                rows = item.get('rows', [])
-
-                if headers:
-                    markdown_parts.append("| " + " | ".join(headers) + " |")
-                    markdown_parts.append("|" + "---"*len(headers) + "|")
-                
-                for row in rows:
-                    markdown_parts.append("| " + " | ".join(row) + " |")
-            
-            markdown_parts.append("")
-            
-        return "\n".join(markdown_parts).strip()
-
-    # --- NEW: キーワードマップとキーワードマッチング関数 ---
-    KEYWORD_MAP = {
-        "https://cc.musabi.ac.jp/campus-2nd/faq": ["よくある質問", "質問", "疑問"],
-        "https://cc.musabi.ac.jp/campus-2nd/qualification-course": ["教職課程", "学芸員課程", "教員免許", "学芸員資格", "資格取得", "課程", "履修費", "費用"],
-        "https://cc.musabi.ac.jp/campus-2nd/schooling": ["スクーリング", "面接授業", "受講", "授業", "費用", "受講料"],
-        "https://cc.musabi.ac.jp/campus-2nd/registration": ["履修登録", "登録", "履修", "費用", "履修費"],
-        "https://cc.musabi.ac.jp/campus-2nd/school": ["学費", "授業料", "入学金", "年間費用", "学校費用", "納入", "支払い"],
-        "https://cc.musabi.ac.jp/campus-2nd/gpa": ["成績", "GPA", "評価", "単位"],
-    }
-
-    def _get_keyword_matched_files(self, query_tokens):
-        """
-        ユーザーのクエリキーワードに基づいて、関連性の高いJSONファイルを特定する。
-        戻り値は {source_url: match_count} の辞書。
-        """
-        print(f"[debug]:tokens --- {query_tokens}")
-        matched_files_scores = {}
-        for source_url, keywords in self.KEYWORD_MAP.items():
-            count = 0
-            for q_token in query_tokens:
-                for file_kw in keywords:
-                    if q_token in file_kw or file_kw in q_token:
-                        count += 1
-            if count > 0:
-                matched_files_scores[source_url] = count
-        return matched_files_scores
-    # --- END NEW ---
+    async def _get_embedding_async(self, text, task_type="RETRIEVAL_QUERY", chat_history=None, max_retries=5):
+        """_get_embedding の非同期版"""
+        content_to_embed = self._build_embedding_content(text, chat_history)
+        for attempt in range(max_retries + 1):
+            try:
+                return await self.provider.aembed(content_to_embed, task_type=task_type)
+            except Exception as e:
+                if not is_transient_error(e):
+                    logger.error("Embedding API Error (not retrying): %r", e)
+                    raise
+                if attempt == max_retries:
+                    logger.error("Failed to get embedding after multiple retries.")
+                    raise
+                logger.warning("Embedding API Error: %s. Retrying...", e)
+                await asyncio.sleep(5)
+
+    def _search_index(self, bundle, query_embedding_np, k):
+        """FAISSインデックスからクエリベクトルに近いチャンクをk件検索する"""
+        return bundle.vector_store.index.search(query_embedding_np, k)
+
+    def _generate_answer(self, prompt):
+        """結合したコンテキストを含むプロンプトから最終回答を生成する"""
+        return self.provider.generate(prompt)
+
+    async def _generate_answer_async(self, prompt):
+        """_generate_answer の非同期版"""
+        return await self.provider.agenerate(prompt)
+
+    def _generate_answer_stream(self, prompt):
+        """_generate_answer のストリーミング版 (生成されたテキストの断片を順に返す)"""
+        return self.provider.generate_stream(prompt)
+
+    def _extract_keywords_locally(self, bundle, query):
+        """辞書に載っている語を質問文から検出する (LLMを呼ばない)"""
+        return bundle.keyword_extractor.extract(query)
+
+    def _parse_keywords(self, keywords_str):
+        """LLMの出力をカンマで分割し、各キーワードの空白を削除する"""
+        return [kw.strip() for kw in keywords_str.strip().split(',') if kw.strip()]
 
     def _extract_keywords_with_llm(self, query):
         """LLMを使ってユーザーの質問からキーワードを抽出する"""
-        keyword_extraction_prompt_path = os.path.join(BASE_DIR, 'prompts', 'keyword_extraction_prompt.txt')
-        with open(keyword_extraction_prompt_path, 'r', encoding='utf-8') as f:
-            keyword_extraction_prompt_template = f.read()
-        keyword_extraction_prompt = keyword_extraction_prompt_template.format(query=query)
+        keyword_extraction_prompt = self.keyword_extraction_prompt_template.format(query=query)
         try:
-            model = genai.GenerativeModel(GENERATION_MODEL)
-            response = model.generate_content(keyword_extraction_prompt)
-            keywords_str = response.text.strip()
-            # カンマで分割し、各キーワードの空白を削除
-            keywords = [kw.strip() for kw in keywords_str.split(',') if kw.strip()]
-            print(f"[DEBUG] Extracted keywords: {keywords}")
-            return keywords
+            return self._parse_keywords(self.provider.generate(keyword_extraction_prompt))
         except Exception as e:
-            print(f"[DEBUG] Error extracting keywords with LLM: {e}. Falling back to simple split.")
+            logger.warning("Error extracting keywords with LLM: %s. Falling back to simple split.", e)
             return query.lower().split() # エラー時はフォールバック
 
-    def process_chat_query(self, query, chat_history=None, k=5):
-        """チャットクエリを処理し、回答と情報源を返す"""
-        print(f"--- Starting new chat flow for query: {query} ---")
-
-        # 1. クエリ拡張を削除し、元のクエリを直接使用
-        processed_query = query
-
-        # 2. ユーザーのプロンプトをキーワードに分解 (LLMを使用)
-        query_tokens = self._extract_keywords_with_llm(processed_query)
-        print(f"[DEBUG]:query tokens ------- {query_tokens}")
-
-        # 3. キーワードが含まれるJSONの一致度でファイルを選定
-        keyword_matched_scores = self._get_keyword_matched_files(query_tokens)
-        print(f"[VOTING] Keyword matched scores: {keyword_matched_scores}")
-
-        files_to_process = []
-
-        # 優先順位1: キーワードマッチしたファイルが存在する場合
-        if keyword_matched_scores:
-            sorted_keyword_files = sorted(keyword_matched_scores.items(), key=lambda item: item[1], reverse=True)
-            files_to_process.append(sorted_keyword_files[0][0]) # 最もスコアの高いファイルは必ず含める
-
-            if len(sorted_keyword_files) >= 2:
-                top_score = sorted_keyword_files[0][1]
-                second_file_url, second_file_score = sorted_keyword_files[1]
-                if second_file_score >= (top_score * 0.65): # 閾値は0.65
-                    files_to_process.append(second_file_url)
-                else:
-                    print(f"[VOTING] Second keyword-matched file ({second_file_url}) score ({second_file_score}) is too low compared to top ({top_score}). Only returning top keyword-matched file.")
-            print(f"[VOTING] Files selected via keyword match: {files_to_process}")
-
-        else: # キーワードマッチしたファイルがない場合、FAISS検索にフォールバック
-            # 4. FAISS検索 (当たりをつける)
-            print(f"[VOTING] Step 1: Searching for top {k} chunks with query: {processed_query}...")
-            faiss_voted_scores = {}
-            try:
-                # chat_historyを_get_embeddingに渡す
-                query_embedding = self._get_embedding(processed_query, task_type="RETRIEVAL_QUERY", chat_history=chat_history)
-                query_embedding_np = np.array([query_embedding]).astype('float32')
-                
-                distances, indices = self.index.search(query_embedding_np, k)
-                
-                if indices.size > 0:
-                    initial_retrieved_chunks = []
-                    for i, idx in enumerate(indices[0]):
-                        if idx < len(self.metadata):
-                            chunk = self.metadata[idx]
-                            chunk['distance'] = distances[0][i]
-                            initial_retrieved_chunks.append(chunk)
-
-                    filtered_chunks_for_voting = initial_retrieved_chunks
-                    print(f"[VOTING] {len(filtered_chunks_for_voting)} chunks will be used for voting.")
-
-                    print("[VOTING] Step 2: Voting for files based on FAISS chunks...")
-                    for chunk in filtered_chunks_for_voting:
-                        source_file = chunk['source']
-                        faiss_voted_scores[source_file] = faiss_voted_scores.get(source_file, 0) + 1
-                    
-                    print(f"[VOTING] FAISS voted scores: {faiss_voted_scores}")
-                else:
-                    print("[VOTING] No chunks found via FAISS.")
+    async def _extract_keywords_with_llm_async(self, query):
+        """_extract_keywords_with_llm の非同期版"""
+        keyword_extraction_prompt = self.keyword_extraction_prompt_template.format(query=query)
+        try:
+            return self._parse_keywords(await self.provider.agenerate(keyword_extraction_prompt))
+        except Exception as e:
+            logger.warning("Error extracting keywords with LLM: %s. Falling back to simple split.", e)
+            return query.lower().split() # エラー時はフォールバック
 
-            except Exception as e:
-                print(f"[VOTING] Error during FAISS chunk search: {e}")
-
-            # FAISS検索結果からファイルを選定
-            if faiss_voted_scores:
-                sorted_faiss_files = sorted(faiss_voted_scores.items(), key=lambda item: item[1], reverse=True)
-                files_to_process.append(sorted_faiss_files[0][0]) # 最もスコアの高いファイルは必ず含める
-
-                if len(sorted_faiss_files) >= 2:
-                    top_score = sorted_faiss_files[0][1]
-                    second_file_url, second_file_score = sorted_faiss_files[1]
-                    if second_file_score >= (top_score * 0.65): # 閾値は0.65
-                        files_to_process.append(second_file_url)
-                    else:
-                        print(f"[VOTING] Second FAISS-retrieved file ({second_file_url}) score ({second_file_score}) is too low compared to top ({top_score}). Only returning top FAISS-retrieved file.")
-            print(f"[VOTING] Files selected via FAISS fallback: {files_to_process}")
-
-        # 最終的に処理するファイルリスト
-        # 過去の参照ドキュメントと現在の検索結果を結合
-        all_candidate_files = files_to_process + self.previous_source_documents
-        # 重複を排除し、順序を保持
-        files_to_process = list(dict.fromkeys(all_candidate_files))
-        files_to_process = files_to_process[:3] # 最大3つに制限 (過去のコンテキストも考慮するため少し増やす)
-        print(f"[VOTING] Final files to process (after heuristic): {files_to_process}")
-
-        if not files_to_process:
-            print("[VOTING] No relevant files found after all search attempts.")
-            return "関連する情報を見つけることができませんでした。", []
-
-        combined_context_parts = []
-        source_documents_used = []
-
-        # 6. 選択されたファイルのコンテンツを読み込み、結合する
-        for i, file_source in enumerate(files_to_process):
-            print(f"[VOTING] Step 3: Reading content of file: {file_source}...")
-            try:
-                file_name = file_source.split('/')[-1] + ".json"
-                file_path = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'scraped_data_student_menu', file_name))
-                
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    document_data = json.load(f)
-                
-                markdown_content = self._convert_json_to_markdown(document_data)
-                combined_context_parts.append(f"--- Document {i+1} (Source: {file_source})\n{markdown_content}\n")
-                source_documents_used.append(file_source)
-                print(f"[VOTING] Successfully loaded and converted {file_name} to Markdown.")
+    def _select_top_files(self, voted_scores, label):
+        """
+        得票数の最も多いファイルを必ず選び、2番目のファイルは得票数が1位の65%以上なら追加する。
+        label はログ出力用の選定方法の名前。
+        """
+        selected_files = []
+        if not voted_scores:
+            return selected_files
+        sorted_files = sorted(voted_scores.items(), key=lambda item: item[1], reverse=True)
+        selected_files.append(sorted_files[0][0]) # 最もスコアの高いファイルは必ず含める
+
+        if len(sorted_files) >= 2:
+            top_score = sorted_files[0][1]
+            second_file_url, second_file_score = sorted_files[1]
+            if second_file_score >= (top_score * 0.65): # 閾値は0.65
+                selected_files.append(second_file_url)
+            else:
+                logger.debug(
+                    "Second %s file (%s) score (%s) is too low compared to top (%s).",
+                    label, second_file_url, second_file_score, top_score,
+                )
+        return selected_files
+
+    def _record_faiss_hits(self, span, distances, indices):
+        span['hits'] = [
+            {'index': int(idx), 'distance': round(float(distance), 4)}
+            for idx, distance in zip(indices[0], distances[0])
+        ]
+
+    def _valid_chunk_ids(self, bundle, indices):
+        return [int(idx) for idx in indices[0] if 0 <= idx < len(bundle.vector_store.metadata)]
+
+    def _retrieve_faiss_ranking(self, trace, bundle, query, chat_history, k):
+        """
+        クエリをEmbeddingしてFAISS検索する。戻り値は (近い順のチャンクIDのリスト, クエリのEmbedding)。
+        エラー時は空のリストと、Embeddingを取得できていればそのEmbedding (取得前のエラーならNone)。
+        """
+        query_embedding = None
+        try:
+            # chat_historyを_get_embeddingに渡す
+            with trace.span('embedding'):
+                query_embedding = self._get_embedding(query, task_type="RETRIEVAL_QUERY", chat_history=chat_history)
+            query_embedding_np = np.array([query_embedding]).astype('float32')
+
+            with trace.span('faiss_search', k=k) as span:
+                distances, indices = self._search_index(bundle, query_embedding_np, k)
+                self._record_faiss_hits(span, distances, indices)
+            return self._valid_chunk_ids(bundle, indices), query_embedding
+        except Exception as e:
+            logger.warning("Error during FAISS chunk search: %s", e)
+            trace.set(faiss_error=repr(e))
+            return [], query_embedding
+
+    async def _retrieve_faiss_ranking_async(self, trace, bundle, query, chat_history, k):
+        """_retrieve_faiss_ranking の非同期版"""
+        query_embedding = None
+        try:
+            with trace.span('embedding'):
+                query_embedding = await self._get_embedding_async(query, task_type="RETRIEVAL_QUERY", chat_history=chat_history)
+            query_embedding_np = np.array([query_embedding]).astype('float32')
+
+            # FAISSの検索はGILを解放するため、別スレッドで実行してイベントループを塞がない
+            with trace.span('faiss_search', k=k) as span:
+                distances, indices = await asyncio.to_thread(self._search_index, bundle, query_embedding_np, k)
+                self._record_faiss_hits(span, distances, indices)
+            return self._valid_chunk_ids(bundle, indices), query_embedding
+        except asyncio.CancelledError:
+            trace.set(faiss_search='cancelled')
+            raise
+        except Exception as e:
+            logger.warning("Error during FAISS chunk search: %s", e)
+            trace.set(faiss_error=repr(e))
+            return [], query_embedding
 
+    def _lexical_search(self, trace, bundle, query, keywords, k):
+        """
+        BM25で質問文を検索し、スコア順のチャンクIDのリストを返す。
+        抽出したキーワードはクエリに足して、そのbi-gramの重みを強める。
+        """
+        lexical_query = " ".join([query] + list(keywords))
+        with trace.span('lexical_search', k=k) as span:
+            chunk_ids, scores = bundle.vector_store.lexical_index.search(lexical_query, k)
+            span['hits'] = [
+                {'index': chunk_id, 'score': round(score, 4)}
+                for chunk_id, score in zip(chunk_ids, scores)
+            ]
+        return chunk_ids
+
+    def _fuse_and_select(self, trace, bundle, lexical_ranking, faiss_ranking, k):
+        """
+        BM25とFAISSの順位をRRFで統合し、上位k件のチャンクが属するファイルごとにRRFスコアを合計して選ぶ。
+        戻り値は (選ばれたファイルのリスト, 統合した全候補の [(チャンクID, RRFスコア)])。
+        全候補はコンテキストに入れるセクションの優先度付けに使う。
+        """
+        with trace.span('rank_fusion') as span:
+            fused = reciprocal_rank_fusion([lexical_ranking, faiss_ranking])
+            file_scores = {}
+            for chunk_id, score in fused[:k]:
+                source_file = bundle.vector_store.metadata[chunk_id].source
+                file_scores[source_file] = file_scores.get(source_file, 0.0) + score
+            span['scores'] = {source: round(score, 5) for source, score in file_scores.items()}
+
+        if lexical_ranking and faiss_ranking:
+            trace.set(selection='hybrid')
+        elif lexical_ranking:
+            trace.set(selection='lexical')
+        elif faiss_ranking:
+            trace.set(selection='faiss')
+        return self._select_top_files(file_scores, 'hybrid-retrieved'), fused
+
+    def _lookup_documents(self, bundle, span, sources):
+        """情報源URLのリストから {情報源URL: ドキュメント情報} を作る。見つからないものは飛ばす"""
+        documents = {}
+        for file_source in sources:
+            try:
+                documents[file_source] = bundle.document_store.get(file_source)
             except Exception as e:
-                print(f"[VOTING] Error reading file {file_path}: {e}. Skipping this file.")
+                logger.warning("Error getting document %s: %s. Skipping this file.", file_source, e)
+                span.setdefault('skipped', []).append(file_source)
+        return documents
+
+    def _chunk_section(self, doc, chunk, sections_by_headings):
+        """
+        チャンクを含むセクションの番号を返す。見つからなければNone。
+        create_vector_db.py が保存したMarkdown上の位置 (offset) から二分探索で引き、
+        位置が無い古いメタデータや、ページが更新されて見出しが合わない場合は見出しの階層で照合する。
+        """
+        headings = chunk.headings
+        offset = chunk.offset
+        if offset is not None:
+            index = bisect.bisect_right(doc['section_starts'], offset[0]) - 1
+            if index >= 0 and doc['sections'][index]['headings'] == headings:
+                return index
+        indices = sections_by_headings.get(headings)
+        return indices[0] if indices else None
+
+    def _section_scores(self, bundle, documents, hit_chunks):
+        """
+        ヒットしたチャンクをドキュメントのセクションに対応付け、セクションごとにRRFスコアを合計する。
+        戻り値は {(情報源URL, セクション番号): スコア}。
+        """
+        sections_by_headings = {}
+        for source, doc in documents.items():
+            by_headings = sections_by_headings.setdefault(source, {})
+            for index, section in enumerate(doc['sections']):
+                by_headings.setdefault(section['headings'], []).append(index)
+        section_scores = {}
+        for chunk_id, score in hit_chunks:
+            chunk = bundle.vector_store.metadata[chunk_id]
+            doc = documents.get(chunk.source)
+            if doc is None:
                 continue
-        
-        if not combined_context_parts:
-            print("[VOTING] No valid files were processed for context.")
-            return "関連する情報を見つけることができませんでした。", []
-
-        full_context = "\n\n".join(combined_context_parts)
-
-        # --- デバッグ用: 生成されたMarkdownをファイルに保存 ---
-        debug_output_dir = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'debug_output'))
-        os.makedirs(debug_output_dir, exist_ok=True)
-        debug_file_path = os.path.join(debug_output_dir, 'last_context.md')
-        with open(debug_file_path, 'w', encoding='utf-8') as f:
-                f.write(full_context)
-        print(f"[VOTING] Debug: Combined Markdown context saved to {debug_file_path}")
-        # ---------------------------------------------------
-
-        # 7. 結合されたファイル全体で回答生成
-        print("[VOTING] Step 4: Generating answer with the combined full file context...")
-        
-        # チャット履歴を考慮したプロンプトは不要になるため削除
-        # チャット履歴を考慮したプロンプトは不要になるため削除
-        # chat_history_str = ""
-        # if chat_history:
-        #     chat_history_str = "\n".join([f"{'ユーザー' if i % 2 == 0 else 'アシスタント'}: {msg}" for i, msg in enumerate(chat_history)])
-        #     chat_history_str = f"これまでの会話履歴:\n{chat_history_str}\n"
-
-        prompt_file_path = os.path.join(BASE_DIR, 'prompts', 'rag_chat_prompt.txt')
-        with open(prompt_file_path, 'r', encoding='utf-8') as f:
-            prompt_template = f.read()
-        prompt = prompt_template.format(full_context=full_context, query=query)
-        
-        print(f"[VOTING] Prompt for generation (first 300 chars): {prompt[:300]}...")
+            index = self._chunk_section(doc, chunk, sections_by_headings[chunk.source])
+            if index is not None:
+                key = (chunk.source, index)
+                section_scores[key] = section_scores.get(key, 0.0) + score
+        return section_scores
+
+    def _previous_files(self, files_to_process, session):
+        """過去の質問で参照したドキュメントのうち、今回選ばれたファイルに含まれないもの"""
+        return [source for source in session.previous_source_documents if source not in files_to_process]
+
+    def _prepare_answer_prompt(self, trace, bundle, query, files_to_process, hit_chunks, session):
+        """
+        選ばれたファイルと過去の参照ドキュメントから、トークン数の上限に収まるコンテキストを組み立てる。
+        hit_chunks: 検索でヒットしたチャンクの [(チャンクID, スコア)]。
+        戻り値は (回答生成用プロンプト, 使用した情報源のリスト)。コンテキストが作れなければNone。
+        """
+        previous_files = self._previous_files(files_to_process, session)
+        trace.set(files=files_to_process, previous_files=previous_files)
+
+        if not files_to_process and not previous_files:
+            logger.debug("No relevant files found after all search attempts.")
+            return None
+
+        with trace.span('document_lookup') as span:
+            documents = self._lookup_documents(bundle, span, files_to_process)
+            previous_documents = self._lookup_documents(bundle, span, previous_files)
+
+        with trace.span('context_assembly', mode=self.context_assembler.mode, budget=self.context_assembler.budget_tokens) as span:
+            section_scores = self._section_scores(bundle, documents, hit_chunks[:CONTEXT_HIT_CHUNKS])
+            context = self.context_assembler.assemble(documents, section_scores, previous_documents)
+            span.update(context.to_dict())
+
+        if not context.sources:
+            logger.debug("No valid files were processed for context.")
+            return None
+
+        full_context = context.text
+        trace.set(context_chars=len(full_context), context_tokens=context.tokens)
+        # デバッグ用: 有効な場合のみ、結合したコンテキストをリクエストごとのファイルに保存
+        trace.dump_context(full_context)
+
+        prompt = self.rag_chat_prompt_template.format(full_context=full_context, query=query)
+        trace.set(prompt_chars=len(prompt))
+        return prompt, context.sources
+
+    def _get_cache_embedding(self, trace, query, chat_history=None, query_embedding=None):
+        """
+        回答キャッシュのキーにする、チャット履歴を含まない質問だけのEmbedding。失敗時はNone。
+        チャット履歴が無ければ検索に使ったEmbedding (query_embedding) と同じテキストなので、APIを呼ばずにそれを使う。
+        """
+        if self.answer_cache is None:
+            return None
+        if not chat_history and query_embedding is not None:
+            trace.set(cache_embedding='reused')
+            return query_embedding
+        try:
+            with trace.span('cache_embedding'):
+                return self._get_embedding(query, task_type="RETRIEVAL_QUERY", max_retries=0)
+        except Exception as e:
+            logger.warning("Failed to get embedding for answer cache: %s", e)
+            return None
+
+    async def _get_cache_embedding_async(self, trace, query):
+        """_get_cache_embedding の非同期版"""
+        if self.answer_cache is None:
+            return None
         try:
-            model = genai.GenerativeModel(GENERATION_MODEL)
-            response = model.generate_content(prompt)
-            final_answer = response.text
-            print("[VOTING] Successfully generated the final_answer.")
-            self.previous_source_documents = list(set(source_documents_used)) # 今回使用した情報源を記憶
-            return final_answer, list(set(source_documents_used))
+            with trace.span('cache_embedding'):
+                return await self._get_embedding_async(query, task_type="RETRIEVAL_QUERY", max_retries=0)
         except Exception as e:
-            print(f"[VOTING] Error during final answer generation: {e}")
-            return f"最終的な回答の生成中にエラーが発生しました: {e}", list(set(source_documents_used))
+            logger.warning("Failed to get embedding for answer cache: %s", e)
+            return None
+
+    def _cache_sources(self, files_to_process, session):
+        """回答キャッシュのキーにする情報源: コンテキストの組み立てに渡す、選ばれたファイルと過去の参照ドキュメント"""
+        return list(files_to_process) + self._previous_files(files_to_process, session)
+
+    def _lookup_cached_answer(self, trace, bundle, cache_vector, cache_sources):
+        """
+        コンテキストの組み立てに渡す情報源 (cache_sources) の集合が同じで、質問のEmbedding (cache_vector) が
+        類似度の閾値以上の回答が、今の版 (bundle.cache_version) のキャッシュにあれば返す。
+        組み立てと生成を省くため、情報源の中で選ばれるセクションが前回と違っても同じ回答を返す。
+        回答キャッシュが無効、Embeddingが取れなかった、または情報源が無い場合は照合しない。
+        戻り値は (回答, 使用した情報源のリスト)。ヒットしなければNone。
+        """
+        if self.answer_cache is None or cache_vector is None or not cache_sources:
+            return None
+        cached = self.answer_cache.lookup(cache_vector, cache_sources, bundle.cache_version)
+        if cached is None:
+            trace.set(answer_cache='miss')
+            return None
+        trace.set(answer_cache='hit', answer_cache_similarity=round(cached['similarity'], 4))
+        return cached['answer'], cached['sources']
+
+    def _store_cached_answer(self, bundle, cache_vector, cache_sources, answer, source_documents_used):
+        if self.answer_cache is None or cache_vector is None:
+            return
+        self.answer_cache.store(cache_vector, cache_sources, answer, bundle.cache_version,
+                                sources=source_documents_used)
+
+    def _generation_error_result(self, trace, error, source_documents_used):
+        logger.warning("Error during final answer generation: %s", error)
+        trace.set(generation_error=repr(error))
+        return f"最終的な回答の生成中にエラーが発生しました: {error}", source_documents_used
+
+    def process_chat_query(self, query, chat_history=None, k=5, session=None):
+        """
+        チャットクエリを処理し、回答と情報源を返す。
+        session: 会話状態 (ChatSession)。省略時は過去の情報源を引き継がない新しい会話として扱う。
+        """
+        session = session if session is not None else self.new_session()
+        bundle = self._current_bundle()
+        trace = self.tracer.start(query)
+        trace.set(vector_store_version=bundle.version)
+        try:
+            return self._process_chat_query(trace, bundle, query, chat_history, k, session)
+        except Exception as e:
+            trace.set(error=repr(e))
+            raise
+        finally:
+            trace.finish()
+
+    def _extract_keywords_locally_traced(self, trace, bundle, query):
+        with trace.span('keyword_extraction', extractor='local') as span:
+            keywords = self._extract_keywords_locally(bundle, query)
+            span['keywords'] = keywords
+        return keywords
+
+    def _select_files(self, trace, bundle, query, chat_history, k):
+        """
+        BM25 (文字bi-gram) とFAISSのハイブリッド検索で、コンテキストに使うファイルを選ぶ。
+        BM25のクエリには、質問文に含まれる見出し語 (無ければ、有効な場合はLLMで抽出したキーワード) を足す。
+        戻り値は (選ばれたファイルのリスト, 統合した全候補, クエリのEmbeddingまたはNone)。
+        """
+        keywords = self._extract_keywords(trace, bundle, query)
+        candidates = max(k, HYBRID_CANDIDATES)
+        lexical_ranking = self._lexical_search(trace, bundle, query, keywords, candidates)
+        faiss_ranking, query_embedding = self._retrieve_faiss_ranking(trace, bundle, query, chat_history, candidates)
+        files_to_process, hit_chunks = self._fuse_and_select(trace, bundle, lexical_ranking, faiss_ranking, k)
+        return files_to_process, hit_chunks, query_embedding
+
+    def _extract_keywords(self, trace, bundle, query):
+        """質問文に含まれる見出し語。無ければ、有効な場合はLLMで抽出したキーワード"""
+        keywords = self._extract_keywords_locally_traced(trace, bundle, query)
+        if not keywords and self.keyword_llm_fallback:
+            with trace.span('keyword_extraction', extractor='llm') as span:
+                keywords = self._extract_keywords_with_llm(query)
+                span['keywords'] = keywords
+        return keywords
+
+    def _plan_query_threaded(self, trace, bundle, query, chat_history, k):
+        """
+        _plan_query_async と同じ並行処理を、同期版のAPI呼び出しとスレッドで行う。
+        Embedding+FAISS検索 (とチャット履歴がある場合は回答キャッシュ用のEmbedding) を別スレッドで先に開始し、
+        その間にキーワード抽出とBM25検索を行う。イベントループを作らないため、非同期クライアントが
+        最初のイベントループに結び付くプロバイダーでも、何度でも呼べる。戻り値は _plan_query_async と同じ。
+        """
+        candidates = max(k, HYBRID_CANDIDATES)
+        retrieval = self._plan_executor.submit(self._retrieve_faiss_ranking, trace, bundle, query, chat_history, candidates)
+        cache_embedding = None
+        if chat_history and self.answer_cache is not None:
+            cache_embedding = self._plan_executor.submit(self._get_cache_embedding, trace, query)
+        try:
+            keywords = self._extract_keywords(trace, bundle, query)
+            lexical_ranking = self._lexical_search(trace, bundle, query, keywords, candidates)
+        finally:
+            faiss_ranking, query_embedding = retrieval.result()
+            cache_vector = cache_embedding.result() if cache_embedding is not None else None
+        files_to_process, hit_chunks = self._fuse_and_select(trace, bundle, lexical_ranking, faiss_ranking, k)
+        if cache_embedding is None:
+            cache_vector = self._get_cache_embedding(trace, query, chat_history, query_embedding)
+        return files_to_process, hit_chunks, cache_vector
+
+    def _process_chat_query(self, trace, bundle, query, chat_history, k, session):
+        # 1. BM25とFAISSのハイブリッド検索でファイルを選定
+        files_to_process, hit_chunks, query_embedding = self._select_files(trace, bundle, query, chat_history, k)
+
+        # 2. 情報源が同じで似た質問の回答があれば、コンテキストの組み立てと生成を省略する
+        cache_vector = self._get_cache_embedding(trace, query, chat_history, query_embedding)
+        cache_sources = self._cache_sources(files_to_process, session)
+        cached = self._lookup_cached_answer(trace, bundle, cache_vector, cache_sources)
+        if cached is not None:
+            cached_answer, source_documents_used = cached
+            session.remember_sources(source_documents_used)
+            return cached_answer, source_documents_used
+
+        # 3. 選ばれたファイルのうち、ヒットしたセクションを中心にコンテキストを組み立てて回答生成
+        prepared = self._prepare_answer_prompt(trace, bundle, query, files_to_process, hit_chunks, session)
+        if prepared is None:
+            return NO_RESULT_MESSAGE, []
+        prompt, source_documents_used = prepared
+
+        try:
+            with trace.span('generation'):
+                final_answer = self._generate_answer(prompt)
+            session.remember_sources(source_documents_used) # 今回使用した情報源を記憶
+            self._store_cached_answer(bundle, cache_vector, cache_sources, final_answer, source_documents_used)
+            return final_answer, source_documents_used
+        except Exception as e:
+            return self._generation_error_result(trace, e, source_documents_used)
+
+    async def process_chat_query_async(self, query, chat_history=None, k=5, session=None):
+        """
+        process_chat_query の非同期版。
+        Embedding+FAISS検索と、LLMでのキーワード抽出 (有効な場合) や回答キャッシュ用のEmbeddingを
+        並行して行い、APIの往復をクリティカルパスから除ける。
+        """
+        session = session if session is not None else self.new_session()
+        if not self._loaded:
+            # ロードはファイルの読み込みが中心のため、別スレッドで行ってイベントループを塞がない
+            await asyncio.to_thread(self._ensure_loaded)
+        bundle = self._current_bundle()
+        trace = self.tracer.start(query)
+        trace.set(mode='async', vector_store_version=bundle.version)
+        try:
+            return await self._process_chat_query_async(trace, bundle, query, chat_history, k, session)
+        except Exception as e:
+            trace.set(error=repr(e))
+            raise
+        finally:
+            trace.finish()
+
+    async def _process_chat_query_async(self, trace, bundle, query, chat_history, k, session):
+        files_to_process, hit_chunks, cache_vector = await self._plan_query_async(trace, bundle, query, chat_history, k)
+
+        cache_sources = self._cache_sources(files_to_process, session)
+        cached = self._lookup_cached_answer(trace, bundle, cache_vector, cache_sources)
+        if cached is not None:
+            cached_answer, source_documents_used = cached
+            session.remember_sources(source_documents_used)
+            return cached_answer, source_documents_used
+
+        prepared = self._prepare_answer_prompt(trace, bundle, query, files_to_process, hit_chunks, session)
+        if prepared is None:
+            return NO_RESULT_MESSAGE, []
+        prompt, source_documents_used = prepared
+
+        try:
+            with trace.span('generation'):
+                final_answer = await self._generate_answer_async(prompt)
+            session.remember_sources(source_documents_used) # 今回使用した情報源を記憶
+            self._store_cached_answer(bundle, cache_vector, cache_sources, final_answer, source_documents_used)
+            return final_answer, source_documents_used
+        except Exception as e:
+            return self._generation_error_result(trace, e, source_documents_used)
+
+    async def _plan_query_async(self, trace, bundle, query, chat_history, k):
+        """
+        ファイル選定と、回答キャッシュ用の質問Embeddingを並行して行う。
+        チャット履歴が無い場合は、検索に使ったEmbeddingをそのままキャッシュにも使う
+        (取得できなかった場合だけ、改めてキャッシュ用に取得する)。
+        戻り値は (選ばれたファイルのリスト, ヒットしたチャンク, キャッシュ用のEmbeddingまたはNone)。
+        """
+        if not chat_history:
+            files_to_process, hit_chunks, query_embedding = await self._select_files_async(trace, bundle, query, chat_history, k)
+            if query_embedding is not None:
+                return files_to_process, hit_chunks, self._get_cache_embedding(trace, query, chat_history, query_embedding)
+            return files_to_process, hit_chunks, await self._get_cache_embedding_async(trace, query)
+
+        cache_task = asyncio.create_task(self._get_cache_embedding_async(trace, query))
+        try:
+            files_to_process, hit_chunks, _ = await self._select_files_async(trace, bundle, query, chat_history, k)
+            cache_vector = await cache_task
+        finally:
+            if not cache_task.done():
+                cache_task.cancel()
+                try:
+                    await cache_task
+                except asyncio.CancelledError:
+                    pass
+        return files_to_process, hit_chunks, cache_vector
+
+    async def _select_files_async(self, trace, bundle, query, chat_history, k):
+        """
+        _select_files の非同期版。
+        Embedding+FAISS検索を先に開始し、その間にキーワード抽出とBM25検索を行う。
+        戻り値は _select_files と同じ。
+        """
+        candidates = max(k, HYBRID_CANDIDATES)
+        retrieval_task = asyncio.create_task(self._retrieve_faiss_ranking_async(trace, bundle, query, chat_history, candidates))
+        try:
+            keywords = self._extract_keywords_locally_traced(trace, bundle, query)
+            if not keywords and self.keyword_llm_fallback:
+                with trace.span('keyword_extraction', extractor='llm') as span:
+                    keywords = await self._extract_keywords_with_llm_async(query)
+                    span['keywords'] = keywords
+            lexical_ranking = self._lexical_search(trace, bundle, query, keywords, candidates)
+            faiss_ranking, query_embedding = await retrieval_task
+        finally:
+            # 例外で抜ける場合はFAISS検索を取り消す
+            if not retrieval_task.done():
+                retrieval_task.cancel()
+                try:
+                    await retrieval_task
+                except asyncio.CancelledError:
+                    pass
+        files_to_process, hit_chunks = self._fuse_and_select(trace, bundle, lexical_ranking, faiss_ranking, k)
+        return files_to_process, hit_chunks, query_embedding
+
+    def stream_chat_query(self, query, chat_history=None, k=5, session=None):
+        """
+        チャットクエリを処理し、回答をストリーミングで返すジェネレーター。
+        最初に使用する情報源のリストをyieldし、その後は回答テキストの断片を生成された順にyieldする。
+        ファイル選定では、process_chat_query_async と同じくAPI呼び出しを並行して行う (スレッドで行うため、
+        リクエストごとにイベントループを作らない)。
+        """
+        session = session if session is not None else self.new_session()
+        bundle = self._current_bundle()
+        trace = self.tracer.start(query)
+        trace.set(mode='stream', vector_store_version=bundle.version)
+        try:
+            files_to_process, hit_chunks, cache_vector = self._plan_query_threaded(trace, bundle, query, chat_history, k)
+            cache_sources = self._cache_sources(files_to_process, session)
+            cached = self._lookup_cached_answer(trace, bundle, cache_vector, cache_sources)
+            if cached is not None:
+                cached_answer, source_documents_used = cached
+                session.remember_sources(source_documents_used)
+                yield source_documents_used
+                trace.set(first_token_ms=round(trace.elapsed_ms(), 3))
+                yield cached_answer
+                return
+
+            prepared = self._prepare_answer_prompt(trace, bundle, query, files_to_process, hit_chunks, session)
+            if prepared is None:
+                yield []
+                yield NO_RESULT_MESSAGE
+                return
+            prompt, source_documents_used = prepared
+            yield source_documents_used
+
+            try:
+                with trace.span('generation') as span:
+                    answer_parts = []
+                    for text in self._generate_answer_stream(prompt):
+                        if not answer_parts:
+                            trace.set(first_token_ms=round(trace.elapsed_ms(), 3))
+                        answer_parts.append(text)
+                        yield text
+                    span['answer_chars'] = sum(len(part) for part in answer_parts)
+                session.remember_sources(source_documents_used) # 今回使用した情報源を記憶
+                self._store_cached_answer(bundle, cache_vector, cache_sources, "".join(answer_parts), source_documents_used)
+            except Exception as e:
+                error_message, _ = self._generation_error_result(trace, e, source_documents_used)
+                yield error_message
+        except GeneratorExit:
+            trace.set(stream='closed_by_consumer')
+            raise
+        except Exception as e:
+            trace.set(error=repr(e))
+            raise
+        finally:
+            trace.finish()
 
 if __name__ == '__main__':
     # 新しいチャットベースのRAGシステムをテストする
     try:
         rag_chat_system = RAGChatSystem()
+        session = rag_chat_system.new_session()
         
         print(f"\n--- Testing new chat flow ---")
         
@@ -337,7 +869,7 @@ if __name__ == '__main__':
         query1 = "学費はいくらですか？"
         chat_history1 = []
         print(f"User Query 1: {query1}")
-        answer1, sources1 = rag_chat_system.process_chat_query(query1, chat_history1)
+        answer1, sources1 = rag_chat_system.process_chat_query(query1, chat_history1, session=session)
         print("\n--- Answer 1 ---")
         print(f"Answer: {answer1}")
         print(f"Source Documents: {sources1}")
@@ -348,7 +880,7 @@ if __name__ == '__main__':
         # Streamlitのst.session_state.messagesの形式を模倣
         chat_history2 = [{"role": "user", "content": query1}, {"role": "assistant", "content": answer1}] 
         print(f"User Query 2: {query2}")
-        answer2, sources2 = rag_chat_system.process_chat_query(query2, chat_history2)
+        answer2, sources2 = rag_chat_system.process_chat_query(query2, chat_history2, session=session)
         print("\n--- Answer 2 ---")
         print(f"Answer: {answer2}")
         print(f"Source Documents: {sources2}")
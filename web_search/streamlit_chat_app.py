@@ -26,6 +26,10 @@ st.write("在学生（学2課程）向けの情報に特化したチャットbot
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# 会話状態はセッションごとに持ち、共有のRAGChatSystemには持たせない
+if "rag_session" not in st.session_state:
+    st.session_state.rag_session = rag_chat_system.new_session()
+
 # 過去のメッセージを表示
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -52,7 +56,9 @@ if prompt := st.chat_input("質問を入力してください..."):
                 for msg in st.session_state.messages:
                     chat_history_for_rag.append({"role": msg["role"], "content": msg["content"]})
 
-                final_answer, source_documents_used = rag_chat_system.process_chat_query(prompt, chat_history=chat_history_for_rag)
+                final_answer, source_documents_used = rag_chat_system.process_chat_query(
+                    prompt, chat_history=chat_history_for_rag, session=st.session_state.rag_session
+                )
                 st.markdown(final_answer)
 
             except Exception as e:
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from logging.handlers import QueueListener, RotatingFileHandler
+
+# --- 定数 ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEBUG_OUTPUT_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'data', 'debug_output'))
+TRACE_LOG_PATH = os.getenv('RAG_TRACE_PATH', os.path.join(DEBUG_OUTPUT_DIR, 'traces', 'rag_trace.jsonl'))
+CONTEXT_DUMP_DIR = os.path.join(DEBUG_OUTPUT_DIR, 'contexts')
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUP_COUNT = 3
+TRACE_QUEUE_SIZE = 10000
+
+
+def env_flag(name, default):
+    """環境変数を真偽値として読む (1/true/yes/on が真)。未設定なら default"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class JsonlTraceSink:
+    """
+    トレースをJSONL形式でファイルに書き出すシンク。
+    書き込みはバックグラウンドスレッド (QueueListener) が行い、ファイルはサイズでローテーションする。
+    """
+
+    def __init__(self, path, max_bytes=TRACE_MAX_BYTES, backup_count=TRACE_BACKUP_COUNT):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.listener = QueueListener(self.queue, handler)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        """トレース1件 (辞書) をキューに積む。キューが溢れた場合は捨てて件数だけ数える"""
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        try:
+            self.queue.put_nowait(logging.makeLogRecord({'msg': line}))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+# 同じファイルに複数のシンクが書き込んでローテーションが衝突しないよう、パスごとに1つだけ作る
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def get_trace_sink(path=TRACE_LOG_PATH):
+    with _sinks_lock:
+        sink = _sinks.get(path)
+        if sink is None:
+            sink = JsonlTraceSink(path)
+            _sinks[path] = sink
+        return sink
+
+
+class RequestTrace:
+    """1回のリクエストの処理ステージ (span) と属性を記録する"""
+
+    def __init__(self, tracer, query):
+        self.tracer = tracer
+        self.request_id = uuid.uuid4().hex[:16]
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self._start = time.perf_counter()
+        self.attributes = {'query': query}
+        self.spans = []
+
+    def elapsed_ms(self):
+        """リクエスト開始からの経過時間 (ミリ秒)"""
+        return (time.perf_counter() - self._start) * 1000
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """with文で囲んだ処理の所要時間を記録する。yieldされる辞書に属性を追加できる"""
+        record = {'name': name, 'start_ms': round(self.elapsed_ms(), 3)}
+        record.update(attributes)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = repr(e)
+            raise
+        finally:
+            record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self.spans.append(record)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def dump_context(self, full_context):
+        """コンテキストのダンプが有効な場合、リクエストIDごとのファイルに保存する"""
+        if not self.tracer.dump_context:
+            return None
+        os.makedirs(self.tracer.context_dump_dir, exist_ok=True)
+        path = os.path.join(self.tracer.context_dump_dir, f"{self.request_id}.md")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(full_context)
+        self.attributes['context_dump'] = path
+        return path
+
+    def finish(self):
+        """トレースを確定してシンクに送る"""
+        record = {
+            'request_id': self.request_id,
+            'started_at': self.started_at,
+            'duration_ms': round(self.elapsed_ms(), 3),
+        }
+        record.update(self.attributes)
+        record['spans'] = self.spans
+        self.tracer.emit(record)
+        return record
+
+
+class Tracer:
+    """
+    RAGChatSystemの処理ステージを計測するトレーサー。
+    enabled: トレースをJSONLに書き出すか (環境変数 RAG_TRACE_ENABLED、既定は有効)
+    dump_context: リクエストごとに結合コンテキストをMarkdownで保存するか (環境変数 RAG_DEBUG_CONTEXT_DUMP、既定は無効)
+    """
+
+    def __init__(self, path=TRACE_LOG_PATH, enabled=None, dump_context=None, context_dump_dir=CONTEXT_DUMP_DIR):
+        self.path = path
+        self.enabled = env_flag('RAG_TRACE_ENABLED', True) if enabled is None else enabled
+        self.dump_context = env_flag('RAG_DEBUG_CONTEXT_DUMP', False) if dump_context is None else dump_context
+        self.context_dump_dir = context_dump_dir
+        self.sink = get_trace_sink(path) if self.enabled else None
+
+    def start(self, query):
+        return RequestTrace(self, query)
+
+    def emit(self, record):
+        if self.sink is not None:
+            self.sink.emit(record)
@@ -0,0 +1,153 @@
+import os
+import json
+import math
+import logging
+import faiss
+import numpy as np
+
+# --- 定数 ---
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'sq8', 'pq')
+DEFAULT_INDEX_TYPE = 'flat'
+# IVF: クラスタ数は sqrt(N) の4倍を目安に、1クラスタあたり学習点が39点以上になるよう抑える
+IVF_POINTS_PER_CENTROID = 39
+IVF_NPROBE_RATIO = 0.25 # 検索時に見るクラスタの割合
+# HNSW
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+# SQ8/PQで refine=True の場合は、近似距離で候補を k × REFINE_K_FACTOR 件取り、元のベクトルとの正確な距離で並べ直す。
+# 並べ直しには元のベクトル (IndexFlat) を丸ごと持つ必要があり、量子化で減らしたメモリがflat以上に戻るため既定では使わない
+REFINE_K_FACTOR = 4
+PQ_DIMS_PER_SUBQUANTIZER = 8
+
+logger = logging.getLogger(__name__)
+
+
+def default_nlist(num_vectors):
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // IVF_POINTS_PER_CENTROID))
+
+
+def default_pq_nbits(num_vectors):
+    """PQの各サブ量子化器のビット数。学習点が少ないときは小さくする (最大8ビット)"""
+    return max(4, min(8, int(math.log2(max(num_vectors // IVF_POINTS_PER_CENTROID, 16)))))
+
+
+def build_index(vectors, index_type=DEFAULT_INDEX_TYPE, nlist=None, nprobe=None, hnsw_m=HNSW_M,
+                ef_search=HNSW_EF_SEARCH, refine=False, refine_k_factor=REFINE_K_FACTOR):
+    """
+    指定した種類のFAISSインデックスを作り、学習とベクトルの追加まで行う。
+    refine: sq8/pqで、元のベクトルとの正確な距離で並べ直す層 (IndexRefineFlat) を重ねるか。
+    戻り値は (インデックス, 設定の辞書)。設定はインデックスと一緒に保存し、ロード時の検索パラメータに使う。
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    num_vectors, dimension = vectors.shape
+    config = {'index_type': index_type, 'dimension': dimension, 'ntotal': num_vectors}
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dimension)
+    elif index_type == 'ivf':
+        nlist = nlist or default_nlist(num_vectors)
+        nprobe = nprobe or max(1, int(math.ceil(nlist * IVF_NPROBE_RATIO)))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, nlist)
+        config.update(nlist=nlist, nprobe=nprobe)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        config.update(hnsw_m=hnsw_m, ef_search=ef_search)
+    elif index_type in ('sq8', 'pq'):
+        if index_type == 'sq8':
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            if dimension % PQ_DIMS_PER_SUBQUANTIZER != 0:
+                raise ValueError(f"PQ requires the dimension ({dimension}) to be a multiple of {PQ_DIMS_PER_SUBQUANTIZER}.")
+            subquantizers = dimension // PQ_DIMS_PER_SUBQUANTIZER
+            nbits = default_pq_nbits(num_vectors)
+            index = faiss.IndexPQ(dimension, subquantizers, nbits)
+            config.update(pq_subquantizers=subquantizers, pq_nbits=nbits)
+        config.update(refine=refine)
+        if refine:
+            # 量子化したベクトルで候補を絞り、元のベクトル (IndexFlat) との正確な距離で並べ直す
+            index = faiss.IndexRefineFlat(index)
+            config.update(refine_k_factor=refine_k_factor)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}. Choose from {', '.join(INDEX_TYPES)}.")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, config)
+    return index, config
+
+
+def apply_search_params(index, config):
+    """保存しておいた設定から、検索時のパラメータ (nprobe, efSearch, k_factor) を設定する"""
+    index_type = config.get('index_type', DEFAULT_INDEX_TYPE)
+    if index_type == 'ivf':
+        faiss.extract_index_ivf(index).nprobe = config['nprobe']
+    elif index_type == 'hnsw':
+        index.hnsw.efSearch = config['ef_search']
+    elif index_type in ('sq8', 'pq') and 'refine_k_factor' in config:
+        # refine の項目が無い以前の設定は、常に IndexRefineFlat で作っていた
+        faiss.downcast_index(index).k_factor = config['refine_k_factor']
+
+
+def config_path_for(index_path):
+    """インデックスの設定ファイルのパス (faiss_index.bin -> faiss_index.json)"""
+    return os.path.splitext(index_path)[0] + '.json'
+
+
+def save_index(index, config, index_path):
+    faiss.write_index(index, index_path)
+    with open(config_path_for(index_path), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def read_index(index_path, mmap=False):
+    """
+    インデックスを読み込む。mmap=True の場合はファイルをメモリマップし、全体をコピーせずに開く
+    (同じマシンのワーカー間でページキャッシュを共有できる)。
+    IO_FLAG_MMAP はIVFの転置リストしかメモリマップしないため、IndexFlat・HNSW・SQ8/PQ (と IndexRefineFlat) のベクトルも
+    ファイルを直接指す IO_FLAG_MMAP_IFC で開く。メモリマップできない場合は通常の読み込みに戻す。
+    """
+    if mmap:
+        mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+        if mmap_flag is not None:
+            try:
+                index = faiss.read_index(index_path, mmap_flag)
+            except RuntimeError:
+                pass
+            else:
+                if is_memory_mapped(index_path) is False:
+                    logger.warning("%s was read into memory instead of being memory-mapped.", index_path)
+                return index
+    return faiss.read_index(index_path)
+
+
+def is_memory_mapped(path):
+    """
+    path のファイルがこのプロセスにメモリマップされているか (/proc/self/maps で確かめる)。
+    /proc の無い環境では確かめられないためNoneを返す。
+    """
+    try:
+        with open('/proc/self/maps', 'r', encoding='utf-8', errors='replace') as f:
+            maps = f.read()
+    except OSError:
+        return None
+    real_path = os.path.realpath(path)
+    return any(line.split(maxsplit=5)[5:] == [real_path] for line in maps.splitlines())
+
+
+def load_index(index_path, mmap=False):
+    """
+    インデックスと設定をロードする。戻り値は (インデックス, 設定の辞書)。
+    設定ファイルが無い場合は、以前の create_vector_db.py が作ったIndexFlatL2として扱う。
+    """
+    index = read_index(index_path, mmap=mmap)
+    config_path = config_path_for(index_path)
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    else:
+        config = {'index_type': DEFAULT_INDEX_TYPE, 'dimension': index.d, 'ntotal': index.ntotal}
+    apply_search_params(index, config)
+    return index, config
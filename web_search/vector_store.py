@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+
+# pagesからパッケージとして読み込まれる場合と、web_search内で直接実行される場合の両方に対応
+try:
+    from web_search.lexical_index import BM25Index
+    from web_search.chunk_store import ChunkStore, chunk_store_exists, chunk_store_paths
+except ImportError:
+    from lexical_index import BM25Index
+    from chunk_store import ChunkStore, chunk_store_exists, chunk_store_paths
+
+logger = logging.getLogger(__name__)
+
+# --- 定数 ---
+# ベクトルストアの版 (バンドル) は <ルート>/versions/<版>/ に置き、<ルート>/CURRENT に今使う版の名前を書く。
+# CURRENT が無い場合は、ルートの直下にファイルを置く以前の形式 (legacy) として読む
+BUNDLE_FORMAT = 'vector-store-bundle-v1'
+CURRENT_FILE = 'CURRENT'
+VERSIONS_DIR = 'versions'
+STAGING_PREFIX = '.staging-'
+MANIFEST_FILE = 'manifest.json'
+FAISS_INDEX_FILE = 'faiss_index.bin'
+FAISS_CONFIG_FILE = 'faiss_index.json'
+METADATA_FILE = 'metadata.json'
+LEXICAL_INDEX_FILE = 'bm25_index.json'
+CHUNK_STORE_SUBDIR = 'chunks'
+# 公開するときに残しておく古い版の数 (動いているアプリがまだ読んでいる可能性があるため、すぐには消さない)
+KEEP_VERSIONS = 3
+
+
+def _import_vector_index():
+    """faissを読み込むvector_indexは、インデックスをロードするときに初めて読み込む"""
+    try:
+        from web_search import vector_index
+    except ImportError:
+        import vector_index
+    return vector_index
+
+
+def _file_fingerprint(*paths):
+    """ファイルの更新時刻とサイズから、内容が変わったことを検出するための識別子を作る"""
+    parts = []
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- バンドルの版の管理 ---
+
+def current_version(root):
+    """CURRENT に書かれた今の版の名前。バンドル形式でなければNone"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def bundle_dir(root, version):
+    return os.path.join(root, VERSIONS_DIR, version)
+
+
+def current_vector_store_dir(root):
+    """今の版のファイルがあるディレクトリ。バンドル形式でなければルート自体"""
+    version = current_version(root)
+    return bundle_dir(root, version) if version else root
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _bundle_files(directory):
+    """ディレクトリ内のファイルの相対パス (manifest.json を除く)"""
+    files = []
+    for dir_path, _dir_names, file_names in os.walk(directory):
+        for file_name in file_names:
+            relative_path = os.path.relpath(os.path.join(dir_path, file_name), directory).replace(os.sep, '/')
+            if relative_path != MANIFEST_FILE and not relative_path.endswith('.tmp'):
+                files.append(relative_path)
+    return sorted(files)
+
+
+def begin_bundle(root, base_dir=None):
+    """
+    新しい版を作るための作業ディレクトリを作る。base_dir を指定した場合はその中身をコピーしておく
+    (一部のファイルだけを作り直すとき用)。書き終わったら publish_bundle() で公開する。
+    """
+    staging_dir = os.path.join(root, VERSIONS_DIR, f"{STAGING_PREFIX}{uuid.uuid4().hex[:8]}")
+    os.makedirs(staging_dir)
+    if base_dir is not None:
+        for relative_path in _bundle_files(base_dir):
+            if relative_path.startswith(VERSIONS_DIR + '/') or relative_path == CURRENT_FILE:
+                continue
+            target = os.path.join(staging_dir, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(os.path.join(base_dir, relative_path), target)
+    return staging_dir
+
+
+def publish_bundle(root, staging_dir, **info):
+    """
+    作業ディレクトリにマニフェスト (infoの内容とファイルのチェックサム) を書いて版のディレクトリに移し、
+    CURRENT を書き換えて公開する。CURRENT は一時ファイルからの置き換えで更新するため、
+    読む側は常に古い版か新しい版のどちらかを完全な状態で見る。戻り値は新しい版の名前。
+    """
+    version = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        **info,
+        'files': {
+            relative_path: {
+                'size': os.path.getsize(os.path.join(staging_dir, relative_path)),
+                'sha256': file_checksum(os.path.join(staging_dir, relative_path)),
+            }
+            for relative_path in _bundle_files(staging_dir)
+        },
+    }
+    with open(os.path.join(staging_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.rename(staging_dir, bundle_dir(root, version))
+
+    current_path = os.path.join(root, CURRENT_FILE)
+    with open(current_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(current_path + '.tmp', current_path)
+    prune_bundles(root)
+    return version
+
+
+def prune_bundles(root, keep=KEEP_VERSIONS):
+    """今の版と、それより前の新しい順に keep 個を残して古い版を消す (作業中のディレクトリは消さない)"""
+    versions_root = os.path.join(root, VERSIONS_DIR)
+    current = current_version(root)
+    versions = sorted(
+        (name for name in os.listdir(versions_root) if not name.startswith(STAGING_PREFIX) and name != current),
+        reverse=True,
+    )
+    for name in versions[keep:]:
+        shutil.rmtree(os.path.join(versions_root, name), ignore_errors=True)
+
+
+def verify_bundle(directory):
+    """マニフェストに記録したファイルのサイズとチェックサムを確かめる。一致しなければValueError"""
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"Vector store bundle manifest not found or unsupported: {directory}")
+    for relative_path, expected in manifest['files'].items():
+        path = os.path.join(directory, relative_path)
+        if not os.path.exists(path) or os.path.getsize(path) != expected['size'] or file_checksum(path) != expected['sha256']:
+            raise ValueError(f"Vector store bundle file is missing or corrupted: {path}")
+    return manifest
+
+
+# --- ロード ---
+
+class VectorStore:
+    """
+    1つの版のベクトルストア (FAISSインデックス・チャンクストア・BM25インデックス)。
+    ロードした後は書き換えないため、クエリは開始時に参照を1つ取っておけば、
+    途中で新しい版に差し替えられても最後まで同じ版のインデックスとメタデータを使える。
+    """
+
+    def __init__(self, directory, version, index, index_config, metadata, lexical_index, manifest=None):
+        self.directory = directory
+        self.version = version
+        self.index = index
+        self.index_config = index_config
+        self.metadata = metadata
+        self.lexical_index = lexical_index
+        self.manifest = manifest
+
+    @classmethod
+    def load(cls, directory, version=None, mmap=False):
+        """
+        ディレクトリからロードする。version を省略した場合 (以前の形式) は、ファイルの更新時刻とサイズを版にする。
+        mmap=True ならFAISSのインデックスをメモリマップで開く。
+        """
+        logger.debug("Loading vector store from %s", directory)
+        faiss_index_path = os.path.join(directory, FAISS_INDEX_FILE)
+        metadata_path = os.path.join(directory, METADATA_FILE)
+        chunk_store_dir = os.path.join(directory, CHUNK_STORE_SUBDIR)
+        metadata_paths = chunk_store_paths(chunk_store_dir) if chunk_store_exists(chunk_store_dir) else [metadata_path]
+        if not os.path.exists(faiss_index_path) or not os.path.exists(metadata_paths[0]):
+            raise FileNotFoundError(
+                f"Vector store files not found. Please run create_vector_db.py first.\n"
+                f"Expected: {faiss_index_path} and {metadata_path}"
+            )
+        # インデックスの種類 (flat/ivf/hnsw/sq8/pq) と検索パラメータは一緒に保存された設定から復元する
+        index, index_config = _import_vector_index().load_index(faiss_index_path, mmap=mmap)
+        if metadata_paths[0] != metadata_path:
+            metadata = ChunkStore.load(chunk_store_dir)
+        else:
+            logger.info("Chunk store not found at %s. Loading %s.", chunk_store_dir, metadata_path)
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                metadata = ChunkStore.from_records(json.load(f))
+        logger.info("Loaded FAISS index (%s, dimension %d) with %d vectors and metadata for %d chunks.",
+                    index_config['index_type'], index.d, index.ntotal, len(metadata))
+        manifest = read_manifest(directory)
+        _check_vector_store(index, index_config, metadata, manifest)
+
+        lexical_index_path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        lexical_index = cls._load_lexical_index(lexical_index_path, metadata)
+        if version is None:
+            paths = [faiss_index_path, *metadata_paths]
+            for path in (os.path.join(directory, FAISS_CONFIG_FILE), lexical_index_path):
+                if os.path.exists(path):
+                    paths.append(path)
+            version = _file_fingerprint(*paths)
+        return cls(directory, version, index, index_config, metadata, lexical_index, manifest)
+
+    @staticmethod
+    def _load_lexical_index(path, metadata):
+        """create_vector_db.py が作ったBM25インデックスをロードする。無い・古い場合はメタデータから作る"""
+        if os.path.exists(path):
+            lexical_index = BM25Index.load(path)
+            if lexical_index.num_docs == len(metadata):
+                logger.info("Loaded BM25 index with %d terms.", len(lexical_index.postings))
+                return lexical_index
+            logger.warning("BM25 index does not match metadata. Rebuilding it in memory.")
+        else:
+            logger.info("BM25 index not found at %s. Building it in memory.", path)
+        return BM25Index.build(list(metadata.texts()))
+
+
+def _check_vector_store(index, index_config, metadata, manifest=None):
+    """
+    インデックスとメタデータが同じベクトルストアのものかを確かめる (検索を実行しない安価な検査)。
+    次元数が保存時の設定やマニフェストと違う、またはベクトル数とチャンク数が違う場合はValueError。
+    """
+    expected_dimension = index_config.get('dimension', index.d)
+    if manifest is not None:
+        expected_dimension = manifest.get('dimension', expected_dimension)
+    if index.d != expected_dimension:
+        raise ValueError(
+            f"FAISS index dimension {index.d} does not match its config ({expected_dimension}). "
+            f"Please rebuild the vector store with create_vector_db.py."
+        )
+    expected_chunks = manifest.get('num_chunks', len(metadata)) if manifest is not None else len(metadata)
+    if index.ntotal != len(metadata) or len(metadata) != expected_chunks:
+        raise ValueError(
+            f"FAISS index has {index.ntotal} vectors but metadata has {len(metadata)} chunks "
+            f"(manifest: {expected_chunks}). Please rebuild the vector store with create_vector_db.py."
+        )
+
+
+def load_vector_store(root, mmap=False, verify=False):
+    """
+    ルートから今の版のベクトルストアをロードする。verify=True ならマニフェストのチェックサムも確かめる
+    (バンドル形式の場合のみ)。
+    """
+    version = current_version(root)
+    if version is None:
+        return VectorStore.load(root, mmap=mmap)
+    directory = bundle_dir(root, version)
+    if verify:
+        verify_bundle(directory)
+    return VectorStore.load(directory, version=version, mmap=mmap)